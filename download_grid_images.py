@@ -1,28 +1,23 @@
 import os
 import csv
+import argparse
+from src.scraper.browser_pool import BrowserPool
+from src.scraper.georef import GeoReference, save_georefs
 from src.scraper.scrapers import GoogleMapsScraper, OpenStreetMapScraper
+from src.scraper.tiles import OSM_LAT_OFFSET, OSM_TILE_URL, MBTilesCache, TileFetcher, TileMapScraper
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
 
 GRID_CSV = 'warsaw_grid.csv'
 DATA_DIR = 'data'
+MAX_SESSIONS = 30  # Upper limit, the pool also fits the sessions into free memory
+TILE_CACHE = os.path.join('tiles', 'osm.mbtiles')
 
-# Thread-local storage for scraper instances
-thread_local = threading.local()
-
-def get_scrapers():
-    if not hasattr(thread_local, 'google_scraper'):
-        thread_local.google_scraper = GoogleMapsScraper(headless=True)
-    if not hasattr(thread_local, 'osm_scraper'):
-        thread_local.osm_scraper = OpenStreetMapScraper(headless=True)
-    return thread_local.google_scraper, thread_local.osm_scraper
-
-def process_cell(row):
+def process_cell(row, pool, osm_scraper=None, data_dir=DATA_DIR):
     cell_id = row['cell_id']
     lat = float(row['center_lat'])
     lon = float(row['center_lon'])
-    cell_dir = os.path.join(DATA_DIR, str(cell_id))
+    cell_dir = os.path.join(data_dir, str(cell_id))
     os.makedirs(cell_dir, exist_ok=True)
     gm_path = os.path.join(cell_dir, 'gm.png')
     osm_path = os.path.join(cell_dir, 'osm.png')
@@ -30,28 +25,84 @@ def process_cell(row):
     # Skip if already downloaded
     if os.path.exists(gm_path) and os.path.exists(osm_path):
         return f"Cell {cell_id}: images already exist, skipping."
-    google_scraper, osm_scraper = get_scrapers()
-    google_scraper.scrape((lat, lon), gm_path)
-    osm_scraper.scrape((lat - 0.000009*7.5, lon), osm_path)
+    # One browser session renders both maps of a cell
+    with pool.session() as session:
+        gm_georef = GoogleMapsScraper(driver=session.driver).scrape((lat, lon), gm_path)
+        if osm_scraper is None:
+            # The openstreetmap.org header hides the top of the map, so the browser
+            # view is shifted to line up with the Google Maps view
+            osm_georef = OpenStreetMapScraper(driver=session.driver).scrape((lat + OSM_LAT_OFFSET, lon), osm_path)
+    if osm_scraper is not None:
+        # Tile windows have no header and are centered on the cell itself
+        osm_scraper.scrape((lat, lon), osm_path)
+        window = osm_scraper.window((lat, lon))
+        osm_georef = GeoReference(osm_scraper.zoom, window[:2], osm_scraper.width, osm_scraper.height)
+    # Pixel to ground mapping of both captures, measured in the browser
+    save_georefs(cell_dir, {'gm.png': gm_georef, 'osm.png': osm_georef})
     with open(coords_path, 'w') as f:
         f.write(f'{{"latitude": {lat}, "longitude": {lon}}}')
     return f"Downloaded images for cell {cell_id} at ({lat}, {lon})"
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Download Google Maps and OSM images of the grid cells')
+    parser.add_argument('--grid', default=GRID_CSV,
+                        help=f'Grid CSV with cell_id, center_lat and center_lon, e.g. the output of '
+                             f'quadtree_grid (default: {GRID_CSV})')
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help=f'Base directory of the cell directories (default: {DATA_DIR})')
+    parser.add_argument('--osm-source', choices=['browser', 'tiles'], default='browser',
+                        help='Screenshot OSM in the browser or stitch it from XYZ tiles (default: browser)')
+    parser.add_argument('--tile-url', default=OSM_TILE_URL,
+                        help=f'Tile URL template for --osm-source tiles (default: {OSM_TILE_URL})')
+    parser.add_argument('--tile-cache', default=TILE_CACHE,
+                        help=f'MBTiles file caching downloaded tiles (default: {TILE_CACHE})')
+    parser.add_argument('--tile-rate', type=float, default=2.0,
+                        help='Maximum tile requests per second, 0 for no limit (default: 2)')
+    parser.add_argument('--tile-connections', type=int, default=2,
+                        help='Parallel tile connections (default: 2)')
+    return parser.parse_args()
+
 def main():
-    with open(GRID_CSV, newline='') as csvfile:
+    args = parse_args()
+    with open(args.grid, newline='') as csvfile:
         reader = csv.DictReader(csvfile)
         grid = list(reader)
 
-    max_workers = min(30, os.cpu_count())  # Adjust as needed
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_cell, row) for row in grid]
-        for f in tqdm(as_completed(futures), total=len(futures)):
-            try:
-                msg = f.result()
-                if msg:
-                    print(msg)
-            except Exception as e:
-                print(f"Error: {e}")
+    osm_scraper = None
+    if args.osm_source == 'tiles':
+        fetcher = TileFetcher(
+            MBTilesCache(args.tile_cache),
+            url_template=args.tile_url,
+            max_connections=args.tile_connections,
+            requests_per_second=args.tile_rate or None,
+        )
+        osm_scraper = TileMapScraper(fetcher)
+
+        # Tiles shared by neighbouring cells are downloaded once, before any cell needs them
+        tiles = {
+            tile
+            for row in grid
+            if not os.path.exists(os.path.join(args.data_dir, str(row['cell_id']), 'osm.png'))
+            for tile in osm_scraper.tiles((float(row['center_lat']), float(row['center_lon'])))
+        }
+        print(f"Fetching {len(tiles)} unique OSM tiles")
+        fetched = fetcher.prefetch(tiles, workers=args.tile_connections)
+        print(f"Downloaded {fetched} tiles, {len(tiles) - fetched} were cached in {args.tile_cache}")
+
+    with BrowserPool(headless=True, max_sessions=min(MAX_SESSIONS, os.cpu_count())) as pool:
+        print(f"Using {pool.max_sessions} browser sessions")
+        pool.preload()
+        with ThreadPoolExecutor(max_workers=pool.max_sessions) as executor:
+            futures = [
+                executor.submit(process_cell, row, pool, osm_scraper, args.data_dir) for row in grid
+            ]
+            for f in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    msg = f.result()
+                    if msg:
+                        print(msg)
+                except Exception as e:
+                    print(f"Error: {e}")
 
 if __name__ == '__main__':
     main()
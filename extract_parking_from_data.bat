@@ -3,14 +3,10 @@ setlocal enabledelayedexpansion
 
 echo Starting processing of cropped_gm.png files...
 
-for /r "data" %%f in (cropped_osm.png) do (
-    echo Processing: %%f
-    python src/preprocessing/parking_extractor.py "%%f"
-    if !errorlevel! neq 0 (
-        echo Error processing file: %%f
-    ) else (
-        echo Successfully processed: %%f
-    )
+rem Process all cropped_osm.png files in the data directory in one Python process
+python src/preprocessing/parking_extractor.py data --image-name cropped_osm.png %*
+if !errorlevel! neq 0 (
+    echo Error processing files in data
 )
 
 echo Processing complete.
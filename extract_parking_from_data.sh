@@ -3,16 +3,12 @@
 
 echo "Starting processing of gm.png files..."
 
-# Find all osm.png files recursively in data directory
-find "data" -name "osm.png" -type f | while read file; do
-    echo "Processing: $file"
-    python src/preprocessing/parking_extractor.py "$file"
-    
-    if [ $? -ne 0 ]; then
-        echo "Error processing file: $file"
-    else
-        echo "Successfully processed: $file"
-    fi
-done
+# Process all osm.png files in the data directory in one Python process;
+# masks newer than their image are skipped
+python src/preprocessing/parking_extractor.py data --image-name osm.png "$@"
+
+if [ $? -ne 0 ]; then
+    echo "Error processing files in data"
+fi
 
 echo "Processing complete."
\ No newline at end of file
@@ -1,5 +1,9 @@
 import csv
 
+import numpy as np
+
+from src.preprocessing.districts import DISTRICTS_GEOJSON, DistrictLookup
+
 # Warsaw bounding box (approximate)
 # Latitude: 52.0975 (south) to 52.3680 (north)
 # Longitude: 20.8512 (west) to 21.2712 (east)
@@ -12,26 +16,47 @@ LON_MAX = 21.2712
 LAT_STEP = 0.003  # ~330 m
 LON_STEP = 0.003  # ~220 m
 
+# Cells with a smaller part of their area inside the city are dropped
+# (0 keeps every cell touching the city)
+MIN_CITY_FRACTION = 0.0
+
 output_csv = 'warsaw_grid.csv'
 
-grid = []
-cell_id = 0
-lat = LAT_MIN
-while lat < LAT_MAX:
-    lon = LON_MIN
-    while lon < LON_MAX:
-        center_lat = lat + LAT_STEP / 2
-        center_lon = lon + LON_STEP / 2
-        grid.append({'cell_id': cell_id, 'center_lat': center_lat, 'center_lon': center_lon})
-        cell_id += 1
-        lon += LON_STEP
-    lat += LAT_STEP
-
-with open(output_csv, 'w', newline='') as csvfile:
-    fieldnames = ['cell_id', 'center_lat', 'center_lon']
+
+def grid_steps(start, stop, step):
+    """Return the starts of the grid steps in [start, stop), without float drift."""
+    count = int(np.ceil(round((stop - start) / step, 9)))
+    return start + step * np.arange(count)
+
+
+# Cell ids number the full bounding box grid row by row (south to north), so
+# a cell keeps its id (and data directory) however the grid is clipped
+lats = grid_steps(LAT_MIN, LAT_MAX, LAT_STEP)
+lons = grid_steps(LON_MIN, LON_MAX, LON_STEP)
+south, west = (a.ravel() for a in np.meshgrid(lats, lons, indexing='ij'))
+cell_ids = np.arange(len(south))
+center_lat = np.round(south + LAT_STEP / 2, 10)
+center_lon = np.round(west + LON_STEP / 2, 10)
+
+# Clip the grid to the city: district with the largest share of each cell and
+# the fraction of the cell inside the city
+lookup = DistrictLookup.from_file(DISTRICTS_GEOJSON)
+districts, city_fractions = lookup.covered_fractions(
+    np.column_stack([west, south, west + LON_STEP, south + LAT_STEP])
+)
+keep = (city_fractions > 0) & (city_fractions >= MIN_CITY_FRACTION)
+
+with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
+    fieldnames = ['cell_id', 'center_lat', 'center_lon', 'district', 'city_fraction']
     writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
     writer.writeheader()
-    for row in grid:
-        writer.writerow(row)
+    for i in np.flatnonzero(keep):
+        writer.writerow({
+            'cell_id': int(cell_ids[i]),
+            'center_lat': float(center_lat[i]),
+            'center_lon': float(center_lon[i]),
+            'district': districts[i],
+            'city_fraction': round(float(city_fractions[i]), 6),
+        })
 
-print(f"Generated {len(grid)} grid cells. Output: {output_csv}")
+print(f"Generated {int(keep.sum())} of {len(cell_ids)} grid cells inside the city. Output: {output_csv}")
@@ -1,38 +1,16 @@
 # pip install geopandas shapely requests
 
-import geopandas as gpd
-from shapely.geometry import Point
-import os
-import requests
+from src.preprocessing.districts import DISTRICTS_GEOJSON, DistrictLookup, load_districts
 
-url_geojson = "https://raw.githubusercontent.com/andilabs/warszawa-dzielnice-geojson/master/warszawa-dzielnice.geojson"
-local_folder = "data_districts"
-local_geojson = os.path.join(local_folder, "warszawa-dzielnice.geojson")
-
-# Ensure local folder exists
-os.makedirs(local_folder, exist_ok=True)
-
-# Download if not present
-if not os.path.isfile(local_geojson):
-    print("Downloading GeoJSON file...")
-    r = requests.get(url_geojson)
-    r.raise_for_status()
-    with open(local_geojson, "wb") as f:
-        f.write(r.content)
-    print("Downloaded.")
-
-gdf = gpd.read_file(local_geojson)
+gdf = load_districts(DISTRICTS_GEOJSON)
 
 print("CRS granic dzielnic:", gdf.crs)
 
-gdf = gdf[gdf["name"] != "Warszawa"].reset_index(drop=True)
+# Indeks dzielnic budowany raz, punkty sprawdzane wektorowo (DistrictLookup.lookup)
+lookup = DistrictLookup(gdf)
 
 def check_district(lat, lon):
-    punkt = Point(lon, lat)
-    for _, row in gdf.iterrows():
-        if row["geometry"].contains(punkt):
-            return row["name"]
-    return None
+    return lookup.lookup_one(lat, lon)
 
 test_points = [
     (52.2297, 21.0122),  # Śródmieście
@@ -40,8 +18,7 @@ test_points = [
     (52.4000, 21.2000),  # poza Warszawą
 ]
 
-for lat, lon in test_points:
-    district = check_district(lat, lon)
+for (lat, lon), district in zip(test_points, lookup.lookup(*zip(*test_points))):
     if district:
         print(f"Punkt ({lat:.4f}, {lon:.4f}) → dzielnica: {district}")
     else:
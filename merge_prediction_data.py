@@ -1,11 +1,36 @@
+import argparse
 import os
 import json
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from pathlib import Path
 import numpy as np
 
 DATA_DIR = 'data'
 OUTPUT_CSV = 'warsaw_predictions_merged.csv'
+OUTPUT_PARQUET = 'warsaw_predictions_merged.parquet'
+
+# Cache of the merged cells (file signatures and merged rows) in the data directory
+CACHE_VERSION = 2
+
+# Cells whose file signatures are taken by one thread task
+SIGNATURE_CHUNK = 512
+
+# Partition of cells outside every district in the partitioned dataset
+OUTSIDE_DISTRICT = 'outside'
+
+PRIORITY_COLS = ['cell_id', 'latitude', 'longitude', 'has_coords', 'has_prediction_stats',
+                 'has_images', 'total_detections', 'high_confidence_boxes', 'low_confidence_boxes',
+                 'mask_coverage_pct', 'high_conf_mask_coverage_pct', 'avg_confidence',
+                 'avg_mask_ratio']
+
+# Column types of the merged table; other numeric columns are float64
+BOOL_COLS = ['has_coords', 'has_prediction_stats', 'has_images']
+INTEGER_COLS = ['total_detections', 'high_confidence_boxes', 'low_confidence_boxes',
+                'high_conf_boxes_count', 'low_conf_boxes_count']
+INTEGER_PREFIXES = ('mask_ratio_distribution_', 'class_distribution_')
 
 def load_json_safe(file_path):
     """Safely load JSON file, return empty dict if file doesn't exist or is invalid."""
@@ -27,128 +52,350 @@ def flatten_dict(d, parent_key='', sep='_'):
             items.append((new_key, v))
     return dict(items)
 
-def main():
-    data_rows = []
-    
+def cache_path(data_dir, stats_file_name):
+    """Return the merge cache file of one stats file name."""
+    return os.path.join(data_dir, f".merge_{Path(stats_file_name).stem}.pkl")
+
+def list_cells(data_dir):
+    """Return the cell ids (subdirectory names) of the data directory, in cell id order."""
+    with os.scandir(data_dir) as entries:
+        cell_ids = [entry.name for entry in entries if entry.is_dir()]
+    cell_ids.sort(key=lambda x: (0, int(x), '') if x.isdigit() else (1, 0, x))
+    return cell_ids
+
+def cell_signatures(data_dir, cell_ids, stats_file_name):
+    """
+    Return what the merged row of each cell depends on: (size, mtime_ns) of
+    its coordinates and stats files (None when missing) and whether both
+    images exist.
+    """
+    signatures = []
+    for cell_id in cell_ids:
+        subdir = os.path.join(data_dir, cell_id)
+        signature = []
+        for name in ('coords.json', stats_file_name):
+            try:
+                stat = os.stat(os.path.join(subdir, name))
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        signature.append(
+            os.path.exists(os.path.join(subdir, 'gm.png'))
+            and os.path.exists(os.path.join(subdir, 'osm.png'))
+        )
+        signatures.append(tuple(signature))
+    return signatures
+
+def read_cell(subdir, stats_file_name):
+    """
+    Read the coordinates and prediction stats of one cell into a flat row.
+
+    Args:
+        subdir: Cell directory
+        stats_file_name: Name of the prediction stats JSON file in the cell
+
+    Returns:
+        dict: Merged row of the cell
+    """
+    coords_file = subdir / 'coords.json'
+    stats_file = subdir / stats_file_name
+
+    # Initialize row with cell_id
+    row = {'cell_id': subdir.name}
+
+    # Load coordinates
+    coords_data = load_json_safe(coords_file)
+    row['latitude'] = coords_data.get('latitude')
+    row['longitude'] = coords_data.get('longitude')
+
+    # Load prediction stats
+    stats_data = load_json_safe(stats_file)
+    if stats_data:
+        # Add parameters
+        parameters = stats_data.get('parameters', {})
+        for param_key, param_value in parameters.items():
+            row[f'param_{param_key}'] = param_value
+
+        # Flatten nested dictionaries (like mask_ratio_distribution, class_distribution)
+        row.update(flatten_dict(stats_data.get('stats', {})))
+
+        # Add counts and spreads of high/low confidence boxes
+        for prefix, key in (('high_conf', 'high_confidence_boxes'), ('low_conf', 'low_confidence_boxes')):
+            boxes = stats_data.get(key, [])
+            row[f'{prefix}_boxes_count'] = len(boxes)
+            if not boxes:
+                continue
+
+            confs = [box['conf'] for box in boxes if 'conf' in box]
+            mask_ratios = [box['mask_ratio'] for box in boxes if 'mask_ratio' in box]
+            if confs:
+                row[f'{prefix}_std_confidence'] = float(np.std(confs))
+            if mask_ratios:
+                row[f'{prefix}_std_mask_ratio'] = float(np.std(mask_ratios))
+
+    # Add file existence flags
+    row['has_coords'] = coords_file.exists()
+    row['has_prediction_stats'] = stats_file.exists()
+    row['has_images'] = (subdir / 'gm.png').exists() and (subdir / 'osm.png').exists()
+
+    return row
+
+def load_cache(path):
+    """
+    Load the merge cache: the merged rows indexed by cell id, with the file
+    signature and district of each cell. None if it is missing or outdated.
+    """
+    if os.path.exists(path):
+        try:
+            cache = pd.read_pickle(path)
+            if cache.attrs.get('version') == CACHE_VERSION:
+                return cache
+        except Exception as e:
+            print(f"Ignoring unreadable merge cache {path}: {e}")
+    return None
+
+def save_cache(path, cache):
+    """Write the merge cache atomically."""
+    cache.attrs['version'] = CACHE_VERSION
+    tmp_path = f"{path}.tmp"
+    cache.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+def to_frame(rows):
+    """
+    Build the typed merged table from cell rows.
+
+    Important columns come first, missing numbers are 0, counts are int64,
+    flags are bool, and cell ids and text values (e.g. param_model) are
+    strings.
+    """
+    df = pd.DataFrame(rows)
+    for col in PRIORITY_COLS:
+        if col not in df.columns:
+            df[col] = np.nan
+
+    # Reorder columns to put important ones first
+    remaining_cols = [col for col in df.columns if col not in PRIORITY_COLS]
+    df = df[PRIORITY_COLS + remaining_cols]
+
+    df['cell_id'] = df['cell_id'].astype(str)
+    df[BOOL_COLS] = df[BOOL_COLS].fillna(False).astype(bool)
+
+    value_cols = [col for col in df.columns if col not in ['cell_id'] + BOOL_COLS]
+    integer_cols = [col for col in value_cols
+                    if col in INTEGER_COLS or col.startswith(INTEGER_PREFIXES)]
+    text_cols = [col for col in value_cols
+                 if col not in PRIORITY_COLS and col not in integer_cols
+                 and not pd.api.types.is_numeric_dtype(df[col].infer_objects())]
+    numeric_cols = [col for col in value_cols if col not in text_cols]
+
+    df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors='coerce').fillna(0)
+    df[integer_cols] = df[integer_cols].astype(np.int64)
+    float_cols = [col for col in numeric_cols if col not in integer_cols]
+    df[float_cols] = df[float_cols].astype(np.float64)
+    df[text_cols] = df[text_cols].astype('string')
+    return df
+
+def write_parquet(df, output_parquet, partition_by_district=False):
+    """
+    Write the merged table as Parquet, optionally as a dataset partitioned by district.
+
+    The output is written next to the previous one and swapped in, so readers
+    never see a half written file.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError("Parquet output needs the pyarrow package") from e
+
+    tmp_path = f"{output_parquet}.tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+
+    if partition_by_district:
+        df.to_parquet(tmp_path, index=False, partition_cols=['district'])
+    else:
+        df.to_parquet(tmp_path, index=False)
+
+    if os.path.isdir(output_parquet):
+        shutil.rmtree(output_parquet)
+    elif os.path.exists(output_parquet) and os.path.isdir(tmp_path):
+        os.remove(output_parquet)
+    os.replace(tmp_path, output_parquet)
+
+def assign_districts(table):
+    """
+    Fill the missing districts of the merged cells (from their coordinates).
+
+    Only cells without a known district are looked up, so the district
+    polygons are not loaded at all when no coordinates changed.
+    """
+    missing = table['district'].isna()
+    if not missing.any():
+        return
+
+    # Imported here: the district lookup needs geopandas, used only for partitioning
+    from src.preprocessing.districts import DistrictLookup
+
+    districts = DistrictLookup.from_file().lookup(
+        table.loc[missing, 'latitude'], table.loc[missing, 'longitude']
+    )
+    table.loc[missing, 'district'] = [district or OUTSIDE_DISTRICT for district in districts]
+
+def main(data_dir=DATA_DIR, output_csv=OUTPUT_CSV, stats_file_name='prediction_stats.json', verbose=True,
+         output_parquet=OUTPUT_PARQUET, partition_by_district=False, workers=8, force=False):
+    """
+    Merge coordinates and prediction stats of all cells into one table.
+
+    Cells are read by a thread pool. A cache in the data directory keeps the
+    merged row and file signatures (size, mtime) of every cell, so a later
+    merge only reads the cells whose files changed.
+
+    Args:
+        data_dir: Directory with numbered cell subdirectories
+        output_csv: Path of the exported CSV file (None to skip the CSV export)
+        stats_file_name: Name of the prediction stats JSON file in each cell
+        verbose: Whether to print the first rows and the column list
+        output_parquet: Path of the merged Parquet file, a dataset directory
+            when partitioned by district (None to skip the Parquet output)
+        partition_by_district: Whether to partition the Parquet dataset by
+            district (cells outside the city go to "outside")
+        workers: Threads reading the cells
+        force: Re-read every cell, ignoring the merge cache
+    """
+    start = time.perf_counter()
+
     # Get all subdirectories in data folder
-    data_path = Path(DATA_DIR)
-    if not data_path.exists():
-        print(f"Error: {DATA_DIR} directory not found")
+    if not os.path.isdir(data_dir):
+        print(f"Error: {data_dir} directory not found")
         return
-    
-    subdirs = [d for d in data_path.iterdir() if d.is_dir()]
-    subdirs.sort(key=lambda x: int(x.name) if x.name.isdigit() else float('inf'))
-    
-    print(f"Processing {len(subdirs)} folders...")
-    
-    for subdir in subdirs:
-        cell_id = subdir.name
-        coords_file = subdir / 'coords.json'
-        stats_file = subdir / 'prediction_stats.json'
-        
-        # Initialize row with cell_id
-        row = {'cell_id': cell_id}
-        
-        # Load coordinates
-        coords_data = load_json_safe(coords_file)
-        if coords_data:
-            row['latitude'] = coords_data.get('latitude')
-            row['longitude'] = coords_data.get('longitude')
-        else:
-            row['latitude'] = None
-            row['longitude'] = None
-        
-        # Load prediction stats
-        stats_data = load_json_safe(stats_file)
-        if stats_data:
-            # Extract stats section
-            stats = stats_data.get('stats', {})
-            
-            # Flatten nested dictionaries (like mask_ratio_distribution, class_distribution)
-            flattened_stats = flatten_dict(stats)
-            
-            # Add parameters
-            parameters = stats_data.get('parameters', {})
-            for param_key, param_value in parameters.items():
-                row[f'param_{param_key}'] = param_value
-            
-            # Add all flattened stats
-            row.update(flattened_stats)
-            
-            # Add counts of high/low confidence boxes
-            high_conf_boxes = stats_data.get('high_confidence_boxes', [])
-            low_conf_boxes = stats_data.get('low_confidence_boxes', [])
-            
-            row['high_conf_boxes_count'] = len(high_conf_boxes)
-            row['low_conf_boxes_count'] = len(low_conf_boxes)
-            
-            # Calculate additional metrics if boxes exist
-            if high_conf_boxes:
-                high_confs = [box['conf'] for box in high_conf_boxes if 'conf' in box]
-                high_mask_ratios = [box['mask_ratio'] for box in high_conf_boxes if 'mask_ratio' in box]
-                
-                if high_confs:
-                    row['high_conf_std_confidence'] = np.std(high_confs)
-                if high_mask_ratios:
-                    row['high_conf_std_mask_ratio'] = np.std(high_mask_ratios)
-            
-            if low_conf_boxes:
-                low_confs = [box['conf'] for box in low_conf_boxes if 'conf' in box]
-                low_mask_ratios = [box['mask_ratio'] for box in low_conf_boxes if 'mask_ratio' in box]
-                
-                if low_confs:
-                    row['low_conf_std_confidence'] = np.std(low_confs)
-                if low_mask_ratios:
-                    row['low_conf_std_mask_ratio'] = np.std(low_mask_ratios)
-        
-        # Add file existence flags
-        row['has_coords'] = coords_file.exists()
-        row['has_prediction_stats'] = stats_file.exists()
-        row['has_images'] = (subdir / 'gm.png').exists() and (subdir / 'osm.png').exists()
-        
-        data_rows.append(row)
-    
+
+    cell_ids = list_cells(data_dir)
+    cache_file = cache_path(data_dir, stats_file_name)
+    cache = None if force else load_cache(cache_file)
+
+    print(f"Processing {len(cell_ids)} folders...")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        chunks = [cell_ids[i:i + SIGNATURE_CHUNK] for i in range(0, len(cell_ids), SIGNATURE_CHUNK)]
+        signatures = [
+            signature
+            for chunk in executor.map(
+                lambda chunk: cell_signatures(data_dir, chunk, stats_file_name), chunks
+            )
+            for signature in chunk
+        ]
+
+        previous = (
+            cache['signature'].reindex(cell_ids).tolist() if cache is not None
+            else [None] * len(cell_ids)
+        )
+        changed = [i for i, (old, new) in enumerate(zip(previous, signatures)) if old != new]
+        changed_rows = list(executor.map(
+            lambda i: read_cell(Path(data_dir) / cell_ids[i], stats_file_name), changed
+        ))
+
+    # Unchanged cells keep their rows from the cache, changed cells are
+    # replaced and removed cells dropped
+    table = cache.drop(index=[cell_ids[i] for i in changed], errors='ignore') if cache is not None else None
+    if changed_rows:
+        updated = to_frame(changed_rows).set_index('cell_id')
+        updated['signature'] = pd.Series([signatures[i] for i in changed], index=updated.index, dtype=object)
+        # A district stays valid while the coordinates file is unchanged
+        updated['district'] = [
+            cache.at[cell_ids[i], 'district']
+            if previous[i] is not None and previous[i][0] == signatures[i][0] else None
+            for i in changed
+        ]
+        table = updated if table is None else pd.concat([table, updated])
+    elif table is None:
+        table = to_frame([]).set_index('cell_id').assign(signature=None, district=None)
+    table = table.reindex(cell_ids)
+    table.index.name = 'cell_id'
+
+    missing_districts = partition_by_district and bool(output_parquet) and table['district'].isna().any()
+    if missing_districts:
+        assign_districts(table)
+
     # Create DataFrame
-    df = pd.DataFrame(data_rows)
-    
-    # Reorder columns to put important ones first
-    priority_cols = ['cell_id', 'latitude', 'longitude', 'has_coords', 'has_prediction_stats', 
-                     'has_images', 'total_detections', 'high_confidence_boxes', 'low_confidence_boxes',
-                     'mask_coverage_pct', 'high_conf_mask_coverage_pct', 'avg_confidence', 
-                     'avg_mask_ratio']
-    
-    # Get remaining columns
-    remaining_cols = [col for col in df.columns if col not in priority_cols]
-    
-    # Reorder
-    new_order = [col for col in priority_cols if col in df.columns] + remaining_cols
-    df = df[new_order]
-    
-    # Fill NaN values for numeric columns with 0, and object columns with empty string or appropriate defaults
-    numeric_columns = df.select_dtypes(include=[np.number]).columns
-    df[numeric_columns] = df[numeric_columns].fillna(0)
-    
+    df = to_frame(table.drop(columns=['signature', 'district']).reset_index())
+
+    if changed or missing_districts or cache is None or len(cache) != len(cell_ids):
+        save_cache(cache_file, df.set_index('cell_id').assign(
+            signature=table['signature'].to_numpy(), district=table['district'].to_numpy()
+        ))
+
+    if output_parquet:
+        if partition_by_district:
+            df['district'] = table['district'].to_numpy()
+        write_parquet(df, output_parquet, partition_by_district)
+        df = df.drop(columns='district', errors='ignore')
+
     # Save to CSV
-    df.to_csv(OUTPUT_CSV, index=False)
-    
+    if output_csv:
+        df.to_csv(output_csv, index=False)
+
     # Print summary
-    print(f"\nDataFrame created with {len(df)} rows and {len(df.columns)} columns")
-    print(f"Saved to: {OUTPUT_CSV}")
-    
+    print(f"\nDataFrame created with {len(df)} rows and {len(df.columns)} columns "
+          f"({len(changed)} folders read) in {time.perf_counter() - start:.2f}s")
+    for path in (output_parquet, output_csv):
+        if path:
+            print(f"Saved to: {path}")
+
     print(f"\nSummary:")
     print(f"- Folders with coordinates: {df['has_coords'].sum()}")
     print(f"- Folders with prediction stats: {df['has_prediction_stats'].sum()}")
     print(f"- Folders with images: {df['has_images'].sum()}")
     print(f"- Folders with detections > 0: {(df['total_detections'] > 0).sum()}")
-    
+
+    if not verbose:
+        return df
+
     print(f"\nFirst few rows:")
     print(df.head())
-    
+
     print(f"\nColumn list:")
     for i, col in enumerate(df.columns):
         print(f"{i+1:2d}. {col}")
-    
+
     return df
 
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Merge coordinates and prediction stats of all cells'
+    )
+    parser.add_argument('--data-dir', default=DATA_DIR,
+                        help=f'Directory with numbered cell subdirectories (default: {DATA_DIR})')
+    parser.add_argument('--stats-file', default='prediction_stats.json',
+                        help='Prediction stats file name in each cell (default: prediction_stats.json)')
+    parser.add_argument('--parquet', default=OUTPUT_PARQUET,
+                        help=f'Merged Parquet path (default: {OUTPUT_PARQUET})')
+    parser.add_argument('--no-parquet', action='store_true',
+                        help='Do not write the Parquet output')
+    parser.add_argument('--partition-by-district', action='store_true',
+                        help='Write the Parquet output as a dataset partitioned by district')
+    parser.add_argument('--csv', default=OUTPUT_CSV,
+                        help=f'Merged CSV path (default: {OUTPUT_CSV})')
+    parser.add_argument('--no-csv', action='store_true',
+                        help='Do not write the CSV output')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Threads reading the cells (default: 8)')
+    parser.add_argument('--force', action='store_true',
+                        help='Re-read every cell, ignoring the merge cache')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Do not print the first rows and the column list')
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    df = main()
+    args = parse_args()
+    df = main(
+        data_dir=args.data_dir,
+        output_csv=None if args.no_csv else args.csv,
+        stats_file_name=args.stats_file,
+        verbose=not args.quiet,
+        output_parquet=None if args.no_parquet else args.parquet,
+        partition_by_district=args.partition_by_district,
+        workers=args.workers,
+        force=args.force,
+    )
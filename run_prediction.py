@@ -2,45 +2,168 @@ import os
 import glob
 import sys
 import argparse
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import json
+import cv2
+import numpy as np
+import merge_prediction_data
+from src.predictor.export import (
+    BACKENDS,
+    compare_backends,
+    export_model,
+    sample_calibration_images,
+)
+from src.predictor.detections import Detections
+from src.predictor.mask_overlap import parking_region
 from src.predictor.predictor import Predictor
 from src.predictor.predictor import ModelClass
+from src.predictor.model_pool import get_model, weights_path
+from src.predictor.result_cache import ResultCache, config_digest, file_digest
 
 
-def process_directory(
-    dir_path, model_type=ModelClass.LARGE, mask_threshold=0.5, mask_low_confidence=0.1
+REQUIRED_FILES = ["gm.png", "osm.png", "osm_mask.png"]
+DETECTIONS_FILE = "detections.npz"
+OUTPUT_FILES = [
+    "visualization_gm.png",
+    "visualization_osm.png",
+    "prediction_stats.json",
+    DETECTIONS_FILE,
+]
+# Outputs of directories skipped without running the model
+SKIPPED_OUTPUT_FILES = ["prediction_stats.json", DETECTIONS_FILE]
+
+
+def load_model(model_type, predictor_options=None):
+    """Load (once per process) the model selected by the predictor options."""
+    predictor_options = predictor_options or {}
+    return get_model(
+        model_type,
+        fuse=True,
+        warmup=True,
+        backend=predictor_options.get("backend", "torch"),
+        int8=predictor_options.get("int8", False),
+    )
+
+
+def find_missing_inputs(dir_path):
+    """Return the names of required input files missing from a directory."""
+    return [f for f in REQUIRED_FILES if not os.path.exists(os.path.join(dir_path, f))]
+
+
+def save_outputs(predictor, dir_path, mask_threshold=0.5, mask_low_confidence=0.1):
+    """Write visualizations and prediction stats of a predicted directory."""
+
+    # Outputs are always rewritten, up-to-date directories are skipped by the cache
+    print(f"Creating visualization_gm.png in {dir_path}")
+    predictor.visualize(
+        mask_threshold=mask_threshold,
+        mask_low_confidence=mask_low_confidence,
+        visualization_type="gm",
+        save_path="visualization_gm.png",
+    )
+
+    print(f"Creating visualization_osm.png in {dir_path}")
+    predictor.visualize(
+        mask_threshold=mask_threshold,
+        mask_low_confidence=mask_low_confidence,
+        visualization_type="osm",
+        save_path="visualization_osm.png",
+    )
+
+    print(f"Creating prediction stats in {dir_path}")
+    predictor.summarize(
+        mask_threshold=mask_threshold,
+        mask_low_confidence=mask_low_confidence,
+        save=True,
+    )
+
+    # Keep raw detections so thresholds can be changed without re-running the model
+    predictor.save_detections(DETECTIONS_FILE)
+
+
+def skip_empty_masks(
+    dir_paths,
+    min_mask_area=0.0,
+    mask_threshold=0.5,
+    mask_low_confidence=0.1,
+    readers=4,
 ):
-    """Process a single data directory if output files don't exist."""
+    """
+    Write empty prediction stats for directories without (enough) parking.
 
-    # Define expected output files by exact name
-    vis_gm_path = os.path.join(dir_path, "visualization_gm.png")
-    vis_osm_path = os.path.join(dir_path, "visualization_osm.png")
+    The mask of every directory is read and measured; when the parking mask
+    covers at most `min_mask_area` of the frame, an empty but valid
+    prediction stats file and detections file are written without running
+    the model. Visualizations of an earlier prediction are removed, as they
+    would contradict the empty stats.
 
-    # Check for prediction stats files using wildcard pattern
-    stats_json_pattern = os.path.join(dir_path, "prediction_stats_*.json")
-    stats_txt_pattern = os.path.join(dir_path, "prediction_stats_*.txt")
+    Args:
+        min_mask_area (float): Max fraction of masked pixels to skip inference
 
-    # Check if output files already exist
-    # vis_gm_exists = os.path.exists(vis_gm_path)
-    # vis_osm_exists = os.path.exists(vis_osm_path)
+    Returns:
+        tuple: (directories that still need inference, skipped directories)
+    """
 
-    vis_gm_exists, vis_osm_exists = False, False # force to reprocess
+    def skip_directory(dir_path):
+        if find_missing_inputs(dir_path):
+            return False  # reported later by the inference stage
 
-    stats_json_exists = len(glob.glob(stats_json_pattern)) > 0
-    stats_txt_exists = len(glob.glob(stats_txt_pattern)) > 0
+        mask = cv2.imread(
+            os.path.join(dir_path, "osm_mask.png"), cv2.IMREAD_GRAYSCALE
+        )
+        if mask is None:
+            return False
 
-    # Skip directory if all outputs already exist
-    # if vis_gm_exists and vis_osm_exists and (stats_json_exists or stats_txt_exists):
-    #     print(f"Skipping {dir_path} - all outputs already exist")
-    # return False
+        mask_area, _ = parking_region(mask)
+        if mask_area > min_mask_area:
+            return False
+
+        predictor = Predictor(
+            img_data_folder=dir_path,
+            image_gm="gm.png",
+            image_osm="osm.png",
+            parking_mask="osm_mask.png",
+            model_type=None,
+        )
+        predictor.skip_prediction()
+        predictor.summarize(
+            mask_threshold=mask_threshold,
+            mask_low_confidence=mask_low_confidence,
+            save=True,
+            verbose=False,
+        )
+        predictor.save_detections(DETECTIONS_FILE)
+        for name in set(OUTPUT_FILES) - set(SKIPPED_OUTPUT_FILES):
+            if os.path.exists(os.path.join(dir_path, name)):
+                os.remove(os.path.join(dir_path, name))
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, readers)) as executor:
+        skipped = list(executor.map(skip_directory, dir_paths))
+
+    remaining_dirs = [d for d, skip in zip(dir_paths, skipped) if not skip]
+    skipped_dirs = [d for d, skip in zip(dir_paths, skipped) if skip]
+    return remaining_dirs, skipped_dirs
+
+
+def process_directory(
+    dir_path,
+    model_type=ModelClass.LARGE,
+    mask_threshold=0.5,
+    mask_low_confidence=0.1,
+    model=None,
+    predictor_options=None,
+):
+    """Process a single data directory if output files don't exist."""
 
     print(f"Processing {dir_path}...")
 
     try:
         # Check required input files exist
-        required_files = ["gm.png", "osm.png", "osm_mask.png"]
-        missing_files = [
-            f for f in required_files if not os.path.exists(os.path.join(dir_path, f))
-        ]
+        missing_files = find_missing_inputs(dir_path)
 
         if missing_files:
             print(
@@ -55,45 +178,14 @@ def process_directory(
             image_osm="osm.png",
             parking_mask="osm_mask.png",
             model_type=model_type,
+            model=model,
+            **(predictor_options or {}),
         )
 
         # Make predictions
         results = predictor.predict()
 
-        # Generate GM visualization if it doesn't exist
-        if not vis_gm_exists:
-            print(f"Creating visualization_gm.png in {dir_path}")
-            predictor.visualize(
-                mask_threshold=mask_threshold,
-                mask_low_confidence=mask_low_confidence,
-                visualization_type="gm",
-                save_path="visualization_gm.png",
-            )
-        else:
-            print(f"visualization_gm.png already exists in {dir_path}")
-
-        # Generate OSM visualization if it doesn't exist
-        if not vis_osm_exists:
-            print(f"Creating visualization_osm.png in {dir_path}")
-            predictor.visualize(
-                mask_threshold=mask_threshold,
-                mask_low_confidence=mask_low_confidence,
-                visualization_type="osm",
-                save_path="visualization_osm.png",
-            )
-        else:
-            print(f"visualization_osm.png already exists in {dir_path}")
-
-        # Generate summary statistics if they don't exist
-        if not stats_json_exists and not stats_txt_exists:
-            print(f"Creating prediction stats in {dir_path}")
-            predictor.summarize(
-                mask_threshold=mask_threshold,
-                mask_low_confidence=mask_low_confidence,
-                save=True,
-            )
-        else:
-            print(f"Prediction stats already exist in {dir_path}")
+        save_outputs(predictor, dir_path, mask_threshold, mask_low_confidence)
 
         print(f"Successfully processed {dir_path}")
         return True
@@ -103,6 +195,556 @@ def process_directory(
         return False
 
 
+def process_batch(
+    dir_paths,
+    model_type=ModelClass.LARGE,
+    mask_threshold=0.5,
+    mask_low_confidence=0.1,
+    model=None,
+    batch_size=8,
+    predictor_options=None,
+):
+    """
+    Process several data directories, running inference in batches.
+
+    Returns:
+        list: Successfully processed directories
+    """
+    ready_dirs = []
+    for dir_path in dir_paths:
+        missing_files = find_missing_inputs(dir_path)
+        if missing_files:
+            print(
+                f"Skipping {dir_path} - missing input files: {', '.join(missing_files)}"
+            )
+        else:
+            ready_dirs.append(dir_path)
+
+    processed_dirs = []
+    for start in range(0, len(ready_dirs), batch_size):
+        batch_dirs = ready_dirs[start : start + batch_size]
+        print(f"Processing batch of {len(batch_dirs)} directories...")
+
+        try:
+            predictors = list(
+                Predictor.predict_many(
+                    batch_dirs,
+                    model_type=model_type,
+                    image_gm="gm.png",
+                    image_osm="osm.png",
+                    parking_mask="osm_mask.png",
+                    batch_size=batch_size,
+                    model=model,
+                    **(predictor_options or {}),
+                )
+            )
+        except Exception as e:
+            # A broken image fails the whole forward pass, retry one by one
+            print(f"Error processing batch ({e}), falling back to single directories")
+            for dir_path in batch_dirs:
+                if process_directory(
+                    dir_path,
+                    model_type,
+                    mask_threshold,
+                    mask_low_confidence,
+                    model,
+                    predictor_options,
+                ):
+                    processed_dirs.append(dir_path)
+            continue
+
+        for predictor in predictors:
+            dir_path = predictor.img_data_folder
+            try:
+                save_outputs(predictor, dir_path, mask_threshold, mask_low_confidence)
+                print(f"Successfully processed {dir_path}")
+                processed_dirs.append(dir_path)
+            except Exception as e:
+                print(f"Error processing {dir_path}: {e}")
+
+    return processed_dirs
+
+
+def process_pipelined(
+    dir_paths,
+    model_type=ModelClass.LARGE,
+    mask_threshold=0.5,
+    mask_low_confidence=0.1,
+    model=None,
+    batch_size=1,
+    readers=4,
+    writers=4,
+    read_queue_depth=16,
+    write_queue_depth=16,
+    predictor_options=None,
+):
+    """
+    Process data directories in a staged pipeline.
+
+    Reader threads decode the images of upcoming directories into a bounded
+    queue, the calling thread runs inference (batched if batch_size > 1) and
+    a writer pool draws visualizations and writes stats in the background,
+    so disk I/O overlaps with inference. Queue depths bound the number of
+    decoded directories held in memory.
+
+    Returns:
+        list: Successfully processed directories
+    """
+    pending_dirs = queue.Queue()
+    for dir_path in dir_paths:
+        pending_dirs.put(dir_path)
+
+    loaded = queue.Queue(maxsize=read_queue_depth)
+    done_reading = object()
+    processed_dirs = []
+
+    def read_directories():
+        while True:
+            try:
+                dir_path = pending_dirs.get_nowait()
+            except queue.Empty:
+                break
+
+            missing_files = find_missing_inputs(dir_path)
+            if missing_files:
+                print(
+                    f"Skipping {dir_path} - missing input files: {', '.join(missing_files)}"
+                )
+                continue
+
+            try:
+                predictor = Predictor(
+                    img_data_folder=dir_path,
+                    image_gm="gm.png",
+                    image_osm="osm.png",
+                    parking_mask="osm_mask.png",
+                    model_type=model_type,
+                    model=model,
+                    **(predictor_options or {}),
+                )
+                predictor.load_images()
+                if predictor.img_gm is None or predictor.mask is None:
+                    raise ValueError("could not decode input images")
+                loaded.put(predictor)
+            except Exception as e:
+                print(f"Error processing {dir_path}: {e}")
+
+        loaded.put(done_reading)
+
+    def write_outputs(predictor):
+        dir_path = predictor.img_data_folder
+        try:
+            save_outputs(predictor, dir_path, mask_threshold, mask_low_confidence)
+            print(f"Successfully processed {dir_path}")
+            processed_dirs.append(dir_path)
+        except Exception as e:
+            print(f"Error processing {dir_path}: {e}")
+        finally:
+            write_slots.release()
+
+    def predict_and_submit(predictors):
+        try:
+            Predictor.predict_batch(predictors)
+        except Exception as e:
+            # A broken image fails the whole forward pass, retry one by one
+            print(f"Error processing batch ({e}), falling back to single directories")
+            predicted = []
+            for predictor in predictors:
+                try:
+                    predictor.predict(load_images=False)
+                    predicted.append(predictor)
+                except Exception as e:
+                    print(f"Error processing {predictor.img_data_folder}: {e}")
+            predictors = predicted
+
+        for predictor in predictors:
+            write_slots.acquire()
+            writer_pool.submit(write_outputs, predictor)
+
+    write_slots = threading.BoundedSemaphore(write_queue_depth)
+    reader_threads = [
+        threading.Thread(target=read_directories, daemon=True)
+        for _ in range(max(1, readers))
+    ]
+    for thread in reader_threads:
+        thread.start()
+
+    with ThreadPoolExecutor(max_workers=max(1, writers)) as writer_pool:
+        finished_readers = 0
+        batch = []
+        while finished_readers < len(reader_threads):
+            item = loaded.get()
+            if item is done_reading:
+                finished_readers += 1
+                continue
+
+            batch.append(item)
+            if len(batch) >= batch_size:
+                predict_and_submit(batch)
+                batch = []
+
+        if batch:
+            predict_and_submit(batch)
+
+    return processed_dirs
+
+
+def process_directories(
+    dir_paths,
+    model_type=ModelClass.LARGE,
+    mask_threshold=0.5,
+    mask_low_confidence=0.1,
+    model=None,
+    batch_size=1,
+    pipeline=None,
+    predictor_options=None,
+):
+    """
+    Process data directories one after another in the current process.
+
+    Args:
+        pipeline (dict): Keyword arguments of `process_pipelined()` (readers,
+            writers, queue depths); if given, the staged pipeline is used
+        predictor_options (dict): Extra keyword arguments of `Predictor`
+            (e.g. roi_padding)
+
+    Returns:
+        list: Successfully processed directories
+    """
+    if pipeline is not None:
+        return process_pipelined(
+            dir_paths,
+            model_type=model_type,
+            mask_threshold=mask_threshold,
+            mask_low_confidence=mask_low_confidence,
+            model=model,
+            batch_size=batch_size,
+            predictor_options=predictor_options,
+            **pipeline,
+        )
+
+    if batch_size > 1:
+        return process_batch(
+            dir_paths,
+            model_type=model_type,
+            mask_threshold=mask_threshold,
+            mask_low_confidence=mask_low_confidence,
+            model=model,
+            batch_size=batch_size,
+            predictor_options=predictor_options,
+        )
+
+    return [
+        dir_path
+        for dir_path in dir_paths
+        if process_directory(
+            dir_path,
+            model_type=model_type,
+            mask_threshold=mask_threshold,
+            mask_low_confidence=mask_low_confidence,
+            model=model,
+            predictor_options=predictor_options,
+        )
+    ]
+
+
+def _init_worker(model_type, threads_per_worker, predictor_options):
+    """Pin torch/OpenCV threads and load the model once per worker process."""
+    import torch
+
+    torch.set_num_threads(threads_per_worker)
+    torch.set_num_interop_threads(1)
+    cv2.setNumThreads(1)
+    load_model(model_type, predictor_options)
+
+
+def _process_shard(
+    dir_paths,
+    model_type,
+    mask_threshold,
+    mask_low_confidence,
+    batch_size,
+    pipeline,
+    predictor_options,
+):
+    """Process a shard of directories inside a worker process."""
+    processed_dirs = process_directories(
+        dir_paths,
+        model_type=model_type,
+        mask_threshold=mask_threshold,
+        mask_low_confidence=mask_low_confidence,
+        model=load_model(model_type, predictor_options),
+        batch_size=batch_size,
+        pipeline=pipeline,
+        predictor_options=predictor_options,
+    )
+    processed = set(processed_dirs)
+    failed_dirs = [d for d in dir_paths if d not in processed]
+    return processed_dirs, failed_dirs
+
+
+def process_parallel(
+    dir_paths,
+    workers,
+    threads_per_worker=None,
+    model_type=ModelClass.LARGE,
+    mask_threshold=0.5,
+    mask_low_confidence=0.1,
+    batch_size=1,
+    shard_size=None,
+    pipeline=None,
+    predictor_options=None,
+):
+    """
+    Process data directories with a pool of worker processes.
+
+    Every worker loads its own copy of the model and limits torch to
+    `threads_per_worker` intra-op threads, so workers x threads matches the
+    number of CPU cores. Directories are handed out in small shards to keep
+    the workers evenly loaded.
+
+    Returns:
+        tuple: (processed directories, failed or skipped directories)
+    """
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    if shard_size is None:
+        shard_size = max(batch_size, 4)
+
+    shards = [
+        dir_paths[start : start + shard_size]
+        for start in range(0, len(dir_paths), shard_size)
+    ]
+    print(
+        f"Using {workers} workers x {threads_per_worker} threads, "
+        f"{len(shards)} shards of up to {shard_size} directories"
+    )
+
+    processed_dirs, failed_dirs = [], []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(model_type, threads_per_worker, predictor_options),
+    ) as executor:
+        futures = {
+            executor.submit(
+                _process_shard,
+                shard,
+                model_type,
+                mask_threshold,
+                mask_low_confidence,
+                batch_size,
+                pipeline,
+                predictor_options,
+            ): shard
+            for shard in shards
+        }
+        for future in as_completed(futures):
+            try:
+                shard_processed, shard_failed = future.result()
+            except Exception as e:
+                # The whole shard is lost (e.g. a crashed worker)
+                print(f"Error in worker: {e}")
+                shard_processed, shard_failed = [], futures[future]
+            processed_dirs.extend(shard_processed)
+            failed_dirs.extend(shard_failed)
+
+    return processed_dirs, failed_dirs
+
+
+def select_for_escalation(
+    dir_paths,
+    confidence_band=(0.25, 0.5),
+    min_band_boxes=1,
+    min_mask_area=0.2,
+    mask_low_confidence=0.1,
+    readers=4,
+):
+    """
+    Pick the directories whose cheap-model result is uncertain.
+
+    A directory is escalated when at least `min_band_boxes` of its boxes
+    overlapping the parking mask have a confidence inside `confidence_band`,
+    or when the parking mask covers at least `min_mask_area` of the frame.
+    Only saved detections and masks are read.
+
+    Returns:
+        list: Directories to predict again with a larger model
+    """
+    band_low, band_high = confidence_band
+
+    def needs_escalation(dir_path):
+        try:
+            detections = Detections.load(os.path.join(dir_path, DETECTIONS_FILE))
+        except (OSError, KeyError, ValueError):
+            return False
+
+        counted = detections.mask_ratio >= mask_low_confidence
+        in_band = (detections.conf >= band_low) & (detections.conf < band_high)
+        if np.count_nonzero(counted & in_band) >= min_band_boxes:
+            return True
+
+        mask = cv2.imread(
+            os.path.join(dir_path, "osm_mask.png"), cv2.IMREAD_GRAYSCALE
+        )
+        return mask is not None and parking_region(mask)[0] >= min_mask_area
+
+    with ThreadPoolExecutor(max_workers=max(1, readers)) as executor:
+        escalate = list(executor.map(needs_escalation, dir_paths))
+
+    return [d for d, needed in zip(dir_paths, escalate) if needed]
+
+
+def run_inference(args, dir_paths, model_type, predictor_options, pipeline=None):
+    """
+    Predict directories with one model, in the mode selected on the command line.
+
+    Returns:
+        list: Successfully processed directories
+    """
+    if not dir_paths:
+        return []
+
+    if args.workers > 1:
+        processed_dirs, failed_dirs = process_parallel(
+            dir_paths,
+            workers=args.workers,
+            threads_per_worker=args.threads_per_worker,
+            model_type=model_type,
+            mask_threshold=args.threshold,
+            mask_low_confidence=args.low_threshold,
+            batch_size=args.batch_size,
+            pipeline=pipeline,
+            predictor_options=predictor_options,
+        )
+        if failed_dirs:
+            print(f"{len(failed_dirs)} directories failed or were skipped:")
+            for dir_path in sorted(failed_dirs):
+                print(f"  {dir_path}")
+        return processed_dirs
+
+    # Load the model once and share it between all directories
+    model = load_model(model_type, predictor_options)
+    if args.batch_size > 1:
+        print(f"Using batch size: {args.batch_size}")
+    return process_directories(
+        dir_paths,
+        model_type=model_type,
+        mask_threshold=args.threshold,
+        mask_low_confidence=args.low_threshold,
+        model=model,
+        batch_size=args.batch_size,
+        pipeline=pipeline,
+        predictor_options=predictor_options,
+    )
+
+
+def run_config_digest(args, model_types, predictor_options):
+    """Digest of every setting that changes the outputs of a directory."""
+    weights = {
+        model_type.value: (
+            file_digest(weights_path(model_type))
+            if os.path.exists(weights_path(model_type))
+            else None
+        )
+        for model_type in model_types
+    }
+    config = {
+        "weights": weights,
+        "model_types": [model_type.value for model_type in model_types],
+        "threshold": args.threshold,
+        "low_threshold": args.low_threshold,
+        "min_mask_area": args.min_mask_area,
+        "predictor_options": predictor_options,
+    }
+    if len(model_types) > 1:
+        config["cascade"] = [
+            list(args.cascade_band),
+            args.cascade_min_boxes,
+            args.cascade_mask_area,
+        ]
+    return config_digest(**config)
+
+
+def parse_threshold_pair(value):
+    """Parse a "mask_threshold:mask_low_confidence" pair, e.g. "0.5:0.1"."""
+    try:
+        mask_threshold, mask_low_confidence = (float(v) for v in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Invalid threshold pair '{value}', expected e.g. 0.5:0.1"
+        )
+    return mask_threshold, mask_low_confidence
+
+
+def rescore(data_dirs, threshold_pairs, data_dir="data", output_csv=None):
+    """
+    Rebuild prediction stats and the merged tables from saved detections.
+
+    The model is not used: every directory's detections file and mask are
+    loaded once and summarized for each (mask_threshold, mask_low_confidence)
+    pair. The merged Parquet file is written next to the merged CSV, with the
+    same name. With more than one pair, the stats files and the merged files
+    get a "_<threshold>_<low_threshold>" suffix.
+
+    Returns:
+        int: Number of rescored directories
+    """
+    output_csv = output_csv or merge_prediction_data.OUTPUT_CSV
+
+    def suffix(pair):
+        return "" if len(threshold_pairs) == 1 else f"_{pair[0]}_{pair[1]}"
+
+    rescored_count = 0
+    rescored_dirs = []
+    for dir_path in data_dirs:
+        if not os.path.exists(os.path.join(dir_path, DETECTIONS_FILE)):
+            print(f"Skipping {dir_path} - no {DETECTIONS_FILE}, run prediction first")
+            continue
+
+        try:
+            predictor = Predictor(
+                img_data_folder=dir_path,
+                image_gm="gm.png",
+                image_osm="osm.png",
+                parking_mask="osm_mask.png",
+                model_type=None,
+            )
+            predictor.load_detections(DETECTIONS_FILE)
+
+            for pair in threshold_pairs:
+                predictor.summarize(
+                    mask_threshold=pair[0],
+                    mask_low_confidence=pair[1],
+                    save=True,
+                    stats_name=f"prediction_stats{suffix(pair)}",
+                    verbose=False,
+                )
+            rescored_count += 1
+            rescored_dirs.append(dir_path)
+
+        except Exception as e:
+            print(f"Error rescoring {dir_path}: {e}")
+
+    # The base stats no longer match the thresholds the cells were cached with
+    if len(threshold_pairs) == 1:
+        ResultCache(data_dir, REQUIRED_FILES, OUTPUT_FILES).discard(rescored_dirs)
+
+    # Merge the rescored stats of every pair into its own Parquet file and CSV
+    base, ext = os.path.splitext(output_csv)
+    for pair in threshold_pairs:
+        merge_prediction_data.main(
+            data_dir=data_dir,
+            output_csv=f"{base}{suffix(pair)}{ext}",
+            output_parquet=f"{base}{suffix(pair)}.parquet",
+            stats_file_name=f"prediction_stats{suffix(pair)}.json",
+            verbose=False,
+        )
+
+    return rescored_count
+
+
 def parse_args():
     """Parse command-line arguments."""
     parser = argparse.ArgumentParser(
@@ -141,11 +783,211 @@ def parse_args():
         help="Minimum mask ratio threshold for low confidence (red boxes) (default: 0.1)",
     )
 
+    # Batched inference
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Number of directories stacked into one forward pass (default: 1)",
+    )
+
+    # Multi-process run
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes, each with its own model copy (default: 1)",
+    )
+
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="Torch intra-op threads per worker (default: CPU cores / workers)",
+    )
+
+    # Skip cells without parking
+    parser.add_argument(
+        "--min-mask-area",
+        type=float,
+        default=None,
+        help="Skip inference (and write empty stats) for directories whose "
+        "parking mask covers at most this fraction of the frame, e.g. 0 for "
+        "empty masks or 0.001 for near-empty ones (default: disabled)",
+    )
+
+    # Inference backend
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="torch",
+        choices=BACKENDS,
+        help="Inference backend; onnx/openvino models are exported once and "
+        "cached next to the weights (default: torch)",
+    )
+
+    parser.add_argument(
+        "--int8",
+        action="store_true",
+        help="Use an INT8 quantized export, calibrated on a sample of the data "
+        "directories (onnx/openvino only)",
+    )
+
+    parser.add_argument(
+        "--calibration-cells",
+        type=int,
+        default=100,
+        help="Number of data directories used for INT8 calibration (default: 100)",
+    )
+
+    # Mask ROI inference
+    parser.add_argument(
+        "--roi-padding",
+        type=int,
+        default=None,
+        help="Run the model only on windows around the parking regions of the "
+        "mask, padded by this many pixels (default: full-frame inference)",
+    )
+
+    # Tiled inference
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=None,
+        help="Predict full-resolution tiles of this size and merge them with "
+        "rotated NMS, for large captures (default: one pass over the whole image)",
+    )
+
+    parser.add_argument(
+        "--tile-overlap",
+        type=int,
+        default=128,
+        help="Overlap of neighbouring tiles in pixels, larger than a car (default: 128)",
+    )
+
+    parser.add_argument(
+        "--nms-iou",
+        type=float,
+        default=0.5,
+        help="IoU above which duplicate boxes across tiles are merged (default: 0.5)",
+    )
+
+    # Cascade inference
+    parser.add_argument(
+        "--cascade",
+        type=str,
+        default=None,
+        choices=["NANO", "MEDIUM", "LARGE"],
+        help="Run --model-type on every directory first, then re-run uncertain "
+        "directories with this larger model (default: disabled)",
+    )
+
+    parser.add_argument(
+        "--cascade-band",
+        type=float,
+        nargs=2,
+        default=(0.25, 0.5),
+        metavar=("LOW", "HIGH"),
+        help="Confidence band of ambiguous detections (default: 0.25 0.5)",
+    )
+
+    parser.add_argument(
+        "--cascade-min-boxes",
+        type=int,
+        default=1,
+        help="Escalate directories with at least this many ambiguous boxes "
+        "overlapping the mask (default: 1)",
+    )
+
+    parser.add_argument(
+        "--cascade-mask-area",
+        type=float,
+        default=0.2,
+        help="Escalate directories whose parking mask covers at least this "
+        "fraction of the frame (default: 0.2)",
+    )
+
+    # Pipelined I/O
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Overlap image reading and output writing with inference",
+    )
+
+    parser.add_argument(
+        "--readers",
+        type=int,
+        default=4,
+        help="Reader threads decoding input images in pipeline mode (default: 4)",
+    )
+
+    parser.add_argument(
+        "--writers",
+        type=int,
+        default=4,
+        help="Writer threads saving outputs in pipeline mode (default: 4)",
+    )
+
+    parser.add_argument(
+        "--read-queue-depth",
+        type=int,
+        default=16,
+        help="Max decoded directories waiting for inference (default: 16)",
+    )
+
+    parser.add_argument(
+        "--write-queue-depth",
+        type=int,
+        default=16,
+        help="Max predicted directories waiting to be written (default: 16)",
+    )
+
     # Force reprocessing
     parser.add_argument(
         "--force",
         action="store_true",
-        help="Force reprocessing of directories even if outputs already exist",
+        help="Reprocess every directory, ignoring the prediction cache",
+    )
+
+    # Re-scoring of saved detections
+    subparsers = parser.add_subparsers(dest="command")
+    rescore_parser = subparsers.add_parser(
+        "rescore",
+        help="Rebuild prediction stats and the merged CSV from saved detections "
+        "for other thresholds, without running the model",
+    )
+    rescore_parser.add_argument(
+        "--pairs",
+        type=parse_threshold_pair,
+        nargs="+",
+        default=None,
+        help="Threshold pairs as mask_threshold:mask_low_confidence, e.g. "
+        "0.5:0.1 0.7:0.2 (default: --threshold:--low-threshold)",
+    )
+    rescore_parser.add_argument(
+        "--output-csv",
+        type=str,
+        default=merge_prediction_data.OUTPUT_CSV,
+        help="Merged CSV path, the merged Parquet file is written next to it "
+        f"(default: {merge_prediction_data.OUTPUT_CSV})",
+    )
+
+    drift_parser = subparsers.add_parser(
+        "drift",
+        help="Report the accuracy drift of --backend (and --int8) versus the "
+        "torch model on a sample of the data directories",
+    )
+    drift_parser.add_argument(
+        "--cells",
+        type=int,
+        default=50,
+        help="Number of sampled data directories to compare (default: 50)",
+    )
+    drift_parser.add_argument(
+        "--output",
+        type=str,
+        default="backend_drift.json",
+        help="Path of the JSON report (default: backend_drift.json)",
     )
 
     return parser.parse_args()
@@ -180,19 +1022,174 @@ def main():
 
     print(f"Found {len(data_dirs)} directories to process")
 
-    # Process each directory
-    processed_count = 0
-    for dir_path in data_dirs:
-        if process_directory(
-            dir_path,
-            model_type=model_type,
+    if args.command == "rescore":
+        threshold_pairs = args.pairs or [(args.threshold, args.low_threshold)]
+        print(f"Rescoring for threshold pairs: {threshold_pairs}")
+        rescored_count = rescore(
+            data_dirs, threshold_pairs, data_dir=args.data_dir, output_csv=args.output_csv
+        )
+        print(
+            f"Rescoring complete. {rescored_count}/{len(data_dirs)} directories rescored."
+        )
+        return
+
+    if args.int8 and args.backend == "torch":
+        print("--int8 needs --backend onnx or openvino")
+        return
+
+    cascade_model_type = None
+    if args.cascade is not None:
+        cascade_model_type = model_type_map[args.cascade]
+        if cascade_model_type == model_type:
+            print("--cascade needs a model different from --model-type")
+            return
+        print(
+            f"Using cascade: {model_type.value} first, {cascade_model_type.value} "
+            f"for confidence band {args.cascade_band} or mask area >= "
+            f"{args.cascade_mask_area}"
+        )
+
+    # Export the models once, before any worker needs them
+    if args.backend != "torch":
+        calibration_images = None
+        if args.int8:
+            calibration_images = sample_calibration_images(
+                data_dirs, count=args.calibration_cells
+            )
+        for export_type in [model_type, cascade_model_type]:
+            if export_type is not None:
+                export_model(
+                    export_type,
+                    args.backend,
+                    int8=args.int8,
+                    calibration_images=calibration_images,
+                )
+
+    if args.command == "drift":
+        if args.backend == "torch":
+            print("Choose the backend to compare with --backend onnx or openvino")
+            return
+        drift_dirs = [
+            os.path.dirname(path)
+            for path in sample_calibration_images(
+                [d for d in data_dirs if not find_missing_inputs(d)],
+                count=args.cells,
+                seed=1,
+            )
+        ]
+        report = compare_backends(
+            model_type,
+            args.backend,
+            drift_dirs,
+            int8=args.int8,
+            mask_threshold=args.threshold,
+            mask_low_confidence=args.low_threshold,
+        )
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(json.dumps(report["total"], indent=2))
+        print(f"Drift report saved to {args.output}")
+        return
+
+    predictor_options = {"backend": args.backend, "int8": args.int8}
+    if args.roi_padding is not None:
+        predictor_options["roi_padding"] = args.roi_padding
+        print(f"Using mask ROI inference with padding: {args.roi_padding}")
+    if args.tile_size is not None:
+        if args.roi_padding is not None:
+            print("--tile-size and --roi-padding cannot be combined")
+            return
+        predictor_options["tile_size"] = args.tile_size
+        predictor_options["tile_overlap"] = args.tile_overlap
+        predictor_options["nms_iou"] = args.nms_iou
+        print(
+            f"Using tiled inference: {args.tile_size}px tiles, "
+            f"{args.tile_overlap}px overlap, NMS IoU {args.nms_iou}"
+        )
+
+    # Directories whose inputs and settings did not change since the last run
+    cache = ResultCache(args.data_dir, REQUIRED_FILES, OUTPUT_FILES)
+    cache_key = run_config_digest(
+        args,
+        [t for t in [model_type, cascade_model_type] if t is not None],
+        predictor_options,
+    )
+    total_count = len(data_dirs)
+    complete_dirs = [d for d in data_dirs if not find_missing_inputs(d)]
+    stale_dirs, cached_dirs = cache.split(
+        complete_dirs, cache_key, workers=args.readers, force=args.force
+    )
+    cached_count = len(cached_dirs)
+    if cached_count:
+        stale_dirs = set(stale_dirs)
+        data_dirs = [d for d in data_dirs if d in stale_dirs or find_missing_inputs(d)]
+        print(
+            f"Skipped {cached_count} up-to-date directories, "
+            f"{len(data_dirs)} left to process (use --force to reprocess all)"
+        )
+
+    # Cells without parking do not need the model at all
+    skipped_count = 0
+    skipped_dirs = []
+    if args.min_mask_area is not None:
+        data_dirs, skipped_dirs = skip_empty_masks(
+            data_dirs,
+            min_mask_area=args.min_mask_area,
             mask_threshold=args.threshold,
             mask_low_confidence=args.low_threshold,
-        ):
-            processed_count += 1
+            readers=args.readers,
+        )
+        skipped_count = len(skipped_dirs)
+        print(
+            f"Skipped inference for {skipped_count} directories with mask area "
+            f"<= {args.min_mask_area}, {len(data_dirs)} left to predict"
+        )
+
+    pipeline = None
+    if args.pipeline:
+        pipeline = {
+            "readers": args.readers,
+            "writers": args.writers,
+            "read_queue_depth": args.read_queue_depth,
+            "write_queue_depth": args.write_queue_depth,
+        }
+        print(f"Using pipeline: {pipeline}")
+
+    # Process each directory
+    processed_dirs = run_inference(
+        args, data_dirs, model_type, predictor_options, pipeline=pipeline
+    )
+
+    # Re-run only uncertain directories with the larger model
+    if cascade_model_type is not None:
+        escalate_dirs = select_for_escalation(
+            processed_dirs,
+            confidence_band=args.cascade_band,
+            min_band_boxes=args.cascade_min_boxes,
+            min_mask_area=args.cascade_mask_area,
+            mask_low_confidence=args.low_threshold,
+            readers=args.readers,
+        )
+        print(
+            f"Cascade: escalating {len(escalate_dirs)}/{len(processed_dirs)} "
+            f"directories from {model_type.value} to {cascade_model_type.value}"
+        )
+        escalated_dirs = run_inference(
+            args, escalate_dirs, cascade_model_type, predictor_options, pipeline=pipeline
+        )
+        print(
+            f"Cascade complete. {len(processed_dirs) - len(escalated_dirs)} directories "
+            f"kept the {model_type.value} result, {len(escalated_dirs)} use "
+            f"{cascade_model_type.value}."
+        )
+
+    cache.update(processed_dirs)
+    cache.update(skipped_dirs, SKIPPED_OUTPUT_FILES)
+    processed_count = len(processed_dirs) + skipped_count + cached_count
 
     print(
-        f"Processing complete. {processed_count}/{len(data_dirs)} directories processed."
+        f"Processing complete. {processed_count}/{total_count} directories "
+        f"processed ({skipped_count} without inference, {cached_count} cached)."
     )
 
 
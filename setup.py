@@ -10,6 +10,10 @@ setup(
         "torch",
         "ultralytics",
     ],
+    extras_require={
+        "onnx": ["onnx", "onnxruntime"],
+        "openvino": ["openvino", "nncf"],
+    },
     author="Your Name",
     author_email="your.email@example.com",
     description="Parking space prediction using YOLO models",
@@ -0,0 +1,431 @@
+import argparse
+import csv
+import heapq
+import math
+import os
+
+import numpy as np
+
+from src.predictor.detections import Detections
+from src.predictor.geometry import polygon_iou
+from src.scraper.georef import EARTH_RADIUS, load_georef
+
+UNIQUE_FIELDS = [
+    "detection_id",
+    "cell_id",
+    "longitude",
+    "latitude",
+    "polygon",
+    "conf",
+    "cls",
+    "mask_ratio",
+    "views",
+]
+AREA_FIELDS = [
+    "area_id",
+    "center_lat",
+    "center_lon",
+    "unique_cars",
+    "total_detections",
+    "high_confidence_boxes",
+    "low_confidence_boxes",
+    "merged_duplicates",
+]
+
+
+class _Record:
+    """A unique car: its best detection and the number of captures showing it."""
+
+    __slots__ = (
+        "polygon",
+        "south",
+        "keys",
+        "conf",
+        "cls",
+        "mask_ratio",
+        "cell_id",
+        "last_cell",
+        "views",
+    )
+
+    def __init__(self, polygon, south, keys, conf, cls, mask_ratio, cell_id):
+        self.polygon = polygon
+        self.south = south
+        self.keys = keys
+        self.conf = conf
+        self.cls = cls
+        self.mask_ratio = mask_ratio
+        self.cell_id = cell_id
+        self.last_cell = cell_id
+        self.views = 1
+
+
+class DetectionStore:
+    """
+    Global index of the detections of all cells in ground coordinates.
+
+    Cells are added in north to south order of their captures. Every box is
+    projected to Web Mercator meters (relative to the first cell, so the
+    float32 IoU stays precise) and matched against the boxes of other
+    captures through a uniform grid index; boxes overlapping with IoU of at
+    least `iou_threshold` are one car seen twice, and the detection with the
+    highest confidence is kept.
+
+    A box lying north of the capture being added can not overlap any later
+    capture, so it is written out and evicted from the index. The index
+    therefore only holds about one row of captures, which keeps the memory
+    bounded for any number of boxes.
+
+    Unique cars are counted in areas of `area_size` meters on the ground:
+    rows of equal height along the meridian, split into columns whose width
+    in degrees follows the latitude of the row.
+    """
+
+    def __init__(
+        self,
+        unique_writer=None,
+        iou_threshold=0.3,
+        bucket_size=10.0,
+        area_size=250.0,
+        mask_threshold=0.5,
+        mask_low_confidence=0.1,
+    ):
+        """
+        Args:
+            unique_writer (csv.DictWriter): Receives one row per unique car
+                (optional)
+            iou_threshold (float): Minimum IoU of two boxes of the same car
+            bucket_size (float): Grid index cell size in meters, larger than a car
+            area_size (float): Side of the square count areas in meters
+            mask_threshold (float): Mask ratio of high confidence boxes
+            mask_low_confidence (float): Minimum mask ratio of counted boxes
+        """
+        self.unique_writer = unique_writer
+        self.iou_threshold = iou_threshold
+        self.bucket_size = bucket_size
+        self.area_size = area_size
+        self.mask_threshold = mask_threshold
+        self.mask_low_confidence = mask_low_confidence
+
+        # Set by the first cell: local origin and the Mercator size of the
+        # index grid cells, which only has to be shared by all captures
+        self.origin = None
+        self.index_size = None
+
+        self.records = {}
+        self.buckets = {}
+        self._by_south_edge = []
+        self._next_id = 0
+
+        self.areas = {}
+        self.unique_cars = 0
+        self.merged_duplicates = 0
+
+    def _index(self, record_id, record):
+        for key in record.keys:
+            self.buckets.setdefault(key, set()).add(record_id)
+        heapq.heappush(self._by_south_edge, (-record.south, record_id))
+
+    def _unindex(self, record_id, record):
+        for key in record.keys:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(record_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def _candidates(self, keys, cell_id):
+        ids = set()
+        for key in keys:
+            ids.update(self.buckets.get(key, ()))
+        # Boxes of the same capture were already merged by the model's NMS
+        return [i for i in ids if self.records[i].last_cell != cell_id]
+
+    def _flush(self, south_limit=None):
+        """Emit every box lying entirely north of `south_limit` (all if None)."""
+        emitted = []
+        while self._by_south_edge:
+            south, record_id = self._by_south_edge[0]
+            if south_limit is not None and -south <= south_limit:
+                break
+            heapq.heappop(self._by_south_edge)
+            record = self.records.get(record_id)
+            # Skip heap entries of boxes that were replaced or already emitted
+            if record is not None and record.south == -south:
+                del self.records[record_id]
+                self._unindex(record_id, record)
+                emitted.append(record)
+
+        if emitted:
+            self._emit(emitted)
+
+    def _emit(self, records):
+        """Count evicted unique cars in their areas and write them out."""
+        mercator = np.stack([r.polygon for r in records]).astype(np.float64) + self.origin
+        centers = mercator.mean(axis=1)
+        lonlat = _mercator_to_lonlat(mercator)
+        center_lonlat = _mercator_to_lonlat(centers)
+
+        area_keys = _area_keys(np.radians(center_lonlat), self.area_size)
+
+        for index, (record, area_key) in enumerate(zip(records, area_keys)):
+            area = self.areas.get(area_key)
+            if area is None:
+                area = self.areas[area_key] = _empty_counts()
+            area["unique_cars"] += 1
+            area["merged_duplicates"] += record.views - 1
+            if record.mask_ratio >= self.mask_low_confidence:
+                area["total_detections"] += 1
+                if record.mask_ratio >= self.mask_threshold:
+                    area["high_confidence_boxes"] += 1
+                else:
+                    area["low_confidence_boxes"] += 1
+
+            if self.unique_writer is not None:
+                ring = lonlat[index].tolist()
+                ring.append(ring[0])
+                self.unique_writer.writerow(
+                    {
+                        "detection_id": self.unique_cars + index,
+                        "cell_id": record.cell_id,
+                        "longitude": f"{center_lonlat[index, 0]:.7f}",
+                        "latitude": f"{center_lonlat[index, 1]:.7f}",
+                        "polygon": "POLYGON (("
+                        + ", ".join(f"{x:.7f} {y:.7f}" for x, y in ring)
+                        + "))",
+                        "conf": f"{record.conf:.4f}",
+                        "cls": record.cls,
+                        "mask_ratio": f"{record.mask_ratio:.4f}",
+                        "views": record.views,
+                    }
+                )
+        self.unique_cars += len(records)
+
+    def add_cell(self, cell_id, detections, georef):
+        """
+        Add the detections of one capture.
+
+        Args:
+            cell_id: Identifier of the cell
+            detections (Detections): Detections in image pixels
+            georef (GeoReference): Georeference of the detected image
+        """
+        if self.origin is None:
+            self.origin = np.array(georef.transform)[[2, 5]]
+            latitude = georef.pixels_to_lonlat((georef.width / 2, georef.height / 2))[1]
+            self.index_size = self.bucket_size / math.cos(math.radians(latitude))
+
+        # Nothing north of this capture can overlap it or any later capture
+        self._flush(south_limit=georef.transform[5] - self.origin[1])
+        if len(detections) == 0:
+            return
+
+        polygons = (georef.pixels_to_mercator(detections.polygons) - self.origin).astype(
+            np.float32
+        )
+        lows = np.floor(polygons.min(axis=1) / self.index_size).astype(np.int64).tolist()
+        highs = np.floor(polygons.max(axis=1) / self.index_size).astype(np.int64).tolist()
+        souths = polygons[:, :, 1].min(axis=1).tolist()
+
+        for polygon, south, (x0, y0), (x1, y1), conf, cls, mask_ratio in zip(
+            polygons,
+            souths,
+            lows,
+            highs,
+            detections.conf.tolist(),
+            detections.cls.tolist(),
+            detections.mask_ratio.tolist(),
+        ):
+            keys = [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+            best_iou, best_id = 0.0, None
+            for record_id in self._candidates(keys, cell_id):
+                iou = polygon_iou(polygon, self.records[record_id].polygon)
+                if iou > best_iou:
+                    best_iou, best_id = iou, record_id
+
+            if best_id is None or best_iou < self.iou_threshold:
+                record = _Record(polygon, south, keys, conf, cls, mask_ratio, cell_id)
+                self.records[self._next_id] = record
+                self._index(self._next_id, record)
+                self._next_id += 1
+                continue
+
+            record = self.records[best_id]
+            record.views += 1
+            record.last_cell = cell_id
+            self.merged_duplicates += 1
+            if conf > record.conf:
+                # The better detection replaces the box, re-index it
+                self._unindex(best_id, record)
+                record.polygon, record.south, record.keys = polygon, south, keys
+                record.conf, record.cls = conf, cls
+                record.mask_ratio, record.cell_id = mask_ratio, cell_id
+                self._index(best_id, record)
+
+    def close(self):
+        """Emit the remaining boxes."""
+        self._flush()
+
+    def area_rows(self):
+        """Yield the per-area counts as rows of AREA_FIELDS."""
+        for (ix, iy), counts in sorted(self.areas.items()):
+            lat = (iy + 0.5) * self.area_size / EARTH_RADIUS
+            lon = (ix + 0.5) * self.area_size / (EARTH_RADIUS * math.cos(lat))
+            lat, lon = math.degrees(lat), math.degrees(lon)
+            yield {
+                "area_id": f"{ix}_{iy}",
+                "center_lat": f"{lat:.7f}",
+                "center_lon": f"{lon:.7f}",
+                **counts,
+            }
+
+
+def _empty_counts():
+    return {
+        "unique_cars": 0,
+        "total_detections": 0,
+        "high_confidence_boxes": 0,
+        "low_confidence_boxes": 0,
+        "merged_duplicates": 0,
+    }
+
+
+def _area_keys(lonlat, area_size):
+    """
+    Return the (column, row) keys of the areas of points given in radians.
+
+    Rows are `area_size` meters of the meridian; columns are `area_size`
+    meters along the center latitude of their row.
+    """
+    rows = np.floor(lonlat[:, 1] * EARTH_RADIUS / area_size)
+    row_latitudes = (rows + 0.5) * area_size / EARTH_RADIUS
+    columns = np.floor(lonlat[:, 0] * EARTH_RADIUS * np.cos(row_latitudes) / area_size)
+    return list(zip(columns.astype(np.int64).tolist(), rows.astype(np.int64).tolist()))
+
+
+def _mercator_to_lonlat(points):
+    points = np.asarray(points, dtype=np.float64)
+    lon = np.degrees(points[..., 0] / EARTH_RADIUS)
+    lat = np.degrees(2 * np.arctan(np.exp(points[..., 1] / EARTH_RADIUS)) - np.pi / 2)
+    return np.stack([lon, lat], axis=-1)
+
+
+def find_cells(data_dir, detections_file="detections.npz", image_name="gm.png"):
+    """
+    Find the cells with saved detections and a georeference, north to south.
+
+    Returns:
+        list: (cell id, cell directory, GeoReference), sorted by the north
+            edge of the capture, then west to east
+    """
+    cells = []
+    for name in os.listdir(data_dir):
+        cell_dir = os.path.join(data_dir, name)
+        if not os.path.isfile(os.path.join(cell_dir, detections_file)):
+            continue
+        georef = load_georef(cell_dir, image_name)
+        if georef is None:
+            print(f"Skipping {cell_dir}: no georef.json or coords.json")
+            continue
+        cells.append((name, cell_dir, georef))
+
+    cells.sort(key=lambda cell: (-cell[2].transform[5], cell[2].transform[2]))
+    return cells
+
+
+def build_store(
+    data_dir,
+    unique_path="unique_detections.csv",
+    areas_path="area_counts.csv",
+    detections_file="detections.npz",
+    image_name="gm.png",
+    **store_options,
+):
+    """
+    Deduplicate the detections of all cells and write unique cars and area counts.
+
+    Args:
+        data_dir (str): Base directory of the cell directories
+        unique_path (str): Output CSV of unique cars (None to skip)
+        areas_path (str): Output CSV of per-area counts
+        detections_file (str): Detections file name in each cell
+        image_name (str): Image the detections were made on
+        **store_options: Keyword arguments of DetectionStore
+
+    Returns:
+        DetectionStore: The closed store, with its totals
+    """
+    cells = find_cells(data_dir, detections_file, image_name)
+
+    unique_file = open(unique_path, "w", newline="") if unique_path else None
+    try:
+        writer = None
+        if unique_file is not None:
+            writer = csv.DictWriter(unique_file, fieldnames=UNIQUE_FIELDS)
+            writer.writeheader()
+
+        store = DetectionStore(unique_writer=writer, **store_options)
+        for cell_id, cell_dir, georef in cells:
+            detections = Detections.load(os.path.join(cell_dir, detections_file))
+            store.add_cell(cell_id, detections, georef)
+        store.close()
+    finally:
+        if unique_file is not None:
+            unique_file.close()
+
+    with open(areas_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=AREA_FIELDS)
+        writer.writeheader()
+        writer.writerows(store.area_rows())
+
+    print(
+        f"Indexed {len(cells)} cells: {store.unique_cars} unique cars, "
+        f"{store.merged_duplicates} duplicates merged across captures"
+    )
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge duplicate detections of overlapping captures and count unique cars per area"
+    )
+    parser.add_argument("--data-dir", default="data", help="Base data directory")
+    parser.add_argument(
+        "--unique-output", default="unique_detections.csv", help="CSV of unique cars"
+    )
+    parser.add_argument(
+        "--areas-output", default="area_counts.csv", help="CSV of per-area counts"
+    )
+    parser.add_argument(
+        "--iou", type=float, default=0.3, help="Minimum IoU of duplicate boxes"
+    )
+    parser.add_argument(
+        "--area-size", type=float, default=250.0, help="Side of the count areas in meters"
+    )
+    parser.add_argument(
+        "--mask-threshold",
+        type=float,
+        default=0.5,
+        help="Mask ratio of high confidence boxes",
+    )
+    parser.add_argument(
+        "--mask-low-confidence",
+        type=float,
+        default=0.1,
+        help="Minimum mask ratio of counted boxes",
+    )
+    args = parser.parse_args()
+
+    build_store(
+        args.data_dir,
+        unique_path=args.unique_output,
+        areas_path=args.areas_output,
+        iou_threshold=args.iou,
+        area_size=args.area_size,
+        mask_threshold=args.mask_threshold,
+        mask_low_confidence=args.mask_low_confidence,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import numpy as np
+
+from src.predictor.mask_overlap import box_mask_ratios
+
+
+class Detections:
+    """
+    Scored detections of a single image stored as a struct of arrays.
+
+    Attributes:
+        polygons (numpy.ndarray): Box corners, shape (N, 4, 2), float32
+        conf (numpy.ndarray): Detection confidences, shape (N,), float32
+        cls (numpy.ndarray): Class ids, shape (N,), int64
+        mask_ratio (numpy.ndarray): Fraction of each box in the parking mask,
+            shape (N,), float64
+        source (str): Name of the model that produced the detections, if known
+    """
+
+    def __init__(self, polygons, conf, cls, mask_ratio, source=None):
+        self.polygons = np.asarray(polygons, dtype=np.float32).reshape(-1, 4, 2)
+        self.conf = np.asarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.asarray(cls, dtype=np.int64).reshape(-1)
+        self.mask_ratio = np.asarray(mask_ratio, dtype=np.float64).reshape(-1)
+        self.source = source
+
+    def __len__(self):
+        return len(self.conf)
+
+    @classmethod
+    def empty(cls):
+        """Return detections without any box."""
+        return cls(np.zeros((0, 4, 2)), np.zeros(0), np.zeros(0), np.zeros(0))
+
+    @classmethod
+    def from_results(cls, results, mask):
+        """
+        Build scored detections from model results.
+
+        Every box tensor is moved to CPU once and mask ratios of all boxes are
+        computed in a single pass.
+
+        Args:
+            results: List of results from the model prediction
+            mask: Grayscale parking mask
+
+        Returns:
+            Detections: Detections of all results, in result order
+        """
+        polygons, confs, classes = [], [], []
+        for result in results or []:
+            if hasattr(result, "obb") and result.obb is not None:
+                polygons.append(result.obb.xyxyxyxy.cpu().numpy().reshape(-1, 4, 2))
+                confs.append(result.obb.conf.cpu().numpy())
+                classes.append(result.obb.cls.cpu().numpy())
+
+        if not polygons:
+            return cls.empty()
+
+        polygons = np.concatenate(polygons)
+        return cls(
+            polygons,
+            np.concatenate(confs),
+            np.concatenate(classes),
+            box_mask_ratios(polygons, mask),
+        )
+
+    def select(self, keep):
+        """Return the detections selected by a boolean mask or index array."""
+        return Detections(
+            self.polygons[keep],
+            self.conf[keep],
+            self.cls[keep],
+            self.mask_ratio[keep],
+            source=self.source,
+        )
+
+    def save(self, path):
+        """
+        Save detections to a compact binary .npz file.
+
+        Args:
+            path (str): Output file path (e.g., "data/0/detections.npz")
+        """
+        arrays = {
+            "polygons": self.polygons,
+            "conf": self.conf,
+            "cls": self.cls.astype(np.int16),
+            "mask_ratio": self.mask_ratio,
+        }
+        if self.source is not None:
+            arrays["source"] = np.array(self.source)
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load detections saved with `save()`.
+
+        Args:
+            path (str): Path of the .npz file
+
+        Returns:
+            Detections: Loaded detections
+        """
+        with np.load(path) as data:
+            return cls(
+                data["polygons"],
+                data["conf"],
+                data["cls"],
+                data["mask_ratio"],
+                source=str(data["source"]) if "source" in data.files else None,
+            )
@@ -0,0 +1,340 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import cv2
+import numpy as np
+import yaml
+from ultralytics import YOLO
+
+from src.predictor.geometry import match_polygons
+from src.predictor.model_pool import get_model, weights_path
+from src.predictor.predictor import Predictor
+
+
+BACKENDS = ["torch", "onnx", "openvino"]
+
+
+def exported_path(model_type, backend, int8=False):
+    """
+    Return where the exported model of a model type is cached.
+
+    Exported models live next to the PyTorch weights, e.g.
+    "runs/obb/train_nano/weights/best_int8.onnx".
+
+    Args:
+        model_type (ModelClass): Type of model (NANO, MEDIUM, LARGE)
+        backend (str): One of BACKENDS
+        int8 (bool): Whether the model is INT8 quantized
+
+    Returns:
+        str: Path of the exported model file (or directory for OpenVINO)
+    """
+    weights = weights_path(model_type)
+    if backend == "torch":
+        return weights
+
+    base = os.path.splitext(weights)[0]
+    suffix = "_int8" if int8 else ""
+    if backend == "onnx":
+        return f"{base}{suffix}.onnx"
+    if backend == "openvino":
+        return f"{base}{suffix}_openvino_model"
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+
+def sample_calibration_images(data_dirs, count=100, image_name="gm.png", seed=0):
+    """
+    Pick a reproducible random sample of images for INT8 calibration.
+
+    Args:
+        data_dirs (list[str]): Data directories (e.g. "data/0")
+        count (int): Number of images to pick
+        image_name (str): Image file name in each directory
+        seed (int): Random seed of the sample
+
+    Returns:
+        list[str]: Paths of existing images
+    """
+    paths = [os.path.join(d, image_name) for d in data_dirs]
+    paths = [p for p in paths if os.path.exists(p)]
+    random.Random(seed).shuffle(paths)
+    return sorted(paths[:count])
+
+
+def export_model(
+    model_type, backend, int8=False, calibration_images=None, imgsz=640, force=False
+):
+    """
+    Export the model of a model type for a CPU inference backend, once.
+
+    The exported model is cached next to the PyTorch weights and reused on
+    later calls. INT8 models are calibrated on `calibration_images`, which
+    should be a sample of our own grid cells.
+
+    Args:
+        model_type (ModelClass): Type of model (NANO, MEDIUM, LARGE)
+        backend (str): "onnx" or "openvino" ("torch" needs no export)
+        int8 (bool): Apply INT8 post-training quantization
+        calibration_images (list[str]): Images used to calibrate INT8 models
+        imgsz (int): Export image size
+        force (bool): Export again even if a cached model exists
+
+    Returns:
+        str: Path of the exported model
+    """
+    path = exported_path(model_type, backend, int8)
+    if backend == "torch" or (os.path.exists(path) and not force):
+        return path
+
+    if int8 and not calibration_images:
+        raise ValueError(
+            f"INT8 {backend} export of {model_type.value} needs calibration images"
+        )
+
+    print(f"Exporting {model_type.value} model to {backend}{' INT8' if int8 else ''}")
+    model = YOLO(weights_path(model_type))
+
+    if backend == "onnx":
+        fp32_path = exported_path(model_type, "onnx")
+        if not os.path.exists(fp32_path) or force:
+            exported = model.export(format="onnx", imgsz=imgsz, dynamic=True)
+            if os.path.abspath(exported) != os.path.abspath(fp32_path):
+                shutil.move(exported, fp32_path)
+        if int8:
+            quantize_onnx(fp32_path, path, calibration_images, imgsz=imgsz)
+
+    elif backend == "openvino":
+        with tempfile.TemporaryDirectory() as work_dir:
+            export_args = {"format": "openvino", "imgsz": imgsz, "dynamic": True}
+            if int8:
+                export_args["int8"] = True
+                export_args["data"] = _calibration_dataset(
+                    calibration_images, model.names, work_dir
+                )
+            exported = model.export(**export_args)
+        if os.path.abspath(exported) != os.path.abspath(path):
+            shutil.move(exported, path)
+
+    else:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+    print(f"Exported model saved to {path}")
+    return path
+
+
+def _calibration_dataset(calibration_images, names, work_dir):
+    """Write a dataset YAML over the calibration images (labels are not needed)."""
+    images_dir = os.path.join(work_dir, "images")
+    os.makedirs(images_dir)
+    for i, image_path in enumerate(calibration_images):
+        shutil.copy(image_path, os.path.join(images_dir, f"{i}.png"))
+
+    data_path = os.path.join(work_dir, "calibration.yaml")
+    with open(data_path, "w") as f:
+        yaml.safe_dump(
+            {"path": work_dir, "train": "images", "val": "images", "names": names}, f
+        )
+    return data_path
+
+
+def _letterbox(image, imgsz):
+    """Resize and pad an image the same way as the YOLO preprocessing."""
+    height, width = image.shape[:2]
+    ratio = min(imgsz / height, imgsz / width)
+    new_w, new_h = round(width * ratio), round(height * ratio)
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    padded = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    padded[top : top + new_h, left : left + new_w] = resized
+    return padded
+
+
+def quantize_onnx(fp32_path, int8_path, calibration_images, imgsz=640):
+    """
+    Quantize an ONNX model to INT8 (static, QDQ) with ONNX Runtime.
+
+    Args:
+        fp32_path (str): Exported FP32 ONNX model
+        int8_path (str): Output path of the quantized model
+        calibration_images (list[str]): Images used for calibration
+        imgsz (int): Input size used for calibration
+    """
+    try:
+        import onnx
+        from onnxruntime.quantization import (
+            CalibrationDataReader,
+            QuantFormat,
+            QuantType,
+            quantize_static,
+        )
+    except ImportError as e:
+        raise ImportError(
+            "ONNX INT8 quantization needs the onnx and onnxruntime packages"
+        ) from e
+
+    input_name = onnx.load(fp32_path, load_external_data=False).graph.input[0].name
+
+    class GridCellsReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(calibration_images)
+
+        def get_next(self):
+            for path in self.paths:
+                image = cv2.imread(path)
+                if image is None:
+                    continue
+                image = _letterbox(image, imgsz)[:, :, ::-1]  # BGR to RGB
+                tensor = image.transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+                return {input_name: np.ascontiguousarray(tensor)}
+            return None
+
+    quantize_static(
+        fp32_path,
+        int8_path,
+        GridCellsReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+    # Keep the Ultralytics metadata (task, names, imgsz) of the FP32 model
+    fp32_model = onnx.load(fp32_path)
+    int8_model = onnx.load(int8_path)
+    del int8_model.metadata_props[:]
+    int8_model.metadata_props.extend(fp32_model.metadata_props)
+    onnx.save(int8_model, int8_path)
+
+
+def compare_backends(
+    model_type,
+    backend,
+    data_dirs,
+    int8=False,
+    device="cpu",
+    iou_threshold=0.5,
+    mask_threshold=0.5,
+    mask_low_confidence=0.1,
+):
+    """
+    Measure how much an exported backend drifts from the PyTorch model.
+
+    Both models predict the same directories; boxes are matched by IoU and
+    the report lists, per directory and in total, detection counts, recall
+    and precision of the backend relative to PyTorch, the mean confidence and
+    mask ratio differences of matched boxes, high/low confidence box counts
+    and the inference time of each model.
+
+    Args:
+        model_type (ModelClass): Type of model (NANO, MEDIUM, LARGE)
+        backend (str): "onnx" or "openvino"
+        data_dirs (list[str]): Directories with gm.png and osm_mask.png
+        int8 (bool): Compare the INT8 quantized export
+        device (str): Device to run both models on
+        iou_threshold (float): Minimum IoU of matched boxes
+        mask_threshold (float): Mask ratio threshold for high confidence boxes
+        mask_low_confidence (float): Minimum mask ratio of counted boxes
+
+    Returns:
+        dict: Report with "cells" (per directory) and "total" entries
+    """
+    models = {
+        "torch": get_model(model_type, device=device, fuse=True, warmup=True),
+        backend: get_model(
+            model_type, device=device, warmup=True, backend=backend, int8=int8
+        ),
+    }
+
+    def box_counts(detections):
+        counted = detections.mask_ratio >= mask_low_confidence
+        high = counted & (detections.mask_ratio >= mask_threshold)
+        return int(high.sum()), int((counted & ~high).sum())
+
+    cells = []
+    for dir_path in data_dirs:
+        detections, times = {}, {}
+        for name, model in models.items():
+            predictor = Predictor(
+                dir_path,
+                "gm.png",
+                "osm.png",
+                "osm_mask.png",
+                model_type,
+                model=model,
+                device=device,
+            )
+            predictor.load_images()
+            start = time.perf_counter()
+            predictor.predict(load_images=False)
+            times[name] = time.perf_counter() - start
+            detections[name] = predictor.get_detections()
+
+        reference, candidate = detections["torch"], detections[backend]
+        matches = match_polygons(
+            reference.polygons, candidate.polygons, iou_threshold=iou_threshold
+        )
+        ref_idx = np.array([m[0] for m in matches], dtype=int)
+        cand_idx = np.array([m[1] for m in matches], dtype=int)
+
+        cell = {
+            "dir": dir_path,
+            "torch_detections": len(reference),
+            "backend_detections": len(candidate),
+            "matched": len(matches),
+            "torch_time_s": times["torch"],
+            "backend_time_s": times[backend],
+        }
+        cell["torch_high_conf"], cell["torch_low_conf"] = box_counts(reference)
+        cell["backend_high_conf"], cell["backend_low_conf"] = box_counts(candidate)
+        if matches:
+            cell["mean_iou"] = float(np.mean([m[2] for m in matches]))
+            cell["mean_abs_conf_diff"] = float(
+                np.mean(np.abs(reference.conf[ref_idx] - candidate.conf[cand_idx]))
+            )
+            cell["mean_abs_mask_ratio_diff"] = float(
+                np.mean(
+                    np.abs(reference.mask_ratio[ref_idx] - candidate.mask_ratio[cand_idx])
+                )
+            )
+        cells.append(cell)
+
+    total = {
+        key: sum(cell[key] for cell in cells)
+        for key in [
+            "torch_detections",
+            "backend_detections",
+            "matched",
+            "torch_high_conf",
+            "backend_high_conf",
+            "torch_low_conf",
+            "backend_low_conf",
+            "torch_time_s",
+            "backend_time_s",
+        ]
+    }
+    total["cells"] = len(cells)
+    total["recall_vs_torch"] = (
+        total["matched"] / total["torch_detections"] if total["torch_detections"] else 1.0
+    )
+    total["precision_vs_torch"] = (
+        total["matched"] / total["backend_detections"]
+        if total["backend_detections"]
+        else 1.0
+    )
+    if total["backend_time_s"] > 0:
+        total["speedup"] = total["torch_time_s"] / total["backend_time_s"]
+    for key in ["mean_iou", "mean_abs_conf_diff", "mean_abs_mask_ratio_diff"]:
+        values = [cell[key] for cell in cells if key in cell]
+        if values:
+            total[key] = float(np.mean(values))
+
+    return {
+        "model_type": model_type.value,
+        "backend": backend,
+        "int8": int8,
+        "cells": cells,
+        "total": total,
+    }
@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+
+
+def polygon_area(polygon):
+    """Return the area of a convex polygon given as (K, 2) points."""
+    return abs(cv2.contourArea(np.asarray(polygon, dtype=np.float32)))
+
+
+def polygon_iou(polygon_a, polygon_b):
+    """
+    Compute the intersection over union of two convex polygons (e.g. OBB).
+
+    Args:
+        polygon_a: Points of the first polygon, shape (K, 2)
+        polygon_b: Points of the second polygon, shape (K, 2)
+
+    Returns:
+        float: IoU in [0, 1]
+    """
+    a = np.asarray(polygon_a, dtype=np.float32).reshape(-1, 2)
+    b = np.asarray(polygon_b, dtype=np.float32).reshape(-1, 2)
+
+    # Cheap rejection on the axis-aligned bounding rectangles
+    if (
+        a[:, 0].max() <= b[:, 0].min()
+        or b[:, 0].max() <= a[:, 0].min()
+        or a[:, 1].max() <= b[:, 1].min()
+        or b[:, 1].max() <= a[:, 1].min()
+    ):
+        return 0.0
+
+    area_a, area_b = polygon_area(a), polygon_area(b)
+    if area_a <= 0 or area_b <= 0:
+        return 0.0
+
+    # intersectConvexConvex expects consistently oriented convex polygons
+    a = cv2.convexHull(a)
+    b = cv2.convexHull(b)
+    intersection, _ = cv2.intersectConvexConvex(a, b)
+    intersection = max(float(intersection), 0.0)
+
+    union = area_a + area_b - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def match_polygons(polygons_a, polygons_b, iou_threshold=0.5):
+    """
+    Greedily match two sets of polygons by IoU.
+
+    Args:
+        polygons_a: Polygons, shape (N, K, 2)
+        polygons_b: Polygons, shape (M, K, 2)
+        iou_threshold (float): Minimum IoU of a match
+
+    Returns:
+        list: Matches as (index in a, index in b, IoU), best IoU first
+    """
+    candidates = []
+    for i, polygon_a in enumerate(polygons_a):
+        for j, polygon_b in enumerate(polygons_b):
+            iou = polygon_iou(polygon_a, polygon_b)
+            if iou >= iou_threshold:
+                candidates.append((iou, i, j))
+
+    matches, used_a, used_b = [], set(), set()
+    for iou, i, j in sorted(candidates, reverse=True):
+        if i not in used_a and j not in used_b:
+            matches.append((i, j, iou))
+            used_a.add(i)
+            used_b.add(j)
+    return matches
@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+import torch
+
+
+def box_mask_ratios(boxes, mask):
+    """
+    Compute the fraction of every oriented box that lies in the masked area.
+
+    Each polygon is rasterized only inside its own bounding rectangle, so the
+    cost depends on the box sizes and not on the frame size. The result is the
+    same as filling the polygon on a full-size frame and intersecting it with
+    the mask.
+
+    Args:
+        boxes: Array (or tensor) of shape (N, 4, 2) or (N, 8) with box corners
+        mask: Grayscale mask image, non-zero pixels are the masked area
+
+    Returns:
+        numpy.ndarray: Array of N ratios (0 for boxes fully outside the frame),
+            aligned with the input boxes
+    """
+    if isinstance(boxes, torch.Tensor):
+        boxes = boxes.cpu().numpy()
+
+    points = np.asarray(boxes).reshape(-1, 4, 2).astype(np.int32)
+    ratios = np.zeros(len(points), dtype=np.float64)
+    if len(points) == 0:
+        return ratios
+
+    parking = mask > 0
+    height, width = parking.shape[:2]
+
+    # Bounding rectangles of all boxes, clipped to the frame
+    x0 = np.clip(points[:, :, 0].min(axis=1), 0, width)
+    y0 = np.clip(points[:, :, 1].min(axis=1), 0, height)
+    x1 = np.clip(points[:, :, 0].max(axis=1) + 1, 0, width)
+    y1 = np.clip(points[:, :, 1].max(axis=1) + 1, 0, height)
+
+    for i in range(len(points)):
+        if x1[i] <= x0[i] or y1[i] <= y0[i]:
+            continue
+
+        # Rasterize the polygon in local coordinates of its bounding rectangle
+        box_mask = np.zeros((y1[i] - y0[i], x1[i] - x0[i]), dtype=np.uint8)
+        local_points = points[i] - np.array([x0[i], y0[i]], dtype=np.int32)
+        cv2.fillPoly(box_mask, [local_points.reshape((-1, 1, 2))], 1)
+
+        box_area = np.count_nonzero(box_mask)
+        if box_area > 0:
+            window = parking[y0[i] : y1[i], x0[i] : x1[i]]
+            ratios[i] = np.count_nonzero(window[box_mask > 0]) / box_area
+
+    return ratios
+
+
+def parking_region(mask):
+    """
+    Measure how much of the frame the parking mask covers.
+
+    Args:
+        mask: Grayscale mask image, non-zero pixels are the masked area
+
+    Returns:
+        tuple: (fraction of masked pixels, bounding rectangle (x, y, w, h) of
+            the masked pixels or None if the mask is empty)
+    """
+    area = cv2.countNonZero(mask)
+    if area == 0:
+        return 0.0, None
+    return area / mask.size, cv2.boundingRect(cv2.findNonZero(mask))
@@ -0,0 +1,121 @@
+import threading
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+
+def default_device():
+    """Return the torch device used for inference ("cuda" if available, else "cpu")."""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def weights_path(model_type):
+    """
+    Return the path of the trained weights for a model type.
+
+    Args:
+        model_type (ModelClass): Type of model (NANO, MEDIUM, LARGE)
+
+    Returns:
+        str: Path to the best.pt file of the given model
+    """
+    return f"./runs/obb/train_{model_type.value}/weights/best.pt"
+
+
+class ModelPool:
+    """
+    Process-wide registry of loaded YOLO models.
+
+    Each (model type, device, backend, INT8, fused) combination is loaded
+    once and then shared by every Predictor that asks for it, so a grid run
+    pays the load cost only once.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        model_type,
+        device=None,
+        fuse=False,
+        warmup=False,
+        backend="torch",
+        int8=False,
+    ):
+        """
+        Return a loaded model, loading it on first use.
+
+        Args:
+            model_type (ModelClass): Type of model to load (NANO, MEDIUM, LARGE)
+            device (str): Device to move the model to (default: cuda if available)
+            fuse (bool): Fuse Conv2d + BatchNorm layers right after loading
+                (PyTorch backend only)
+            warmup (bool): Run a dummy forward pass right after loading
+            backend (str): "torch", "onnx" or "openvino"; other backends are
+                exported next to the weights on first use
+            int8 (bool): Use the INT8 quantized export (must already exist)
+
+        Returns:
+            YOLO: Loaded model, shared between callers
+        """
+        device = device or default_device()
+        # Fusing only applies to the PyTorch backend
+        fuse = bool(fuse) and backend == "torch"
+        key = (model_type, device, backend, int8, fuse)
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                if backend == "torch":
+                    model = YOLO(weights_path(model_type))
+                    model.to(device)
+                    if fuse:
+                        model.fuse()
+                else:
+                    from src.predictor.export import export_model
+
+                    model = YOLO(export_model(model_type, backend, int8), task="obb")
+                if warmup:
+                    self._warmup(model, device)
+                self._models[key] = model
+                print(
+                    f"Loaded {model_type.value} model ({backend}"
+                    f"{' INT8' if int8 else ''}{' fused' if fuse else ''}) on {device}"
+                )
+
+        return model
+
+    def preload(self, model_types, device=None, fuse=True, warmup=True, **kwargs):
+        """Load several model types up front (e.g. before a long grid run)."""
+        for model_type in model_types:
+            self.get(model_type, device=device, fuse=fuse, warmup=warmup, **kwargs)
+
+    def clear(self):
+        """Drop every loaded model."""
+        with self._lock:
+            self._models.clear()
+
+    @staticmethod
+    def _warmup(model, device, imgsz=640):
+        dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+        model.predict(dummy, device=device, verbose=False)
+
+
+# Shared pool used by Predictor when no model is passed explicitly
+model_pool = ModelPool()
+
+
+def get_model(
+    model_type, device=None, fuse=False, warmup=False, backend="torch", int8=False
+):
+    """Shortcut for `model_pool.get(...)`."""
+    return model_pool.get(
+        model_type,
+        device=device,
+        fuse=fuse,
+        warmup=warmup,
+        backend=backend,
+        int8=int8,
+    )
@@ -1,9 +1,15 @@
 import os
+import json
 import cv2
 import numpy as np
-import torch
 from enum import Enum
-from ultralytics import YOLO
+
+from src.predictor.detections import Detections
+from src.predictor.mask_overlap import box_mask_ratios
+from src.predictor.model_pool import default_device, get_model
+from src.predictor.roi import predict_windows
+from src.predictor.tiling import predict_tiles
+from src.scraper.georef import load_georef
 
 
 class ModelClass(Enum):
@@ -13,7 +19,22 @@ class ModelClass(Enum):
 
 
 class Predictor:
-    def __init__(self, img_data_folder, image_gm, image_osm, parking_mask, model_type):
+    def __init__(
+        self,
+        img_data_folder,
+        image_gm,
+        image_osm,
+        parking_mask,
+        model_type,
+        model=None,
+        device=None,
+        roi_padding=None,
+        backend="torch",
+        int8=False,
+        tile_size=None,
+        tile_overlap=128,
+        nms_iou=0.5,
+    ):
         """
         Initialize the predictor with paths and model type.
 
@@ -22,8 +43,24 @@ class Predictor:
             image_gm (str): Name of Google Maps image (e.g., "cropped_gm.png")
             image_osm (str): Name of OpenStreetMap image (e.g., "cropped_osm.png")
             parking_mask (str): Name of mask image (e.g., "cropped_osm_mask.png")
-            model_type (ModelClass): Type of model to use (NANO, MEDIUM, LARGE)
+            model_type (ModelClass): Type of model to use (NANO, MEDIUM, LARGE),
+                None to work without a model (e.g. on saved detections)
+            model (YOLO): Already loaded model; if None, it is taken from the
+                shared model pool (loaded once per process)
+            device (str): Device to run inference on (default: cuda if available)
+            roi_padding (int): If set, run the model only on windows around the
+                parking regions of the mask, padded by this many pixels
+            backend (str): Inference backend of the pooled model ("torch",
+                "onnx" or "openvino"), exported on first use
+            int8 (bool): Use the INT8 quantized export of the backend
+            tile_size (int): If set, predict full-resolution tiles of this size
+                and merge them with rotated NMS (for large captures)
+            tile_overlap (int): Overlap of neighbouring tiles in pixels
+            nms_iou (float): IoU above which duplicates across tiles are merged
         """
+        if tile_size is not None and roi_padding is not None:
+            raise ValueError("Tiled and mask ROI inference cannot be combined")
+
         self.img_data_folder = img_data_folder
         self.image_gm_path = os.path.join(img_data_folder, image_gm)
         self.image_osm_path = os.path.join(img_data_folder, image_osm)
@@ -31,19 +68,29 @@ class Predictor:
         self.model_type = model_type
 
         # Determine device
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device or default_device()
 
-        # Load model
-        model_name = f"./runs/obb/train_{model_type.value}/weights/best.pt"
-        self.model = YOLO(model_name)
-        self.model.to(self.device)
+        # Reuse a loaded model instead of reading the weights for every folder
+        if model is None and model_type is not None:
+            model = get_model(model_type, device=self.device, backend=backend, int8=int8)
+        self.model = model
+        self.roi_padding = roi_padding
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.nms_iou = nms_iou
 
         self.results = None
+        self.detections = None
+        self.georef = None
 
     def load_images(self):
         """Load input images and mask."""
         self.img_gm = cv2.imread(self.image_gm_path)
         self.img_osm = cv2.imread(self.image_osm_path)
+        self.load_mask()
+
+    def load_mask(self):
+        """Load only the parking mask (enough to summarize saved detections)."""
         self.mask = cv2.imread(self.parking_mask_path, cv2.IMREAD_GRAYSCALE)
 
     def is_in_mask(self, box_points):
@@ -52,42 +99,274 @@ class Predictor:
 
         Args:
             box_points: Array of (x,y) points defining the bounding box
-            threshold: Minimum percentage of box area that should be in masked area
 
         Returns:
             float: Ratio of box points in masked area
         """
-        # Convert tensor to numpy array if needed
-        if isinstance(box_points, torch.Tensor):
-            box_points = box_points.cpu().numpy()
+        return float(box_mask_ratios(box_points, self.mask)[0])
+
+    def get_detections(self):
+        """
+        Return scored detections, computing them on first use.
+
+        Box polygons, confidences, classes and mask ratios are extracted from
+        the results once per prediction and shared by `visualize()` and
+        `summarize()`.
+
+        Returns:
+            Detections: Scored detections (empty if there are no results)
+        """
+        if self.detections is None:
+            self.detections = Detections.from_results(self.results, self.mask)
+            if self.model_type is not None:
+                self.detections.source = self.model_type.value
+        return self.detections
 
-        # Create a polygon mask from the box points
-        box_mask = np.zeros_like(self.mask)
-        points = box_points.reshape((-1, 1, 2)).astype(np.int32)
-        cv2.fillPoly(box_mask, [points], 255)
+    def skip_prediction(self):
+        """
+        Mark the folder as predicted without any detection, without running
+        the model (e.g. when there is no parking in the mask). Only the mask
+        is loaded, so `summarize()` works but `visualize()` does not.
+        """
+        self.load_mask()
+        self.results = []
+        self.detections = Detections.empty()
 
-        # Count pixels in box that are also in mask
-        intersection = cv2.bitwise_and(box_mask, self.mask)
-        box_area = np.sum(box_mask > 0)
-        intersection_area = np.sum(intersection > 0)
+    def save_detections(self, file_name="detections.npz"):
+        """
+        Save raw scored detections, so they can be re-summarized later with
+        different thresholds without running the model again.
 
-        # Return ratio of intersection area to box area
-        return intersection_area / box_area if box_area > 0 else 0
+        Args:
+            file_name (str): Name of the output file in the data folder
 
-    def predict(self):
+        Returns:
+            str: Path of the saved file
+        """
+        path = os.path.join(self.img_data_folder, file_name)
+        self.get_detections().save(path)
+        return path
+
+    def load_detections(self, file_name="detections.npz"):
+        """
+        Load detections saved with `save_detections()` together with the mask.
+
+        Args:
+            file_name (str): Name of the detections file in the data folder
+
+        Returns:
+            Detections: Loaded detections
+        """
+        self.load_mask()
+        self.detections = Detections.load(
+            os.path.join(self.img_data_folder, file_name)
+        )
+        return self.detections
+
+    def georeference(self):
+        """
+        Return the georeference of the Google Maps image, loading it on first use.
+
+        Returns:
+            GeoReference: Pixel to ground mapping saved at capture time (or
+                derived from coords.json for older captures)
+        """
+        if self.georef is None:
+            self.georef = load_georef(
+                self.img_data_folder, os.path.basename(self.image_gm_path)
+            )
+            if self.georef is None:
+                raise ValueError(f"No georeference for {self.image_gm_path}")
+        return self.georef
+
+    def geo_polygons(self):
+        """
+        Return every detected box as a WGS84 polygon.
+
+        Works on saved detections too (see `load_detections()`), so ground
+        geometry never has to be re-derived from pixels downstream.
+
+        Returns:
+            numpy.ndarray: Box corners as (longitude, latitude), shape (N, 4, 2)
+        """
+        return self.georeference().pixels_to_lonlat(self.get_detections().polygons)
+
+    def save_geojson(self, file_name="detections.geojson"):
+        """
+        Save the detections as a GeoJSON FeatureCollection of box polygons.
+
+        Args:
+            file_name (str): Name of the output file in the data folder
+
+        Returns:
+            str: Path of the saved file
+        """
+        detections = self.get_detections()
+        features = []
+        for polygon, conf, cls, mask_ratio in zip(
+            self.geo_polygons(),
+            detections.conf,
+            detections.cls,
+            detections.mask_ratio,
+        ):
+            ring = polygon.tolist() + [polygon[0].tolist()]
+            features.append(
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "Polygon", "coordinates": [ring]},
+                    "properties": {
+                        "conf": float(conf),
+                        "cls": int(cls),
+                        "mask_ratio": float(mask_ratio),
+                    },
+                }
+            )
+
+        path = os.path.join(self.img_data_folder, file_name)
+        with open(path, "w") as f:
+            json.dump({"type": "FeatureCollection", "features": features}, f)
+        return path
+
+    def inference_size(self):
+        """Return the image size the model was trained with (default: 640)."""
+        imgsz = getattr(self.model, "overrides", {}).get("imgsz", 640)
+        return max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+    def predict(self, load_images=True):
         """
         Make predictions on the loaded images.
 
+        Args:
+            load_images (bool): Whether to (re)load the images from disk first;
+                pass False if `load_images()` was already called
+
         Returns:
             list: List of results from the model prediction
         """
-        self.load_images()
+        if load_images:
+            self.load_images()
 
         # Make prediction on Google Maps image
-        self.results = self.model.predict(self.img_gm, device=self.device)
+        self.predict_batch([self])
 
         return self.results
 
+    @classmethod
+    def predict_many(
+        cls,
+        img_data_folders,
+        model_type,
+        image_gm="gm.png",
+        image_osm="osm.png",
+        parking_mask="osm_mask.png",
+        batch_size=8,
+        model=None,
+        device=None,
+        roi_padding=None,
+        backend="torch",
+        int8=False,
+        **options,
+    ):
+        """
+        Make predictions for several folders, batching the Google Maps images.
+
+        Images from up to `batch_size` folders are stacked into one forward
+        pass and the results are split back so that every yielded predictor
+        looks as if `predict()` had been called on it.
+
+        Args:
+            img_data_folders (list[str]): Folders with image data
+            model_type (ModelClass): Type of model to use (NANO, MEDIUM, LARGE)
+            image_gm (str): Name of Google Maps image
+            image_osm (str): Name of OpenStreetMap image
+            parking_mask (str): Name of mask image
+            batch_size (int): Number of images per forward pass
+            model (YOLO): Already loaded model (default: taken from the model pool)
+            device (str): Device to run inference on (default: cuda if available)
+            roi_padding (int): If set, predict only windows around parking regions
+            backend (str): Inference backend of the pooled model
+            int8 (bool): Use the INT8 quantized export of the backend
+            **options: Other keyword arguments of the constructor (e.g. tiling)
+
+        Yields:
+            Predictor: Predictor with loaded images and results, in input order
+        """
+        device = device or default_device()
+        if model is None:
+            model = get_model(model_type, device=device, backend=backend, int8=int8)
+
+        batch_size = max(1, int(batch_size))
+        for start in range(0, len(img_data_folders), batch_size):
+            predictors = [
+                cls(
+                    folder,
+                    image_gm,
+                    image_osm,
+                    parking_mask,
+                    model_type,
+                    model=model,
+                    device=device,
+                    roi_padding=roi_padding,
+                    **options,
+                )
+                for folder in img_data_folders[start : start + batch_size]
+            ]
+            for predictor in predictors:
+                predictor.load_images()
+
+            cls.predict_batch(predictors)
+
+            yield from predictors
+
+    @staticmethod
+    def predict_batch(predictors):
+        """
+        Make predictions for predictors with already loaded images in one
+        forward pass. All predictors must share the same model and device.
+
+        Args:
+            predictors (list[Predictor]): Predictors after `load_images()`
+
+        Returns:
+            list[Predictor]: The same predictors, each with its own results
+        """
+        if not predictors:
+            return predictors
+
+        first = predictors[0]
+        model, device = first.model, first.device
+
+        # One forward pass for the whole batch, one Results object per image
+        if first.tile_size is not None:
+            results = predict_tiles(
+                model,
+                [predictor.img_gm for predictor in predictors],
+                device,
+                tile_size=first.tile_size,
+                overlap=first.tile_overlap,
+                iou_threshold=first.nms_iou,
+            )
+        elif first.roi_padding is not None:
+            results = predict_windows(
+                model,
+                [predictor.img_gm for predictor in predictors],
+                [predictor.mask for predictor in predictors],
+                device,
+                padding=first.roi_padding,
+                imgsz=first.inference_size(),
+            )
+        else:
+            results = model.predict(
+                [predictor.img_gm for predictor in predictors],
+                device=device,
+                batch=len(predictors),
+            )
+        for predictor, result in zip(predictors, results):
+            predictor.results = [result]
+            predictor.detections = None
+
+        return predictors
+
     def visualize(
         self,
         mask_threshold=0.7,
@@ -113,49 +392,38 @@ class Predictor:
         else:
             vis_img = self.img_osm.copy()
 
-        # Process each detected object
-        for result in self.results:
-            if hasattr(result, "obb") and result.obb is not None:
-                for i, box in enumerate(result.obb.xyxyxyxy):
-                    conf = float(result.obb.conf[i])
-
-                    # Convert tensor to numpy if needed
-                    if isinstance(box, torch.Tensor):
-                        box = box.cpu().numpy()
-
-                    # Check if box is in masked area and get ratio
-                    mask_ratio = self.is_in_mask(box)
-
-                    # Only process boxes with sufficient confidence and mask overlap
-                    if mask_ratio >= mask_low_confidence:
-                        # Choose color based on confidence
-                        if mask_ratio >= mask_threshold:
-                            color = (0, 255, 0)  # Green for high confidence
-                        else:
-                            color = (0, 0, 255)  # Red for low confidence
-
-                        # Draw the oriented bounding box
-                        points = box.reshape((-1, 1, 2)).astype(np.int32)
-                        cv2.polylines(
-                            vis_img, [points], isClosed=True, color=color, thickness=2
-                        )
-
-                        # Get the minimum x and y for text positioning
-                        box_reshaped = box.reshape(4, 2)
-                        min_x = int(np.min(box_reshaped[:, 0]))
-                        min_y = int(np.min(box_reshaped[:, 1]))
-                        text_pos = (min_x, min_y - 10)
-
-                        # Add confidence score text
-                        cv2.putText(
-                            vis_img,
-                            f"{conf:.2f}",
-                            text_pos,
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.5,
-                            color,
-                            2,
-                        )
+        # Process each detected object with sufficient mask overlap
+        detections = self.get_detections()
+        for i in np.flatnonzero(detections.mask_ratio >= mask_low_confidence):
+            box = detections.polygons[i]
+            conf = float(detections.conf[i])
+            mask_ratio = float(detections.mask_ratio[i])
+
+            # Choose color based on confidence
+            if mask_ratio >= mask_threshold:
+                color = (0, 255, 0)  # Green for high confidence
+            else:
+                color = (0, 0, 255)  # Red for low confidence
+
+            # Draw the oriented bounding box
+            points = box.reshape((-1, 1, 2)).astype(np.int32)
+            cv2.polylines(vis_img, [points], isClosed=True, color=color, thickness=2)
+
+            # Get the minimum x and y for text positioning
+            min_x = int(np.min(box[:, 0]))
+            min_y = int(np.min(box[:, 1]))
+            text_pos = (min_x, min_y - 10)
+
+            # Add confidence score text
+            cv2.putText(
+                vis_img,
+                f"{conf:.2f}",
+                text_pos,
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.5,
+                color,
+                2,
+            )
 
         # Save the visualization image if a path is provided
         if save_path:
@@ -165,7 +433,14 @@ class Predictor:
         # Return the visualization image
         return vis_img
 
-    def summarize(self, mask_threshold=0.7, mask_low_confidence=0.1, save=False):
+    def summarize(
+        self,
+        mask_threshold=0.7,
+        mask_low_confidence=0.1,
+        save=False,
+        stats_name="prediction_stats",
+        verbose=True,
+    ):
         """
         Print summary of predictions with detailed statistics.
 
@@ -173,11 +448,13 @@ class Predictor:
             mask_threshold: Threshold for high confidence (green boxes)
             mask_low_confidence: Minimum threshold for low confidence (red boxes)
             save: Whether to save the stats to JSON and TXT files
+            stats_name: Base name of the saved stats files
+            verbose: Whether to print the summary
 
         Returns:
             dict: Dictionary containing summary statistics
         """
-        if self.results is None:
+        if self.results is None and self.detections is None:
             print("No results to summarize. Please run predict() first.")
             return {}
 
@@ -194,43 +471,32 @@ class Predictor:
         high_conf_boxes_mask = np.zeros_like(self.mask)
 
         # Collect data from all boxes
-        for result in self.results:
-            if hasattr(result, "obb") and result.obb is not None:
-                for i, box in enumerate(result.obb.xyxyxyxy):
-                    conf = float(result.obb.conf[i])
-
-                    # Convert tensor to numpy if needed
-                    if isinstance(box, torch.Tensor):
-                        box = box.cpu().numpy()
-
-                    # Get mask ratio
-                    mask_ratio = self.is_in_mask(box)
-
-                    if mask_ratio >= mask_low_confidence:
-                        all_confs.append(conf)
-                        all_mask_ratios.append(mask_ratio)
-
-                        # Add box to appropriate boxes list
-                        box_data = {
-                            "box": box,
-                            "conf": conf,
-                            "mask_ratio": mask_ratio,
-                            "cls": (
-                                int(result.obb.cls[i])
-                                if hasattr(result.obb, "cls")
-                                else None
-                            ),
-                        }
-
-                        # Create a box mask for area coverage calculation
-                        points = box.reshape((-1, 1, 2)).astype(np.int32)
-                        cv2.fillPoly(all_boxes_mask, [points], 255)
-
-                        if mask_ratio >= mask_threshold:
-                            high_conf_boxes.append(box_data)
-                            cv2.fillPoly(high_conf_boxes_mask, [points], 255)
-                        else:
-                            low_conf_boxes.append(box_data)
+        detections = self.get_detections()
+        for i in np.flatnonzero(detections.mask_ratio >= mask_low_confidence):
+            box = detections.polygons[i]
+            conf = float(detections.conf[i])
+            mask_ratio = float(detections.mask_ratio[i])
+
+            all_confs.append(conf)
+            all_mask_ratios.append(mask_ratio)
+
+            # Add box to appropriate boxes list
+            box_data = {
+                "box": box,
+                "conf": conf,
+                "mask_ratio": mask_ratio,
+                "cls": int(detections.cls[i]),
+            }
+
+            # Create a box mask for area coverage calculation
+            points = box.reshape((-1, 1, 2)).astype(np.int32)
+            cv2.fillPoly(all_boxes_mask, [points], 255)
+
+            if mask_ratio >= mask_threshold:
+                high_conf_boxes.append(box_data)
+                cv2.fillPoly(high_conf_boxes_mask, [points], 255)
+            else:
+                low_conf_boxes.append(box_data)
 
         # Calculate mask coverage statistics
         total_mask_area = np.sum(self.mask > 0)
@@ -345,14 +611,13 @@ class Predictor:
         summary_text += "=============================\n"
 
         # Print the summary
-        print(summary_text)
+        if verbose:
+            print(summary_text)
 
         # Save to files if requested
         if save:
-            import json
-
             # Generate base filename with timestamp
-            base_path = os.path.join(self.img_data_folder, f"prediction_stats")
+            base_path = os.path.join(self.img_data_folder, stats_name)
 
             # Save as JSON (excluding non-serializable numpy arrays from boxes)
             json_stats = {k: v for k, v in stats.items() if k != "boxes"}
@@ -362,15 +627,20 @@ class Predictor:
                 if "box" in box:
                     del box["box"]
 
+            parameters = {
+                "mask_threshold": mask_threshold,
+                "mask_low_confidence": mask_low_confidence,
+            }
+            # Record which model produced the detections (e.g. in cascade mode)
+            if detections.source is not None:
+                parameters["model"] = detections.source
+
             json_path = f"{base_path}.json"
             with open(json_path, "w") as f:
                 json.dump(
                     {
                         "stats": json_stats,
-                        "parameters": {
-                            "mask_threshold": mask_threshold,
-                            "mask_low_confidence": mask_low_confidence,
-                        },
+                        "parameters": parameters,
                         "high_confidence_boxes": high_conf_boxes,
                         "low_confidence_boxes": low_conf_boxes,
                     },
@@ -383,6 +653,7 @@ class Predictor:
             with open(txt_path, "w", encoding="utf-8") as f:
                 f.write(summary_text)
 
-            print(f"Stats saved to {json_path} and {txt_path}")
+            if verbose:
+                print(f"Stats saved to {json_path} and {txt_path}")
 
         return stats
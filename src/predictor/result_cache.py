@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+CACHE_FILE = ".prediction_cache.json"
+CACHE_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file (or of all files in a directory)."""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(file_digest(file_path, chunk_size).encode())
+        return digest.hexdigest()
+
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def config_digest(**config):
+    """Return a digest of JSON-serializable run settings (thresholds, weights...)."""
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class ResultCache:
+    """
+    Index of predicted directories keyed by a hash of their inputs and settings.
+
+    A directory is up to date when the content of its input files and the run
+    settings (weights, backend, thresholds...) are the same as when its
+    outputs were written, and these outputs still exist. File contents are
+    only hashed again when a file's size or modification time changed, so
+    checking an unchanged directory costs a few `stat` calls.
+
+    Every entry records the outputs its directory was written with, so
+    directories handled without the model (fewer outputs) are up to date too.
+
+    The index is a JSON file stored in the data directory.
+    """
+
+    def __init__(self, data_dir, input_files, output_files, cache_file=CACHE_FILE):
+        """
+        Args:
+            data_dir (str): Base directory of the data directories
+            input_files (list[str]): Input file names hashed in each directory
+            output_files (list[str]): Output file names that must exist in an
+                up-to-date directory, unless `update` recorded others
+            cache_file (str): Index file name inside `data_dir`
+        """
+        self.path = os.path.join(data_dir, cache_file)
+        self.input_files = list(input_files)
+        self.output_files = list(output_files)
+        self.entries = {}
+        self._pending = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    index = json.load(f)
+                if index.get("version") == CACHE_VERSION:
+                    self.entries = index.get("entries", {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable prediction cache {self.path}: {e}")
+
+    def _fingerprint(self, dir_path):
+        """Return {file name: [size, mtime_ns, sha256]} of the inputs of a directory."""
+        entry = self.entries.get(os.path.normpath(dir_path), {})
+        known = entry.get("inputs", {})
+
+        inputs = {}
+        for name in self.input_files:
+            stat = os.stat(os.path.join(dir_path, name))
+            previous = known.get(name)
+            if previous and previous[:2] == [stat.st_size, stat.st_mtime_ns]:
+                inputs[name] = previous
+            else:
+                digest = file_digest(os.path.join(dir_path, name))
+                inputs[name] = [stat.st_size, stat.st_mtime_ns, digest]
+        return inputs
+
+    def _is_current(self, dir_path, key, inputs):
+        entry = self.entries.get(os.path.normpath(dir_path))
+        if entry is None or entry.get("key") != key:
+            return False
+        if any(
+            entry["inputs"].get(name, [None] * 3)[2] != value[2]
+            for name, value in inputs.items()
+        ):
+            return False
+        return all(
+            os.path.exists(os.path.join(dir_path, name))
+            for name in entry.get("outputs", self.output_files)
+        )
+
+    def split(self, dir_paths, key, workers=4, force=False):
+        """
+        Split directories into the ones to predict and the up-to-date ones.
+
+        Fingerprints of the directories to predict are kept until `update`.
+
+        Args:
+            dir_paths (list[str]): Directories with all input files present
+            key (str): Digest of the run settings (see `config_digest`)
+            workers (int): Threads hashing input files
+            force (bool): Treat every directory as out of date
+
+        Returns:
+            tuple: (directories to predict, up-to-date directories)
+        """
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            fingerprints = list(executor.map(self._fingerprint, dir_paths))
+
+        stale, current = [], []
+        for dir_path, inputs in zip(dir_paths, fingerprints):
+            if not force and self._is_current(dir_path, key, inputs):
+                current.append(dir_path)
+            else:
+                stale.append(dir_path)
+                self._pending[os.path.normpath(dir_path)] = (key, inputs)
+        return stale, current
+
+    def update(self, dir_paths, output_files=None):
+        """
+        Mark directories fingerprinted by `split` as predicted and save the index.
+
+        Args:
+            dir_paths (list[str]): Directories whose outputs were written
+            output_files (list[str]): Outputs these directories were written
+                with (default: the cache's `output_files`)
+        """
+        outputs = list(output_files or self.output_files)
+        for dir_path in dir_paths:
+            pending = self._pending.pop(os.path.normpath(dir_path), None)
+            if pending is not None:
+                key, inputs = pending
+                self.entries[os.path.normpath(dir_path)] = {
+                    "key": key,
+                    "inputs": inputs,
+                    "outputs": outputs,
+                }
+        self.save()
+
+    def discard(self, dir_paths):
+        """Forget directories, e.g. after their outputs were rewritten."""
+        for dir_path in dir_paths:
+            self.entries.pop(os.path.normpath(dir_path), None)
+        self.save()
+
+    def save(self):
+        """Write the index atomically."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "entries": self.entries}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,187 @@
+import math
+import cv2
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+
+def merge_rectangles(rectangles):
+    """
+    Merge overlapping rectangles until no two of them overlap.
+
+    Args:
+        rectangles (list): Rectangles as (x0, y0, x1, y1)
+
+    Returns:
+        list: Non-overlapping rectangles as (x0, y0, x1, y1)
+    """
+    rectangles = [tuple(r) for r in rectangles]
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for rect in rectangles:
+            for i, other in enumerate(result):
+                if (
+                    rect[0] < other[2]
+                    and other[0] < rect[2]
+                    and rect[1] < other[3]
+                    and other[1] < rect[3]
+                ):
+                    result[i] = (
+                        min(rect[0], other[0]),
+                        min(rect[1], other[1]),
+                        max(rect[2], other[2]),
+                        max(rect[3], other[3]),
+                    )
+                    merged = True
+                    break
+            else:
+                result.append(rect)
+        rectangles = result
+    return rectangles
+
+
+def mask_windows(mask, padding=32, min_area=16):
+    """
+    Find padded windows around the connected regions of a parking mask.
+
+    Regions closer than `padding` pixels end up in one window, and windows
+    that still overlap are merged, so every image pixel is inside at most one
+    window.
+
+    Args:
+        mask: Grayscale mask image, non-zero pixels are the masked area
+        padding (int): Margin around each region, so that cars on the region
+            border are fully visible
+        min_area (int): Regions with fewer pixels are ignored
+
+    Returns:
+        list: Windows as (x0, y0, x1, y1) in image coordinates
+    """
+    height, width = mask.shape[:2]
+    binary = (mask > 0).astype(np.uint8)
+
+    # Drop small specks before dilation, which would grow them to full windows
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+    keep[0] = False
+    binary = keep[labels].astype(np.uint8)
+
+    if padding > 0:
+        kernel = cv2.getStructuringElement(
+            cv2.MORPH_RECT, (2 * padding + 1, 2 * padding + 1)
+        )
+        binary = cv2.dilate(binary, kernel)
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+
+    windows = []
+    for label in range(1, count):
+        x, y, w, h, _ = (int(v) for v in stats[label])
+        windows.append((x, y, min(x + w, width), min(y + h, height)))
+
+    return merge_rectangles(windows)
+
+
+def predict_windows(
+    model,
+    images,
+    masks,
+    device,
+    padding=32,
+    imgsz=640,
+    max_window_fraction=0.6,
+    names=None,
+):
+    """
+    Run the detector only on padded windows around the parking regions.
+
+    Windows are scaled with the same factor as a full-frame pass, so cars keep
+    the size the model expects, padded to one common tile size and predicted
+    in a single batch. Detections are mapped back to full-image coordinates
+    and returned as one Results object per image. Images whose windows cover
+    most of the frame are predicted full-frame, as cropping would not save
+    anything there.
+
+    Args:
+        model (YOLO): Loaded model
+        images (list): Full-frame images (BGR)
+        masks (list): Parking masks aligned with the images
+        device (str): Device to run inference on
+        padding (int): Margin around each parking region
+        imgsz (int): Inference size of a full-frame pass
+        max_window_fraction (float): Images whose windows cover more than this
+            fraction of the frame are predicted full-frame
+        names (dict): Class names (default: model.names)
+
+    Returns:
+        list: One Results object per image, with OBB in image coordinates
+    """
+    names = names if names is not None else model.names
+
+    crops, owners, full_frame = [], [], []
+    for index, (image, mask) in enumerate(zip(images, masks)):
+        height, width = image.shape[:2]
+        windows = mask_windows(mask, padding=padding)
+        windows_area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in windows)
+        if windows_area > max_window_fraction * height * width:
+            full_frame.append(index)
+            continue
+
+        scale = imgsz / max(height, width)
+        for x0, y0, x1, y1 in windows:
+            crop = image[y0:y1, x0:x1]
+            crop_w = max(1, round((x1 - x0) * scale))
+            crop_h = max(1, round((y1 - y0) * scale))
+            crop = cv2.resize(crop, (crop_w, crop_h), interpolation=cv2.INTER_AREA)
+            crops.append(crop)
+            owners.append((index, x0, y0, scale))
+
+    detections = [[] for _ in images]
+    if crops:
+        # Pad every crop to one tile size, so the model does not rescale it
+        tile = max(max(crop.shape[:2]) for crop in crops)
+        tile = min(imgsz, max(32, math.ceil(tile / 32) * 32))
+        tiles = []
+        for crop in crops:
+            padded = np.full((tile, tile, 3), 114, dtype=np.uint8)
+            padded[: crop.shape[0], : crop.shape[1]] = crop
+            tiles.append(padded)
+
+        results = model.predict(tiles, device=device, imgsz=tile, batch=len(tiles))
+        for crop, (index, x0, y0, scale), result in zip(crops, owners, results):
+            if result.obb is None or len(result.obb) == 0:
+                continue
+
+            data = result.obb.data.clone()
+            # Drop boxes centered in the padding added around the crop
+            inside = (data[:, 0] < crop.shape[1]) & (data[:, 1] < crop.shape[0])
+            data = data[inside]
+
+            # Map (x, y, w, h) back to full-image coordinates
+            data[:, :4] /= scale
+            data[:, 0] += x0
+            data[:, 1] += y0
+            detections[index].append(data.cpu())
+
+    if full_frame:
+        results = model.predict(
+            [images[index] for index in full_frame],
+            device=device,
+            imgsz=imgsz,
+            batch=len(full_frame),
+        )
+        for index, result in zip(full_frame, results):
+            if result.obb is not None:
+                detections[index].append(result.obb.data.cpu())
+
+    merged = []
+    for image, image_detections in zip(images, detections):
+        if image_detections:
+            obb = torch.cat(image_detections)
+        else:
+            obb = torch.zeros((0, 7), dtype=torch.float32)
+        merged.append(Results(image, path="", names=names, obb=obb))
+
+    return merged
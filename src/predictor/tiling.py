@@ -0,0 +1,195 @@
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+from src.predictor.geometry import polygon_iou
+
+
+def tile_grid(height, width, tile_size=640, overlap=128):
+    """
+    Split an image into overlapping tiles covering it completely.
+
+    The last row and column of tiles are aligned to the image border, so
+    every tile has the full size when the image is at least one tile large.
+
+    Args:
+        height (int): Image height
+        width (int): Image width
+        tile_size (int): Tile side in pixels
+        overlap (int): Overlap of neighbouring tiles in pixels; should be
+            larger than the largest car
+
+    Returns:
+        list: Tiles as (x0, y0, x1, y1)
+    """
+    if overlap >= tile_size:
+        raise ValueError("Tile overlap must be smaller than the tile size")
+
+    step = tile_size - overlap
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        return positions + [length - tile_size]
+
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def xywhr_to_polygons(xywhr):
+    """
+    Convert rotated boxes (cx, cy, w, h, angle in radians) to corner points.
+
+    Args:
+        xywhr: Array of shape (N, 5)
+
+    Returns:
+        numpy.ndarray: Corners, shape (N, 4, 2)
+    """
+    xywhr = np.asarray(xywhr, dtype=np.float64).reshape(-1, 5)
+    center, size, angle = xywhr[:, :2], xywhr[:, 2:4], xywhr[:, 4]
+    cos, sin = np.cos(angle), np.sin(angle)
+    half_w = np.stack([cos, sin], axis=1) * size[:, :1] / 2
+    half_h = np.stack([-sin, cos], axis=1) * size[:, 1:2] / 2
+    return np.stack(
+        [
+            center + half_w + half_h,
+            center + half_w - half_h,
+            center - half_w - half_h,
+            center - half_w + half_h,
+        ],
+        axis=1,
+    )
+
+
+def rotated_nms(polygons, scores, iou_threshold=0.5):
+    """
+    Class-agnostic greedy non-maximum suppression of rotated boxes.
+
+    Only pairs whose bounding rectangles overlap are compared, so the cost
+    stays close to linear for boxes spread over a large image.
+
+    Args:
+        polygons: Box corners, shape (N, 4, 2)
+        scores: Box confidences, shape (N,)
+        iou_threshold (float): Boxes overlapping a kept box more than this
+            are suppressed
+
+    Returns:
+        numpy.ndarray: Indices of kept boxes, highest score first
+    """
+    polygons = np.asarray(polygons, dtype=np.float64).reshape(-1, 4, 2)
+    scores = np.asarray(scores).reshape(-1)
+    mins, maxs = polygons.min(axis=1), polygons.max(axis=1)
+
+    kept = []
+    for i in np.argsort(-scores, kind="stable"):
+        if kept:
+            kept_idx = np.array(kept)
+            overlapping = kept_idx[
+                np.all(mins[kept_idx] < maxs[i], axis=1)
+                & np.all(mins[i] < maxs[kept_idx], axis=1)
+            ]
+            if any(
+                polygon_iou(polygons[i], polygons[j]) > iou_threshold
+                for j in overlapping
+            ):
+                continue
+        kept.append(i)
+
+    return np.array(kept, dtype=int)
+
+
+def predict_tiles(
+    model,
+    images,
+    device,
+    tile_size=640,
+    overlap=128,
+    iou_threshold=0.5,
+    batch_size=16,
+    edge_margin=2,
+    names=None,
+):
+    """
+    Run the detector on full-resolution tiles and merge the detections.
+
+    Every tile is predicted at its native resolution, so small cars keep all
+    their pixels and the cost grows linearly with the image area. Boxes
+    touching a tile border that lies inside the image are dropped (the
+    neighbouring tile sees those cars whole, as long as the overlap is larger
+    than a car), and rotated NMS merges the remaining duplicates.
+
+    Args:
+        model (YOLO): Loaded model
+        images (list): Full-frame images (BGR)
+        device (str): Device to run inference on
+        tile_size (int): Tile side in pixels (multiple of 32)
+        overlap (int): Overlap of neighbouring tiles in pixels
+        iou_threshold (float): IoU above which duplicates are suppressed
+        batch_size (int): Number of tiles per forward pass
+        edge_margin (int): Distance in pixels from an inner tile border under
+            which a box counts as cut by the border
+        names (dict): Class names (default: model.names)
+
+    Returns:
+        list: One Results object per image, with OBB in image coordinates
+    """
+    names = names if names is not None else model.names
+
+    tiles, owners = [], []
+    for index, image in enumerate(images):
+        height, width = image.shape[:2]
+        for x0, y0, x1, y1 in tile_grid(height, width, tile_size, overlap):
+            tile = np.full((tile_size, tile_size, 3), 114, dtype=np.uint8)
+            tile[: y1 - y0, : x1 - x0] = image[y0:y1, x0:x1]
+            tiles.append(tile)
+            owners.append((index, x0, y0, x1, y1, width, height))
+
+    detections = [[] for _ in images]
+    for start in range(0, len(tiles), batch_size):
+        batch = tiles[start : start + batch_size]
+        results = model.predict(batch, device=device, imgsz=tile_size, batch=len(batch))
+        for (index, x0, y0, x1, y1, width, height), result in zip(
+            owners[start : start + batch_size], results
+        ):
+            if result.obb is None or len(result.obb) == 0:
+                continue
+
+            data = result.obb.data.cpu().clone()
+            data[:, 0] += x0
+            data[:, 1] += y0
+
+            # Drop boxes cut by a tile border that is not the image border
+            polygons = xywhr_to_polygons(data[:, :5].numpy())
+            mins, maxs = polygons.min(axis=1), polygons.max(axis=1)
+            cut = np.zeros(len(data), dtype=bool)
+            if x0 > 0:
+                cut |= mins[:, 0] <= x0 + edge_margin
+            if y0 > 0:
+                cut |= mins[:, 1] <= y0 + edge_margin
+            if x1 < width:
+                cut |= maxs[:, 0] >= x1 - edge_margin
+            if y1 < height:
+                cut |= maxs[:, 1] >= y1 - edge_margin
+            detections[index].append(data[torch.from_numpy(~cut)])
+
+    merged = []
+    for image, image_detections in zip(images, detections):
+        if image_detections:
+            obb = torch.cat(image_detections)
+            keep = rotated_nms(
+                xywhr_to_polygons(obb[:, :5].numpy()),
+                obb[:, 5].numpy(),
+                iou_threshold=iou_threshold,
+            )
+            obb = obb[torch.from_numpy(np.sort(keep))]
+        else:
+            obb = torch.zeros((0, 7), dtype=torch.float32)
+        merged.append(Results(image, path="", names=names, obb=obb))
+
+    return merged
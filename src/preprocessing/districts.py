@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import requests
+import shapely
+
+DISTRICTS_URL = "https://raw.githubusercontent.com/andilabs/warszawa-dzielnice-geojson/master/warszawa-dzielnice.geojson"
+DISTRICTS_GEOJSON = os.path.join("data_districts", "warszawa-dzielnice.geojson")
+DISTRICT_CACHE = os.path.join("data_districts", "cell_districts.json")
+
+# Feature with the boundary of the whole city, next to the districts
+CITY_NAME = "Warszawa"
+
+
+def load_districts(path=DISTRICTS_GEOJSON, url=DISTRICTS_URL):
+    """
+    Load the Warsaw districts, downloading the GeoJSON file if it is missing.
+
+    Returns:
+        geopandas.GeoDataFrame: Districts ("name", "geometry") in WGS84,
+            without the feature of the whole city
+    """
+    if not os.path.isfile(path):
+        print("Downloading GeoJSON file...")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        r = requests.get(url)
+        r.raise_for_status()
+        with open(path, "wb") as f:
+            f.write(r.content)
+        print("Downloaded.")
+
+    gdf = gpd.read_file(path)
+    if gdf.crs is not None:
+        gdf = gdf.to_crs(epsg=4326)
+    return gdf[gdf["name"] != CITY_NAME].reset_index(drop=True)
+
+
+class DistrictLookup:
+    """
+    Point to district assignment with prepared district polygons.
+
+    The polygons are prepared once; `lookup` tests whole arrays of points
+    with vectorized calls, and each district only tests the points inside
+    its bounding box.
+    """
+
+    def __init__(self, districts):
+        """
+        Args:
+            districts (geopandas.GeoDataFrame): Districts with "name" and
+                "geometry" in WGS84 (or in the CRS of the boxes passed to
+                `covered_fractions`)
+        """
+        self.names = np.asarray(districts["name"], dtype=object)
+        self.geometries = np.asarray(districts.geometry.values, dtype=object)
+        # Prepared polygons answer repeated point-in-polygon tests much faster
+        shapely.prepare(self.geometries)
+        self.bounds = shapely.bounds(self.geometries)
+
+        digest = hashlib.sha256()
+        for name, geometry in zip(self.names, self.geometries):
+            digest.update(str(name).encode())
+            digest.update(shapely.to_wkb(geometry))
+        self.digest = digest.hexdigest()
+
+    @classmethod
+    def from_file(cls, path=DISTRICTS_GEOJSON):
+        """Build the lookup from the district GeoJSON file."""
+        return cls(load_districts(path))
+
+    def lookup(self, latitudes, longitudes):
+        """
+        Assign districts to points.
+
+        Args:
+            latitudes: Latitudes, array-like of shape (N,)
+            longitudes: Longitudes, array-like of shape (N,)
+
+        Returns:
+            numpy.ndarray: District names (object array), None outside the city
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64).reshape(-1)
+        longitudes = np.asarray(longitudes, dtype=np.float64).reshape(-1)
+        result = np.full(len(latitudes), None, dtype=object)
+        assigned = np.zeros(len(latitudes), dtype=bool)
+
+        for name, geometry, (x0, y0, x1, y1) in zip(
+            self.names, self.geometries, self.bounds
+        ):
+            candidates = np.flatnonzero(
+                ~assigned
+                & (longitudes >= x0)
+                & (longitudes <= x1)
+                & (latitudes >= y0)
+                & (latitudes <= y1)
+            )
+            # Districts do not overlap; on a shared border the first one wins
+            inside = candidates[
+                shapely.contains_xy(geometry, longitudes[candidates], latitudes[candidates])
+            ]
+            result[inside] = name
+            assigned[inside] = True
+        return result
+
+    def lookup_one(self, lat, lon):
+        """Return the district of a single point, None outside the city."""
+        return self.lookup([lat], [lon])[0]
+
+    def covered_fractions(self, boxes):
+        """
+        Measure how much of each box lies in the city and in which district.
+
+        Boxes inside a single district are found with the prepared polygons;
+        only boxes on a border are intersected exactly.
+
+        Args:
+            boxes: (min_lon, min_lat, max_lon, max_lat) rows, shape (N, 4)
+
+        Returns:
+            tuple: (district with the largest share of each box or None,
+                fraction of each box inside the city) as arrays of shape (N,)
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        cells = shapely.box(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3])
+        areas = shapely.area(cells)
+        overlaps = np.zeros((len(cells), len(self.names)))
+
+        for index, (geometry, (x0, y0, x1, y1)) in enumerate(
+            zip(self.geometries, self.bounds)
+        ):
+            candidates = np.flatnonzero(
+                (boxes[:, 0] <= x1)
+                & (boxes[:, 2] >= x0)
+                & (boxes[:, 1] <= y1)
+                & (boxes[:, 3] >= y0)
+            )
+            inside = shapely.contains_properly(geometry, cells[candidates])
+            overlaps[candidates[inside], index] = areas[candidates[inside]]
+
+            border = candidates[~inside]
+            overlaps[border, index] = shapely.area(
+                shapely.intersection(cells[border], geometry)
+            )
+
+        best = overlaps.argmax(axis=1)
+        districts = np.where(
+            overlaps.max(axis=1) > 0, self.names[best], None
+        ).astype(object)
+        fractions = np.divide(
+            overlaps.sum(axis=1), areas, out=np.zeros(len(cells)), where=areas > 0
+        )
+        return districts, np.clip(fractions, 0.0, 1.0)
+
+    def cell_districts(self, cells, cache_path=DISTRICT_CACHE):
+        """
+        Return the cell_id -> district map of grid cells, cached on disk.
+
+        The cache is keyed by the district polygons and the cell coordinates,
+        so it is rebuilt automatically when either changes.
+
+        Args:
+            cells (pandas.DataFrame): Grid with cell_id, center_lat and
+                center_lon columns (e.g. warsaw_grid.csv)
+            cache_path (str): Cache file (None disables caching)
+
+        Returns:
+            dict: {cell_id (str): district name or None}
+        """
+        cell_ids = cells["cell_id"].astype(str).to_numpy()
+        latitudes = cells["center_lat"].to_numpy(dtype=np.float64)
+        longitudes = cells["center_lon"].to_numpy(dtype=np.float64)
+
+        digest = hashlib.sha256(self.digest.encode())
+        digest.update("\n".join(cell_ids).encode())
+        digest.update(latitudes.tobytes())
+        digest.update(longitudes.tobytes())
+        key = digest.hexdigest()
+
+        if cache_path and os.path.isfile(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    cached = json.load(f)
+                if cached.get("key") == key:
+                    return cached["districts"]
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable district cache {cache_path}: {e}")
+
+        districts = dict(zip(cell_ids, self.lookup(latitudes, longitudes).tolist()))
+
+        if cache_path:
+            if os.path.dirname(cache_path):
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "districts": districts}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        return districts
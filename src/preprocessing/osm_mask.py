@@ -0,0 +1,344 @@
+import argparse
+import csv
+import math
+import os
+import re
+
+import cv2
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from PIL import Image
+from shapely.geometry import LineString, box
+from shapely.strtree import STRtree
+
+from src.scraper.georef import (
+    LEGACY_VIEWPORT_WIDTH,
+    GeoReference,
+    google_view_zoom,
+    load_georef,
+)
+from src.scraper.tiles import pixel_window
+
+# Width in meters of a parking lane by its orientation
+PARKING_LANE_WIDTHS = {
+    "parallel": 2.2,
+    "diagonal": 4.5,
+    "perpendicular": 5.0,
+    "half_on_kerb": 2.2,
+    "on_kerb": 2.2,
+    "painted_area_only": 2.2,
+    "lane": 2.2,
+    "street_side": 2.2,
+}
+
+# parking:lane:<side>=<orientation> (old scheme), parking:<side>=<position> with
+# parking:<side>:orientation=<orientation> (current scheme)
+_LANE_TAG = re.compile(r"^parking:(?:lane:)?(left|right|both)$")
+_OTHER_TAG = re.compile(r'"([^"]+)"=>"((?:[^"\\]|\\.)*)"')
+
+EARTH_CIRCUMFERENCE = 40075016.686
+
+
+def ground_resolution(latitude, zoom):
+    """Meters per pixel of a Web Mercator map at a latitude and zoom level."""
+    return EARTH_CIRCUMFERENCE * math.cos(math.radians(latitude)) / (256 * 2**zoom)
+
+
+def _feature_tags(row):
+    """Merge tag columns and the GDAL "other_tags" field of a feature."""
+    tags = {
+        key: value
+        for key, value in row.items()
+        if key not in ("geometry", "other_tags") and isinstance(value, str)
+    }
+    other_tags = row.get("other_tags")
+    if isinstance(other_tags, str):
+        tags.update(_OTHER_TAG.findall(other_tags))
+    return tags
+
+
+def _lane_sides(tags):
+    """Return [(side, width in meters)] of the parking lanes tagged on a way."""
+    sides = []
+    for key, value in tags.items():
+        match = _LANE_TAG.match(key)
+        if match is None or value in ("no", "none", "separate"):
+            continue
+
+        side = match.group(1)
+        orientation = tags.get(f"parking:{side}:orientation", value)
+        width = PARKING_LANE_WIDTHS.get(orientation)
+        if width is None:
+            continue
+        for lane_side in ("left", "right") if side == "both" else (side,):
+            sides.append((lane_side, width))
+    return sides
+
+
+def read_osm_features(path):
+    """
+    Read OSM features from a .osm.pbf/.osm extract or a vector file.
+
+    Extracts are read with the GDAL OSM driver, keeping only parking areas
+    and ways with parking tags; any other format readable by GeoPandas
+    (GeoJSON, GeoPackage...) is read as is, with OSM tags as columns.
+
+    Returns:
+        geopandas.GeoDataFrame: Features in WGS84
+    """
+    if path.endswith((".osm.pbf", ".pbf", ".osm")):
+        areas = gpd.read_file(path, layer="multipolygons", where="amenity = 'parking'")
+        lines = gpd.read_file(
+            path, layer="lines", where="other_tags LIKE '%\"parking:%'"
+        )
+        features = gpd.GeoDataFrame(
+            pd.concat([areas, lines], ignore_index=True), crs=areas.crs
+        )
+    else:
+        features = gpd.read_file(path)
+
+    if features.crs is not None:
+        features = features.to_crs(epsg=4326)
+    return features
+
+
+class ParkingMaskRasterizer:
+    """
+    Rasterizes parking masks of map views from OSM vector data.
+
+    Parking areas (amenity=parking) and, optionally, street parking lanes
+    (buffered to their width on the tagged side of the way) are projected
+    once to global Web Mercator pixels of the base zoom level and indexed with
+    an STR-tree. A mask of a cell then only fills the few polygons whose
+    bounds intersect its window.
+    """
+
+    def __init__(self, geometries, zoom=19):
+        """
+        Args:
+            geometries (list): Parking polygons in global pixel coordinates of
+                `zoom`
+            zoom (int): Base zoom level of the pixel coordinates
+        """
+        self.zoom = zoom
+        self.geometries = [g for g in geometries if g is not None and not g.is_empty]
+        self.tree = STRtree(self.geometries)
+
+    @classmethod
+    def from_features(cls, features, zoom=19, include_lanes=True):
+        """
+        Build the rasterizer from OSM features in WGS84.
+
+        Args:
+            features (geopandas.GeoDataFrame): Features with OSM tags
+            zoom (int): Base zoom level
+            include_lanes (bool): Add street parking lanes
+        """
+        world = 256 * 2**zoom
+
+        def to_pixels(coords):
+            lon, lat = coords[:, 0], np.clip(coords[:, 1], -85.0511, 85.0511)
+            sin_lat = np.sin(np.radians(lat))
+            x = (lon + 180.0) / 360.0 * world
+            y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * world
+            return np.column_stack([x, y])
+
+        geometries = []
+        for _, row in features.iterrows():
+            geometry = row.geometry
+            if geometry is None or geometry.is_empty:
+                continue
+            tags = _feature_tags(row)
+
+            if tags.get("amenity") == "parking" and geometry.geom_type in (
+                "Polygon",
+                "MultiPolygon",
+            ):
+                geometries.append(shapely.transform(geometry, to_pixels))
+
+            elif include_lanes and geometry.geom_type == "LineString":
+                sides = _lane_sides(tags)
+                if not sides:
+                    continue
+                line = shapely.transform(geometry, to_pixels)
+                meters_per_pixel = ground_resolution(geometry.centroid.y, zoom)
+                for side, width in sides:
+                    # Lanes run along the way edge, so the strip is offset by half
+                    # its width; pixel y points south, which mirrors left and right
+                    half = width / meters_per_pixel / 2
+                    offset = line.offset_curve(-half if side == "left" else half)
+                    if isinstance(offset, LineString) and not offset.is_empty:
+                        geometries.append(offset.buffer(half, cap_style="flat"))
+
+        return cls(geometries, zoom=zoom)
+
+    @classmethod
+    def from_file(cls, path, zoom=19, include_lanes=True):
+        """Build the rasterizer from an OSM extract or vector file."""
+        return cls.from_features(
+            read_osm_features(path), zoom=zoom, include_lanes=include_lanes
+        )
+
+    def rasterize(self, window, scale=1.0):
+        """
+        Rasterize the parking mask of a pixel window of the base zoom level.
+
+        Args:
+            window (tuple): (x0, y0, x1, y1) in global pixels of the base zoom
+            scale (float): Output pixels per base zoom pixel (e.g. the device
+                pixel ratio of the screenshots)
+
+        Returns:
+            numpy.ndarray: Mask (uint8, 255 on parking) of size
+                (height * scale, width * scale)
+        """
+        x0, y0, x1, y1 = window
+        height, width = round((y1 - y0) * scale), round((x1 - x0) * scale)
+        mask = np.zeros((height, width), dtype=np.uint8)
+
+        # Sub-pixel accuracy of the polygon edges
+        shift = 4
+        factor = scale * (1 << shift)
+        origin = np.array([x0, y0])
+
+        for index in self.tree.query(box(x0, y0, x1, y1)):
+            geometry = self.geometries[index]
+            polygons = getattr(geometry, "geoms", [geometry])
+            for polygon in polygons:
+                if polygon.geom_type != "Polygon" or polygon.is_empty:
+                    continue
+                # Holes are cut out by the even-odd fill of all rings together
+                rings = [polygon.exterior] + list(polygon.interiors)
+                contours = [
+                    np.round((np.asarray(r.coords)[:, :2] - origin) * factor)
+                    .astype(np.int32)
+                    .reshape(-1, 1, 2)
+                    for r in rings
+                ]
+                cv2.fillPoly(mask, contours, 255, lineType=cv2.LINE_8, shift=shift)
+
+        return mask
+
+    def cell_mask(self, cords, width=1200, height=800, scale=1.0):
+        """
+        Rasterize the mask of the map view centered on `cords`.
+
+        Args:
+            cords (tuple[float, float]): (latitude, longitude) of the view center
+            width (int): Output width in pixels
+            height (int): Output height in pixels
+            scale (float): Output pixels per base zoom pixel
+
+        Returns:
+            numpy.ndarray: Mask of shape (height, width)
+        """
+        window = pixel_window(cords, self.zoom, width / scale, height / scale)
+        mask = self.rasterize(window, scale=scale)
+        if mask.shape != (height, width):
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        return mask
+
+
+    def image_mask(self, georef, width=None, height=None):
+        """
+        Rasterize the mask of a georeferenced image, e.g. a cell's gm.png.
+
+        Args:
+            georef (GeoReference): Pixel to ground mapping of the image
+            width (int): Output width (default: width of the image)
+            height (int): Output height (default: height of the image)
+
+        Returns:
+            numpy.ndarray: Mask covering the ground footprint of the image
+        """
+        # Image window in global pixels of the base zoom
+        factor = 2 ** (self.zoom - georef.zoom)
+        x0, y0 = georef.origin[0] * factor, georef.origin[1] * factor
+        x1 = x0 + georef.width / georef.scale * factor
+        y1 = y0 + georef.height / georef.scale * factor
+
+        mask = self.rasterize((x0, y0, x1, y1), scale=georef.scale / factor)
+        width, height = width or georef.width, height or georef.height
+        if mask.shape != (height, width):
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        return mask
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rasterize OSM parking masks of the grid cells from vector data"
+    )
+    parser.add_argument(
+        "--osm-data",
+        required=True,
+        help="OSM extract (.osm.pbf) or vector file (GeoJSON...) with parking",
+    )
+    parser.add_argument("--grid", default="warsaw_grid.csv", help="Grid cells CSV")
+    parser.add_argument("--data-dir", default="data", help="Base data directory")
+    parser.add_argument(
+        "--mask-name", default="osm_mask.png", help="Mask file name in each cell"
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=None,
+        help="Mask width (default: width of the cell's gm.png, else 1200)",
+    )
+    parser.add_argument(
+        "--height",
+        type=int,
+        default=None,
+        help="Mask height (default: height of the cell's gm.png, else 800)",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Image pixels per CSS pixel of cells without gm.png (the scale of "
+        "other cells comes from their georef.json or gm.png width)",
+    )
+    parser.add_argument(
+        "--no-lanes", action="store_true", help="Only use amenity=parking areas"
+    )
+    args = parser.parse_args()
+
+    rasterizer = ParkingMaskRasterizer.from_file(
+        args.osm_data, include_lanes=not args.no_lanes
+    )
+    print(f"Indexed {len(rasterizer.geometries)} parking geometries")
+
+    with open(args.grid, newline="") as f:
+        cells = list(csv.DictReader(f))
+
+    for row in cells:
+        cell_dir = os.path.join(args.data_dir, str(row["cell_id"]))
+        os.makedirs(cell_dir, exist_ok=True)
+
+        # The mask covers the ground of the cell's gm.png, which the detector sees
+        georef = load_georef(cell_dir, "gm.png")
+        if georef is None:
+            latitude, longitude = float(row["center_lat"]), float(row["center_lon"])
+            width, height, scale = args.width or 1200, args.height or 800, args.scale
+            gm_path = os.path.join(cell_dir, "gm.png")
+            if os.path.exists(gm_path):
+                # Only the header is read, not the whole image
+                with Image.open(gm_path) as image:
+                    width, height = image.size
+                scale = width / LEGACY_VIEWPORT_WIDTH
+            georef = GeoReference.from_view(
+                (latitude, longitude),
+                width,
+                height,
+                zoom=google_view_zoom(latitude, height / scale),
+                scale=scale,
+            )
+        mask = rasterizer.image_mask(georef, width=args.width, height=args.height)
+        cv2.imwrite(os.path.join(cell_dir, args.mask_name), mask)
+
+    print(f"Masks saved for {len(cells)} cells")
+
+
+if __name__ == "__main__":
+    main()
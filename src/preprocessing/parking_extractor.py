@@ -1,53 +1,219 @@
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
 import numpy as np
 from PIL import Image
 
-def create_color_mask(image_path):
+# Fill color of parking areas on openstreetmap.org
+TARGET_COLOR = (238, 238, 238, 255)
+
+
+def _as_rgba(color):
+    """Return a color as an (R, G, B, A) tuple, opaque if no alpha is given."""
+    color = tuple(int(c) for c in color)
+    return color if len(color) == 4 else color + (255,)
+
+
+def _pack(red, green, blue, alpha):
+    """Pack color channels into uint32 values (R in the lowest byte)."""
+    return (
+        red.astype(np.uint32)
+        | (green.astype(np.uint32) << 8)
+        | (blue.astype(np.uint32) << 16)
+        | (np.asarray(alpha, dtype=np.uint32) << 24)
+    )
+
+
+@lru_cache(maxsize=8)
+def _color_lut(target_colors, tolerance):
+    """
+    Build a lookup table from packed 24-bit RGB to the matching target color.
+
+    Returns:
+        numpy.ndarray: 2**24 entries holding 1 + the index of the matched
+            target color, or 0 if no target is within the tolerance
+    """
+    lut = np.zeros((256, 256, 256), dtype=np.uint8)  # indexed [blue, green, red]
+    for index, (red, green, blue, _) in reversed(list(enumerate(target_colors))):
+        lut[
+            max(0, blue - tolerance) : blue + tolerance + 1,
+            max(0, green - tolerance) : green + tolerance + 1,
+            max(0, red - tolerance) : red + tolerance + 1,
+        ] = index + 1
+    return lut.reshape(-1)
+
+
+def match_colors(pixels, target_colors=(TARGET_COLOR,), tolerance=0):
+    """
+    Find pixels equal to any of the target colors.
+
+    Exact matches compare pixels packed into uint32 values; with a tolerance,
+    a lookup table over all RGB values is used, so the cost does not depend on
+    the number of target colors.
+
+    Args:
+        pixels: Image array, shape (H, W, 3) RGB or (H, W, 4) RGBA, uint8
+        target_colors: List of (R, G, B) or (R, G, B, A) colors
+        tolerance (int): Maximum difference per channel
+
+    Returns:
+        numpy.ndarray: Boolean mask of shape (H, W)
+    """
+    targets = tuple(_as_rgba(color) for color in target_colors)
+    red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    alpha = pixels[..., 3] if pixels.shape[-1] == 4 else 255
+
+    if tolerance == 0:
+        if pixels.shape[-1] == 4 and pixels.flags["C_CONTIGUOUS"]:
+            packed = pixels.view("<u4")[..., 0]
+        else:
+            packed = _pack(red, green, blue, alpha)
+        packed_targets = [
+            int(r) | (int(g) << 8) | (int(b) << 16) | (int(a) << 24)
+            for r, g, b, a in targets
+        ]
+        if len(packed_targets) == 1:
+            return packed == np.uint32(packed_targets[0])
+        return np.isin(packed, packed_targets)
+
+    hits = _color_lut(targets, int(tolerance))[_pack(red, green, blue, 0)]
+    mask = hits > 0
+    target_alpha = np.array([0] + [a for _, _, _, a in targets], dtype=np.int16)
+    return mask & (np.abs(np.int16(alpha) - target_alpha[hits]) <= tolerance)
+
+
+def mask_path_for(image_path):
+    """Return the mask path of an image: same folder with a '_mask' suffix."""
+    base_name, extension = os.path.splitext(image_path)
+    return f"{base_name}_mask{extension}"
+
+
+def create_color_mask(image_path, target_colors=(TARGET_COLOR,), tolerance=0, verbose=True):
     """
     Creates a binary mask where pixels with RGBA(238,238,238,255) are white and everything else is black.
-    
+
     Args:
         image_path: Path to the input image
-    
+        target_colors: Colors to match, (R, G, B) or (R, G, B, A)
+        tolerance: Maximum difference per channel
+        verbose: Print the mask path
+
     Returns:
         Saves the mask image in the same folder with '_mask' suffix
     """
-    # Load the image with PIL
+    # Load the image with PIL, RGB images are matched as opaque without converting
     img = Image.open(image_path)
-    
-    # Convert to RGBA if it's not already
-    if img.mode != 'RGBA':
+    if img.mode not in ('RGB', 'RGBA'):
         img = img.convert('RGBA')
-    
-    # Convert to numpy array for easier processing
-    img_array = np.array(img)
-    
-    # Target color to find (R=238, G=238, B=238, A=255)
-    target_color = np.array([238, 238, 238, 255])
-    
-    # Create mask where all values match the target color (255 for match, 0 for non-match)
-    # All 4 channels must match
-    mask = np.all(img_array == target_color, axis=2).astype(np.uint8) * 255
-    
-    # Create mask image
-    mask_img = Image.fromarray(mask, mode='L')  # 'L' mode for 8-bit grayscale
-    
-    # Construct output filename with _mask suffix
-    base_name = os.path.splitext(image_path)[0]
-    mask_path = f"{base_name}_mask{os.path.splitext(image_path)[1]}"
-    
-    # Save the mask image
-    mask_img.save(mask_path)
-    
-    print(f"Mask saved to: {mask_path}")
+
+    # Create mask where the pixel matches a target color (255 for match, 0 for non-match)
+    mask = match_colors(np.asarray(img), target_colors, tolerance).astype(np.uint8) * 255
+
+    # Save the mask image ('L' mode for 8-bit grayscale)
+    mask_path = mask_path_for(image_path)
+    Image.fromarray(mask, mode='L').save(mask_path)
+
+    if verbose:
+        print(f"Mask saved to: {mask_path}")
     return mask_path
 
+
+def _is_up_to_date(image_path):
+    mask_path = mask_path_for(image_path)
+    return (
+        os.path.exists(mask_path)
+        and os.path.getmtime(mask_path) >= os.path.getmtime(image_path)
+    )
+
+
+def _create_masks(task):
+    image_path, target_colors, tolerance = task
+    try:
+        create_color_mask(image_path, target_colors, tolerance, verbose=False)
+        return image_path, None
+    except Exception as e:
+        return image_path, str(e)
+
+
+def extract_masks(
+    paths,
+    image_name='osm.png',
+    target_colors=(TARGET_COLOR,),
+    tolerance=0,
+    workers=None,
+    force=False,
+):
+    """
+    Create masks of many images in one process pool.
+
+    Args:
+        paths: Image files or directories searched recursively for `image_name`
+        image_name: File name of the images in the directories
+        target_colors: Colors to match, (R, G, B) or (R, G, B, A)
+        tolerance: Maximum difference per channel
+        workers: Worker processes (default: number of CPUs)
+        force: Also recreate masks that are newer than their image
+
+    Returns:
+        tuple: (number of created masks, number of up-to-date masks, list of
+            (image path, error) of failed images)
+    """
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                if image_name in files:
+                    images.append(os.path.join(root, image_name))
+        else:
+            images.append(path)
+
+    todo = [p for p in sorted(images) if force or not _is_up_to_date(p)]
+    tasks = [(p, tuple(target_colors), tolerance) for p in todo]
+
+    failed = []
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for image_path, error in executor.map(_create_masks, tasks, chunksize=chunksize):
+            if error is not None:
+                print(f"Error processing file: {image_path}: {error}")
+                failed.append((image_path, error))
+
+    return len(todo) - len(failed), len(images) - len(todo), failed
+
+
+def parse_color(value):
+    """Parse a color given as 'R,G,B' or 'R,G,B,A'."""
+    parts = [int(p) for p in value.split(',')]
+    if len(parts) not in (3, 4) or not all(0 <= p <= 255 for p in parts):
+        raise argparse.ArgumentTypeError(f"Invalid color '{value}', expected R,G,B[,A]")
+    return tuple(parts)
+
+
 if __name__ == "__main__":
-    import sys
-    
-    if len(sys.argv) < 2:
-        print("Usage: python create_mask.py <image_path>")
-        sys.exit(1)
-    
-    image_path = sys.argv[1]
-    create_color_mask(image_path)
+    parser = argparse.ArgumentParser(description='Create parking masks from OSM screenshots')
+    parser.add_argument('paths', nargs='+',
+                        help='Images, or directories searched recursively for --image-name')
+    parser.add_argument('--image-name', default='osm.png',
+                        help='Image file name searched in directories (default: osm.png)')
+    parser.add_argument('--color', type=parse_color, action='append', default=None,
+                        help='Target color R,G,B[,A], can be repeated (default: 238,238,238,255)')
+    parser.add_argument('--tolerance', type=int, default=0,
+                        help='Maximum difference per color channel (default: 0)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true',
+                        help='Recreate masks that are newer than their image')
+    args = parser.parse_args()
+
+    created, up_to_date, failed = extract_masks(
+        args.paths,
+        image_name=args.image_name,
+        target_colors=args.color or [TARGET_COLOR],
+        tolerance=args.tolerance,
+        workers=args.workers,
+        force=args.force,
+    )
+    print(f"Processing complete. {created} masks created, {up_to_date} up to date, {len(failed)} failed.")
@@ -0,0 +1,397 @@
+import argparse
+import os
+
+import cv2
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+
+from src.preprocessing.districts import DISTRICTS_GEOJSON, DistrictLookup, load_districts
+
+# Metric coordinate system of the grid (Poland CS92)
+GRID_CRS = "EPSG:2180"
+
+# Side of the level 0 cells in meters; level L cells are ROOT_SIZE / 2**L, so
+# level 3 (150 m) is about the ground footprint of one capture at zoom 19
+ROOT_SIZE = 1200.0
+
+GRID_FIELDS = [
+    "cell_id",
+    "level",
+    "parent_id",
+    "center_lat",
+    "center_lon",
+    "size_m",
+    "district",
+    "city_fraction",
+]
+
+
+def make_cell_id(level, ix, iy):
+    """Return the id of the cell (ix, iy) of a level, e.g. "2_1051_3898"."""
+    return f"{level}_{ix}_{iy}"
+
+
+def parse_cell_id(cell_id):
+    """Return (level, ix, iy) of a cell id."""
+    level, ix, iy = (int(part) for part in str(cell_id).split("_"))
+    return level, ix, iy
+
+
+def ancestor_id(cell_id, level):
+    """Return the id of the cell of `level` containing the cell (itself if same level)."""
+    cell_level, ix, iy = parse_cell_id(cell_id)
+    if level > cell_level:
+        raise ValueError(f"Level {level} is finer than the cell {cell_id}")
+    shift = cell_level - level
+    return make_cell_id(level, ix >> shift, iy >> shift)
+
+
+def parent_id(cell_id):
+    """Return the id of the parent cell, None for level 0 cells."""
+    level = parse_cell_id(cell_id)[0]
+    return ancestor_id(cell_id, level - 1) if level > 0 else None
+
+
+def child_ids(cell_id):
+    """Return the ids of the four children of a cell."""
+    level, ix, iy = parse_cell_id(cell_id)
+    return [
+        make_cell_id(level + 1, 2 * ix + dx, 2 * iy + dy)
+        for dy in (0, 1)
+        for dx in (0, 1)
+    ]
+
+
+class QuadtreeGrid:
+    """
+    Hierarchical grid of square cells in meters, clipped to the city.
+
+    Cells of every level are aligned to the origin of the metric coordinate
+    system, so a cell id (level, column, row) always denotes the same square
+    and the ids of parents, children and ancestors are computed from the id
+    alone. This makes refinement repeatable and roll-ups across levels a
+    matter of grouping by `ancestor_id`.
+    """
+
+    def __init__(self, lookup, root_size=ROOT_SIZE, crs=GRID_CRS):
+        """
+        Args:
+            lookup (DistrictLookup): Districts in the grid CRS
+            root_size (float): Side of the level 0 cells in meters
+            crs (str): Metric coordinate system of the grid
+        """
+        self.lookup = lookup
+        self.root_size = root_size
+        self.crs = crs
+        self.to_grid = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+        self.to_wgs84 = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+
+    @classmethod
+    def from_file(cls, path=DISTRICTS_GEOJSON, root_size=ROOT_SIZE, crs=GRID_CRS):
+        """Build the grid from the district GeoJSON file."""
+        return cls(DistrictLookup(load_districts(path).to_crs(crs)), root_size, crs)
+
+    def cell_size(self, level):
+        return self.root_size / 2**level
+
+    def locate(self, latitudes, longitudes, level):
+        """Return the ids of the cells of `level` containing the points."""
+        x, y = self.to_grid.transform(
+            np.asarray(longitudes, dtype=np.float64),
+            np.asarray(latitudes, dtype=np.float64),
+        )
+        size = self.cell_size(level)
+        ix = np.floor(np.asarray(x) / size).astype(np.int64)
+        iy = np.floor(np.asarray(y) / size).astype(np.int64)
+        return np.array(
+            [make_cell_id(level, i, j) for i, j in zip(ix.tolist(), iy.tolist())],
+            dtype=object,
+        )
+
+    def describe(self, cell_ids, min_city_fraction=0.0):
+        """
+        Measure cells and drop the ones outside the city.
+
+        Args:
+            cell_ids (list[str]): Cell ids of any levels
+            min_city_fraction (float): Cells with a smaller part of their area
+                inside the city are dropped (0 keeps every cell touching it)
+
+        Returns:
+            pandas.DataFrame: Rows of GRID_FIELDS, sorted by level and id
+        """
+        parsed = np.array([parse_cell_id(c) for c in cell_ids], dtype=np.int64)
+        parsed = parsed.reshape(-1, 3)
+        sizes = self.root_size / 2.0 ** parsed[:, 0]
+        x0, y0 = parsed[:, 1] * sizes, parsed[:, 2] * sizes
+
+        districts, fractions = self.lookup.covered_fractions(
+            np.column_stack([x0, y0, x0 + sizes, y0 + sizes])
+        )
+        lon, lat = self.to_wgs84.transform(x0 + sizes / 2, y0 + sizes / 2)
+
+        grid = pd.DataFrame(
+            {
+                "cell_id": list(cell_ids),
+                "level": parsed[:, 0],
+                "parent_id": [parent_id(c) for c in cell_ids],
+                "center_lat": np.round(lat, 7),
+                "center_lon": np.round(lon, 7),
+                "size_m": sizes,
+                "district": districts,
+                "city_fraction": np.round(fractions, 6),
+            },
+            columns=GRID_FIELDS,
+        )
+        keep = (grid["city_fraction"] > 0) & (grid["city_fraction"] >= min_city_fraction)
+        return grid[keep].sort_values(["level", "cell_id"]).reset_index(drop=True)
+
+    def cover(self, level, min_city_fraction=0.0):
+        """Return the cells of one level covering the city."""
+        bounds = self.lookup.bounds
+        size = self.cell_size(level)
+        columns = np.arange(
+            np.floor(bounds[:, 0].min() / size), np.ceil(bounds[:, 2].max() / size)
+        ).astype(np.int64)
+        rows = np.arange(
+            np.floor(bounds[:, 1].min() / size), np.ceil(bounds[:, 3].max() / size)
+        ).astype(np.int64)
+        cell_ids = [
+            make_cell_id(level, i, j) for j in rows.tolist() for i in columns.tolist()
+        ]
+        return self.describe(cell_ids, min_city_fraction)
+
+    def aggregate(self, grid, measurements, columns):
+        """
+        Average point measurements (e.g. per-capture stats) over the grid cells.
+
+        Args:
+            grid (pandas.DataFrame): Grid cells (leaves)
+            measurements (pandas.DataFrame): Rows with latitude, longitude and
+                the measured columns
+            columns (list[str]): Columns to average
+
+        Returns:
+            pandas.DataFrame: Per cell_id: the column means and "samples",
+                the number of measurements in the cell
+        """
+        measurements = measurements.dropna(subset=["latitude", "longitude"])
+        located = np.full(len(measurements), None, dtype=object)
+        # Leaves do not overlap, so a point is in the leaf of at most one level
+        for level in grid["level"].unique():
+            ids = self.locate(measurements["latitude"], measurements["longitude"], level)
+            leaves = grid.loc[grid["level"] == level, "cell_id"].to_numpy(dtype=object)
+            inside = np.isin(ids, leaves)
+            located[inside] = ids[inside]
+
+        data = measurements[columns].assign(cell_id=located).dropna(subset=["cell_id"])
+        stats = data.groupby("cell_id")[columns].mean()
+        stats["samples"] = data.groupby("cell_id").size()
+        return stats
+
+    def refine(
+        self,
+        grid,
+        measurements,
+        data_dir=None,
+        detections_column="total_detections",
+        mask_column="mask_area_pct",
+        refine_detections=10.0,
+        refine_mask_pct=5.0,
+        empty_mask_pct=0.5,
+        min_level=0,
+        max_level=3,
+        min_city_fraction=0.0,
+    ):
+        """
+        Refine dense cells and coarsen empty ones after a pass over the grid.
+
+        A measured cell is split into its four children when its captures
+        have on average at least `refine_detections` detections or
+        `refine_mask_pct` percent of parking mask. Sibling cells are merged
+        into their parent when all of them were measured without any
+        detection and with at most `empty_mask_pct` percent of mask. Cells
+        without measurements are kept as they are.
+
+        Args:
+            grid (pandas.DataFrame): Current grid (leaves)
+            measurements (pandas.DataFrame): Per-capture stats with cell_id,
+                latitude and longitude (e.g. warsaw_predictions_merged.csv)
+            data_dir (str): Directory of the capture cells, to compute the
+                mask area from their osm_mask.png if the measurements do not
+                have `mask_column`
+            detections_column (str): Detections per capture
+            mask_column (str): Parking mask area per capture in percent
+
+        Returns:
+            pandas.DataFrame: The new grid
+        """
+        if mask_column not in measurements.columns and data_dir is not None:
+            areas = mask_area_pct(data_dir, measurements["cell_id"])
+            if not np.isnan(areas).all():
+                measurements = measurements.assign(**{mask_column: areas})
+
+        columns = [detections_column]
+        if mask_column in measurements.columns:
+            columns.append(mask_column)
+        else:
+            source = f"no osm_mask.png in {data_dir}" if data_dir else "no data_dir"
+            print(
+                f"Warning: no {mask_column} in the measurements and {source}, "
+                f"refining by {detections_column} only"
+            )
+        stats = self.aggregate(grid, measurements, columns).reindex(grid["cell_id"])
+
+        detections = stats[detections_column].to_numpy()
+        measured = stats["samples"].notna().to_numpy()
+        levels = grid["level"].to_numpy()
+
+        dense = measured & (detections >= refine_detections) & (levels < max_level)
+        empty = measured & (detections == 0)
+        if mask_column in stats.columns:
+            # Cells without any mask are neither refined nor merged by area
+            mask = stats[mask_column].to_numpy()
+            dense |= measured & (mask >= refine_mask_pct) & (levels < max_level)
+            empty &= mask <= empty_mask_pct
+
+        # Parents whose every child in the city is an empty leaf
+        parents = grid["parent_id"].where(levels > min_level)
+        groups = pd.DataFrame({"parent": parents, "cell_id": grid["cell_id"], "empty": empty})
+        groups = groups.dropna(subset=["parent"]).groupby("parent")
+        candidates = {parent for parent, group in groups if group["empty"].all()}
+
+        leaves = set(grid["cell_id"])
+        siblings = self.describe([c for parent in candidates for c in child_ids(parent)])
+        coarsen = {
+            parent
+            for parent, children in siblings.groupby("parent_id")["cell_id"]
+            if parent in candidates and set(children) <= leaves
+        }
+
+        cell_ids = []
+        for cell_id, parent, is_dense in zip(grid["cell_id"], parents, dense):
+            if parent in coarsen:
+                continue
+            cell_ids.extend(child_ids(cell_id) if is_dense else [cell_id])
+        cell_ids.extend(sorted(coarsen))
+
+        refined = int(dense.sum())
+        print(f"Refined {refined} cells, merged {len(coarsen)} groups of empty cells")
+        return self.describe(cell_ids, min_city_fraction)
+
+
+def mask_area_pct(data_dir, cell_ids, mask_name="osm_mask.png"):
+    """
+    Return the parking mask area of captures in percent of the frame.
+
+    Args:
+        data_dir (str): Base directory of the capture cells
+        cell_ids: Capture cell ids (subdirectory names)
+        mask_name (str): Mask file name in each cell
+
+    Returns:
+        numpy.ndarray: Mask area per capture, NaN where the mask is missing
+    """
+    areas = np.full(len(cell_ids), np.nan)
+    for index, cell_id in enumerate(cell_ids):
+        mask = cv2.imread(os.path.join(data_dir, str(cell_id), mask_name), cv2.IMREAD_GRAYSCALE)
+        if mask is not None:
+            areas[index] = np.count_nonzero(mask) / mask.size * 100
+    return areas
+
+
+def rollup(values, level, columns=None, how="sum"):
+    """
+    Aggregate per-cell values of any levels to the cells of a coarser level.
+
+    Args:
+        values (pandas.DataFrame): Rows with cell_id and value columns
+        level (int): Target level, not finer than any cell
+        columns (list[str]): Columns to aggregate (default: all numeric ones)
+        how (str): pandas aggregation, e.g. "sum" or "mean"
+
+    Returns:
+        pandas.DataFrame: Aggregated values indexed by the ancestor cell_id
+    """
+    if columns is None:
+        columns = values.select_dtypes("number").columns.tolist()
+    ancestors = values["cell_id"].map(lambda cell_id: ancestor_id(cell_id, level))
+    return values[columns].groupby(ancestors.rename("cell_id")).agg(how)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Metric quadtree grid of the city with adaptive refinement"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init = subparsers.add_parser("init", help="Cover the city with cells of one level")
+    init.add_argument("--level", type=int, default=1, help="Level of the coarse pass")
+
+    refine = subparsers.add_parser(
+        "refine", help="Refine dense cells and coarsen empty ones after a pass"
+    )
+    refine.add_argument("--grid", default="quadtree_grid.csv", help="Current grid CSV")
+    refine.add_argument(
+        "--measurements",
+        default="warsaw_predictions_merged.csv",
+        help="Merged prediction stats with latitude and longitude",
+    )
+    refine.add_argument(
+        "--data-dir",
+        default="data",
+        help="Capture cells with osm_mask.png, for the mask area of the measurements",
+    )
+    refine.add_argument("--refine-detections", type=float, default=10.0)
+    refine.add_argument("--refine-mask-pct", type=float, default=5.0)
+    refine.add_argument("--empty-mask-pct", type=float, default=0.5)
+    refine.add_argument("--min-level", type=int, default=0)
+    refine.add_argument("--max-level", type=int, default=3)
+
+    roll = subparsers.add_parser(
+        "rollup", help="Sum per-cell values of a quadtree grid run to a coarser level"
+    )
+    roll.add_argument(
+        "--values",
+        default="warsaw_predictions_merged.csv",
+        help="CSV with quadtree cell_id and numeric columns",
+    )
+    roll.add_argument("--level", type=int, required=True, help="Target level")
+    roll.add_argument("--columns", nargs="+", default=None, help="Columns to sum")
+
+    for subparser in (init, refine, roll):
+        subparser.add_argument("--output", default="quadtree_grid.csv", help="Output CSV")
+        subparser.add_argument(
+            "--root-size", type=float, default=ROOT_SIZE, help="Level 0 cell side in meters"
+        )
+    for subparser in (init, refine):
+        subparser.add_argument("--min-city-fraction", type=float, default=0.0)
+    args = parser.parse_args()
+
+    grid = QuadtreeGrid.from_file(root_size=args.root_size)
+
+    if args.command == "init":
+        result = grid.cover(args.level, min_city_fraction=args.min_city_fraction)
+    elif args.command == "refine":
+        result = grid.refine(
+            pd.read_csv(args.grid, dtype={"cell_id": str, "parent_id": str}),
+            pd.read_csv(args.measurements, dtype={"cell_id": str}),
+            data_dir=args.data_dir,
+            refine_detections=args.refine_detections,
+            refine_mask_pct=args.refine_mask_pct,
+            empty_mask_pct=args.empty_mask_pct,
+            min_level=args.min_level,
+            max_level=args.max_level,
+            min_city_fraction=args.min_city_fraction,
+        )
+    else:
+        values = pd.read_csv(args.values, dtype={"cell_id": str})
+        result = rollup(values, args.level, args.columns).reset_index()
+
+    result.to_csv(args.output, index=False)
+    print(f"Saved {len(result)} cells to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
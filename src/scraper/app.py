@@ -58,6 +58,29 @@ def crop_center(img, center, crop_width, crop_height):
     return img[y1:y2, x1:x2]
 
 
+def crop_pair(left_img, right_img, center_left, center_right):
+    """
+    Przycina oba obrazy do wspólnego rozmiaru tak, aby podane środki
+    znalazły się w środku wycinków.
+    Zwraca krotkę (wycinek lewego obrazu, wycinek prawego obrazu).
+    """
+    # Obliczenie maksymalnego rozmiaru przycięcia, aby nie wychodziło poza obraz
+    h_left, w_left = left_img.shape[:2]
+    h_right, w_right = right_img.shape[:2]
+
+    avail_width_left = 2 * min(center_left[0], w_left - center_left[0])
+    avail_height_left = 2 * min(center_left[1], h_left - center_left[1])
+    avail_width_right = 2 * min(center_right[0], w_right - center_right[0])
+    avail_height_right = 2 * min(center_right[1], h_right - center_right[1])
+
+    crop_width = int(min(avail_width_left, avail_width_right))
+    crop_height = int(min(avail_height_left, avail_height_right))
+
+    cropped_left = crop_center(left_img, center_left, crop_width, crop_height)
+    cropped_right = crop_center(right_img, center_right, crop_width, crop_height)
+    return cropped_left, cropped_right
+
+
 def process_pair(left_image_path, right_image_path, output_prefix):
     """
     Przetwarza jedną parę obrazów (lewy: gm.png, prawy: osm.png).
@@ -131,22 +154,9 @@ def process_pair(left_image_path, right_image_path, output_prefix):
     print("Środek lewego obrazu:", center_left)
     print("Środek prawego obrazu:", center_right)
 
-    # Obliczenie maksymalnego rozmiaru przycięcia, aby nie wychodziło poza obraz
-    h_left, w_left = left_img.shape[:2]
-    h_right, w_right = right_img.shape[:2]
-
-    avail_width_left = 2 * min(center_left[0], w_left - center_left[0])
-    avail_height_left = 2 * min(center_left[1], h_left - center_left[1])
-    avail_width_right = 2 * min(center_right[0], w_right - center_right[0])
-    avail_height_right = 2 * min(center_right[1], h_right - center_right[1])
-
-    crop_width = int(min(avail_width_left, avail_width_right))
-    crop_height = int(min(avail_height_left, avail_height_right))
-    print("Rozmiar przycięcia:", crop_width, "x", crop_height)
-
     # Przycinanie obrazów
-    cropped_left = crop_center(left_img, center_left, crop_width, crop_height)
-    cropped_right = crop_center(right_img, center_right, crop_width, crop_height)
+    cropped_left, cropped_right = crop_pair(left_img, right_img, center_left, center_right)
+    print("Rozmiar przycięcia:", cropped_left.shape[1], "x", cropped_left.shape[0])
 
     # Zapis wyników
     output_left = output_prefix + "_gm.png"
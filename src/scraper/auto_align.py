@@ -0,0 +1,359 @@
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from src.scraper.app import crop_pair
+from src.scraper.georef import GEOREF_FILE, GeoReference
+
+# Offset (dx, dy) of the OSM capture against the Google Maps capture of cells
+# without saved georeferences: osm pixel = gm pixel + offset. Median of the
+# manually aligned cells in data_old, whose offsets are within 20 pixels of
+# it in x and 45 pixels in y
+DEFAULT_PRIOR = (18, 46)
+
+# Search radius around the prior. The Google imagery is displaced against the
+# OSM data by up to ~2 m, wider searches lock onto the leaning roofs and the
+# shadows of tall buildings instead of the ground
+MAX_SHIFT = 20
+
+# Height of the openstreetmap.org header (and the top of its side panel) in
+# the OSM screenshots of a 2x device pixel ratio
+OSM_HEADER = 150
+
+# Largest offset error in pixels (~1.5 m on the ground at zoom 19, 2x device
+# pixel ratio, about the precision of the manual alignment) of a usable crop;
+# larger errors must go to review
+ALIGNMENT_TOLERANCE = 16
+
+# Confidence thresholds. Peak correlations of 0.02-0.12 are a weak signal, so
+# the gate is set so that no accepted cell of data_old exceeds the tolerance:
+# it accepts 7 of the 12 cells, at most 15.2 pixels from the manual alignment,
+# and sends the other 5 to review (the highest rejected score is 0.044, the
+# lowest accepted one 0.054). The thresholds were chosen on these same cells,
+# so check the crops of a new area before trusting them.
+MIN_SCORE = 0.05
+MIN_RATIO = 1.15
+MAX_SPREAD = 30
+
+REPORT_FILE = "alignment_report.csv"
+REPORT_FIELDS = ["cell", "status", "dx", "dy", "score", "ratio", "spread", "edge"]
+
+
+def gradient_map(image: np.ndarray, scale: float) -> np.ndarray:
+    """
+    Return the locally normalized gradient magnitude of a downscaled image.
+
+    Both captures show the same road and building edges, while their colors
+    have nothing in common, so they are compared by edges only. The local
+    normalization keeps strong edges (shadows, road markings) from
+    outweighing the rest.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.GaussianBlur(gray.astype(np.float32), (0, 0), 1.0)
+    magnitude = cv2.magnitude(
+        cv2.Sobel(gray, cv2.CV_32F, 1, 0), cv2.Sobel(gray, cv2.CV_32F, 0, 1)
+    )
+    return magnitude / (cv2.GaussianBlur(magnitude, (0, 0), 8) + 1e-3)
+
+
+def _match(search: np.ndarray, template: np.ndarray) -> tuple[int, int, float, float]:
+    """
+    Locate a template in a search area by normalized cross-correlation.
+
+    Returns:
+        tuple: (x, y, peak score, ratio of the peak to the best score away
+            from it)
+    """
+    result = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
+    _, peak, _, (x, y) = cv2.minMaxLoc(result)
+
+    others = result.copy()
+    cv2.circle(others, (x, y), 8, -1.0, -1)
+    second = others.max()
+    ratio = peak / second if second > 0 else float("inf")
+    return x, y, peak, ratio
+
+
+def estimate_offset(
+    gm: np.ndarray,
+    osm: np.ndarray,
+    prior: tuple[int, int] = DEFAULT_PRIOR,
+    max_shift: int = MAX_SHIFT,
+    scale: float = 0.5,
+    header: int = OSM_HEADER,
+    margin: int = 40,
+) -> dict:
+    """
+    Estimate the offset between the Google Maps and OSM captures of a cell.
+
+    The central part of the OSM edge map is searched in the Google Maps edge
+    map within `max_shift` pixels of `prior`. The same search is repeated for
+    the four quadrants of the template; quadrants that land far from the
+    whole template show that the peak is not backed by the whole image.
+
+    Args:
+        gm (np.ndarray): Google Maps capture (BGR)
+        osm (np.ndarray): OSM capture (BGR)
+        prior (tuple[int, int]): Expected offset (dx, dy) in pixels
+        max_shift (int): Search radius around the prior in pixels
+        scale (float): Downscaling of the images before matching
+        header (int): Rows at the top of the OSM capture to ignore
+        margin (int): Pixels at the other OSM borders to ignore
+
+    Returns:
+        dict: dx, dy (osm pixel = gm pixel + (dx, dy)), score (peak
+            correlation), ratio (peak over the second best peak), spread
+            (largest distance of a quadrant's offset from dx, dy in pixels)
+            and edge (whether the peak is on the border of the search area,
+            so the best match may lie outside of it)
+    """
+    gm_edges = gradient_map(gm, scale)
+    osm_edges = gradient_map(osm, scale)
+    height, width = osm_edges.shape
+
+    radius = int(round(max_shift * scale))
+    prior_x, prior_y = (int(round(p * scale)) for p in prior)
+
+    # Template from the OSM capture, without its header and borders
+    tx0 = int(margin * scale) + radius + max(0, prior_x)
+    ty0 = int(max(header, margin) * scale) + radius + max(0, prior_y)
+    tx1 = width - int(margin * scale) - radius + min(0, prior_x)
+    ty1 = height - int(margin * scale) - radius + min(0, prior_y)
+    if tx1 - tx0 < 32 or ty1 - ty0 < 32:
+        raise ValueError("Images are too small for the search range")
+    template = osm_edges[ty0:ty1, tx0:tx1]
+
+    def locate(x0, y0, x1, y1):
+        # Search the Google Maps area where the template part can be within
+        # the radius of the prior
+        sx0, sy0 = x0 - prior_x - radius, y0 - prior_y - radius
+        search = gm_edges[sy0 : y1 - prior_y + radius, sx0 : x1 - prior_x + radius]
+        x, y, peak, ratio = _match(search, osm_edges[y0:y1, x0:x1])
+        return (x0 - sx0 - x) / scale, (y0 - sy0 - y) / scale, peak, ratio
+
+    dx, dy, score, ratio = locate(tx0, ty0, tx1, ty1)
+
+    mx, my = (tx0 + tx1) // 2, (ty0 + ty1) // 2
+    quadrants = [
+        locate(x0, y0, x1, y1)
+        for x0, x1 in ((tx0, mx), (mx, tx1))
+        for y0, y1 in ((ty0, my), (my, ty1))
+    ]
+    spread = max(np.hypot(qx - dx, qy - dy) for qx, qy, _, _ in quadrants)
+    edge = max(abs(dx - prior[0]), abs(dy - prior[1])) >= radius / scale
+
+    return {
+        "dx": int(round(dx)),
+        "dy": int(round(dy)),
+        "score": float(score),
+        "ratio": float(ratio),
+        "spread": float(spread),
+        "edge": bool(edge),
+    }
+
+
+def is_confident(
+    alignment: dict,
+    min_score: float = MIN_SCORE,
+    min_ratio: float = MIN_RATIO,
+    max_spread: float = MAX_SPREAD,
+) -> bool:
+    """Check whether an alignment is reliable enough to crop without review."""
+    return (
+        not alignment["edge"]
+        and alignment["score"] >= min_score
+        and alignment["ratio"] >= min_ratio
+        and alignment["spread"] <= max_spread
+    )
+
+
+def georef_prior(cell_dir: str, gm_shape: tuple) -> Optional[tuple[int, int]]:
+    """
+    Return the offset of a cell's OSM capture given by its saved georeferences.
+
+    The OSM georeference accounts for the site header, so the offset only
+    misses the displacement of the Google imagery. Cells without saved
+    georeferences (captured before they were introduced) return None.
+    """
+    path = os.path.join(cell_dir, GEOREF_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        data = json.load(f)
+    if "gm.png" not in data or "osm.png" not in data:
+        return None
+
+    gm_georef = GeoReference.from_dict(data["gm.png"])
+    osm_georef = GeoReference.from_dict(data["osm.png"])
+    center = np.array([gm_shape[1] / 2, gm_shape[0] / 2])
+    offset = osm_georef.lonlat_to_pixels(gm_georef.pixels_to_lonlat(center)) - center
+    return int(round(offset[0])), int(round(offset[1]))
+
+
+def align_cell(task: tuple) -> dict:
+    """
+    Align one cell and write its crops if the alignment is confident.
+
+    Args:
+        task (tuple): (cell directory, estimate_offset kwargs, is_confident
+            kwargs)
+
+    Returns:
+        dict: Report row of the cell
+    """
+    cell_dir, estimate_options, confidence_options = task
+    row = {"cell": cell_dir}
+    try:
+        gm = cv2.imread(os.path.join(cell_dir, "gm.png"))
+        osm = cv2.imread(os.path.join(cell_dir, "osm.png"))
+        if gm is None or osm is None:
+            raise ValueError("Could not read gm.png or osm.png")
+
+        if "prior" not in estimate_options:
+            prior = georef_prior(cell_dir, gm.shape)
+            if prior is not None:
+                estimate_options = {**estimate_options, "prior": prior}
+
+        alignment = estimate_offset(gm, osm, **estimate_options)
+        row.update(alignment)
+        if not is_confident(alignment, **confidence_options):
+            row["status"] = "review"
+            return row
+
+        # The crops are centered on the same ground point of both captures
+        center_gm = (gm.shape[1] / 2, gm.shape[0] / 2)
+        center_osm = (center_gm[0] + alignment["dx"], center_gm[1] + alignment["dy"])
+        cropped_gm, cropped_osm = crop_pair(gm, osm, center_gm, center_osm)
+        cv2.imwrite(os.path.join(cell_dir, "cropped_gm.png"), cropped_gm)
+        cv2.imwrite(os.path.join(cell_dir, "cropped_osm.png"), cropped_osm)
+        row["status"] = "aligned"
+    except Exception as e:
+        print(f"Error aligning {cell_dir}: {e}")
+        row["status"] = "error"
+    return row
+
+
+def align_cells(
+    data_dir: str,
+    workers: Optional[int] = None,
+    force: bool = False,
+    estimate_options: Optional[dict] = None,
+    confidence_options: Optional[dict] = None,
+) -> list[dict]:
+    """
+    Align all cells of a data directory in parallel.
+
+    Cells that already have both crops are skipped unless `force` is set.
+    Cells with a low-confidence alignment get no crops, so the interactive
+    aligner (app.py), which skips cropped cells, only asks about these.
+
+    Returns:
+        list[dict]: Report rows of the processed cells
+    """
+    cells = []
+    for name in sorted(os.listdir(data_dir)):
+        cell_dir = os.path.join(data_dir, name)
+        if not all(
+            os.path.isfile(os.path.join(cell_dir, f)) for f in ("gm.png", "osm.png")
+        ):
+            continue
+        cropped = all(
+            os.path.isfile(os.path.join(cell_dir, f))
+            for f in ("cropped_gm.png", "cropped_osm.png")
+        )
+        if force or not cropped:
+            cells.append(cell_dir)
+
+    tasks = [(c, estimate_options or {}, confidence_options or {}) for c in cells]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(align_cell, tasks, chunksize=4))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Align the Google Maps and OSM captures of all cells and crop them"
+    )
+    parser.add_argument("data_dir", help="Directory with one folder per cell")
+    parser.add_argument(
+        "--prior",
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=("DX", "DY"),
+        help="Expected offset of the OSM capture in pixels (default: from the "
+        f"cell's georef.json, else {DEFAULT_PRIOR})",
+    )
+    parser.add_argument(
+        "--max-shift",
+        type=int,
+        default=MAX_SHIFT,
+        help="Search radius around the expected offset in pixels",
+    )
+    parser.add_argument(
+        "--min-score", type=float, default=MIN_SCORE, help="Minimum peak correlation"
+    )
+    parser.add_argument(
+        "--min-ratio",
+        type=float,
+        default=MIN_RATIO,
+        help="Minimum ratio of the peak to the second best peak",
+    )
+    parser.add_argument(
+        "--max-spread",
+        type=float,
+        default=MAX_SPREAD,
+        help="Maximum distance in pixels between the offsets of the image quadrants",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Worker processes (default: CPUs)"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Also realign cells that have crops"
+    )
+    args = parser.parse_args()
+
+    estimate_options = {"max_shift": args.max_shift}
+    if args.prior is not None:
+        estimate_options["prior"] = tuple(args.prior)
+
+    rows = align_cells(
+        args.data_dir,
+        workers=args.workers,
+        force=args.force,
+        estimate_options=estimate_options,
+        confidence_options={
+            "min_score": args.min_score,
+            "min_ratio": args.min_ratio,
+            "max_spread": args.max_spread,
+        },
+    )
+
+    report_path = os.path.join(args.data_dir, REPORT_FILE)
+    with open(report_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({field: row.get(field, "") for field in REPORT_FIELDS})
+
+    counts = {
+        status: sum(row["status"] == status for row in rows)
+        for status in ("aligned", "review", "error")
+    }
+    print(
+        f"Alignment complete. {counts['aligned']} aligned, {counts['review']} "
+        f"flagged for review, {counts['error']} failed. Report: {report_path}"
+    )
+    if counts["review"]:
+        print(f"Review the flagged cells with: python src/scraper/app.py {args.data_dir}")
+
+
+if __name__ == "__main__":
+    main()
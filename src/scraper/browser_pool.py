@@ -0,0 +1,192 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+
+import psutil
+from selenium import webdriver
+
+from src.scraper.utils import create_driver
+
+
+class BrowserSession:
+    """A pooled Chrome session with its usage counters."""
+
+    def __init__(self, driver: webdriver.Chrome) -> None:
+        self.driver = driver
+        self.uses = 0
+        # Per-session flags of the scrapers, e.g. whether cookies were accepted
+        self.state = {}
+
+    def memory_mb(self) -> float:
+        """Resident memory of chromedriver and all its Chrome processes in MB."""
+        try:
+            root = psutil.Process(self.driver.service.process.pid)
+            processes = [root] + root.children(recursive=True)
+        except (AttributeError, psutil.Error):
+            return 0.0
+
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / 2**20
+
+    def is_alive(self) -> bool:
+        """Check that the browser still answers commands."""
+        try:
+            return self.driver.execute_script("return 1;") == 1
+        except Exception:
+            return False
+
+    def quit(self) -> None:
+        try:
+            self.driver.quit()
+        except Exception as e:
+            print(f"Could not quit browser session: {e}")
+
+
+class BrowserPool:
+    """
+    Thread-safe pool of reusable Chrome sessions.
+
+    Sessions are started lazily, up to `max_sessions`, and handed out to one
+    thread at a time. A session is health-checked before reuse and recycled
+    (quit and started again on the next request) after `max_uses` borrowings
+    or when its processes grow above `max_session_memory_mb`, which caps the
+    memory leaked by long-running map pages.
+    """
+
+    def __init__(
+        self,
+        headless: bool = True,
+        max_sessions: Optional[int] = None,
+        memory_budget_mb: Optional[float] = None,
+        session_memory_mb: float = 500,
+        max_uses: int = 100,
+        max_session_memory_mb: Optional[float] = 1500,
+    ) -> None:
+        """
+        Args:
+            headless (bool, optional): Run browsers without a window.
+                Defaults to True.
+            max_sessions (int, optional): Upper limit of concurrent sessions.
+                Defaults to the number of CPUs.
+            memory_budget_mb (float, optional): Memory the sessions may use
+                together. Defaults to 75% of the currently available memory.
+            session_memory_mb (float, optional): Expected memory of one
+                session, used to fit the sessions into the budget.
+            max_uses (int, optional): Borrowings served by a session before it
+                is recycled.
+            max_session_memory_mb (float, optional): Memory above which a
+                session is recycled (None disables the check).
+        """
+        if memory_budget_mb is None:
+            memory_budget_mb = 0.75 * psutil.virtual_memory().available / 2**20
+
+        by_memory = max(1, int(memory_budget_mb // session_memory_mb))
+        self.max_sessions = min(max_sessions or psutil.cpu_count() or 1, by_memory)
+        self.headless = headless
+        self.max_uses = max_uses
+        self.max_session_memory_mb = max_session_memory_mb
+
+        self._idle = []
+        self._started = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _acquire(self) -> BrowserSession:
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Browser pool is closed")
+                if self._idle:
+                    session = self._idle.pop()
+                    break
+                if self._started < self.max_sessions:
+                    self._started += 1
+                    session = None
+                    break
+                self._condition.wait()
+
+        if session is not None and session.is_alive():
+            return session
+
+        # Start a session outside the lock, Chrome takes a while to start
+        if session is not None:
+            print("Browser session stopped responding, starting a new one.")
+            session.quit()
+        try:
+            return BrowserSession(create_driver(headless=self.headless))
+        except Exception:
+            self._discard()
+            raise
+
+    def _discard(self) -> None:
+        with self._condition:
+            self._started -= 1
+            self._condition.notify()
+
+    def _release(self, session: BrowserSession, healthy: bool) -> None:
+        session.uses += 1
+        recycle = not healthy or session.uses >= self.max_uses
+        if (
+            not recycle
+            and self.max_session_memory_mb is not None
+            and session.memory_mb() > self.max_session_memory_mb
+        ):
+            recycle = True
+
+        if recycle or self._closed:
+            session.quit()
+            self._discard()
+            return
+
+        with self._condition:
+            self._idle.append(session)
+            self._condition.notify()
+
+    @contextmanager
+    def session(self):
+        """
+        Borrow a session for the duration of a `with` block.
+
+        Yields:
+            BrowserSession: Session owned by the calling thread until the
+                block ends
+        """
+        session = self._acquire()
+        healthy = False
+        try:
+            yield session
+            healthy = True
+        finally:
+            self._release(session, healthy)
+
+    def preload(self, count: Optional[int] = None) -> None:
+        """Start sessions ahead of time, so the first pages do not wait for Chrome."""
+        count = self.max_sessions if count is None else min(count, self.max_sessions)
+        with ThreadPoolExecutor(max_workers=max(1, count)) as executor:
+            sessions = list(executor.map(lambda _: self._acquire(), range(count)))
+
+        with self._condition:
+            self._idle.extend(sessions)
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """Quit every idle session; sessions in use are quit when released."""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+            self._condition.notify_all()
+        for session in idle:
+            session.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
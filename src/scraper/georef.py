@@ -0,0 +1,271 @@
+import json
+import math
+import os
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from src.scraper.tiles import TILE_SIZE, OSM_LAT_OFFSET, lonlat_to_pixel
+
+GEOREF_FILE = "georef.json"
+
+# Web Mercator (EPSG:3857) sphere
+EARTH_RADIUS = 6378137.0
+MERCATOR_EXTENT = math.pi * EARTH_RADIUS
+
+# Zoom of the OpenStreetMap views
+CAPTURE_ZOOM = 19
+
+# Camera altitude in meters of the Google Maps satellite view ("@lat,lon,101m")
+GOOGLE_ALTITUDE = 101
+
+# Ground height shown by the Google Maps satellite view per meter of camera
+# altitude. The view has a fixed vertical field of view, so its scale depends
+# on the altitude and the viewport height. Measured on the manually aligned
+# cells in data_old (viewport 655 CSS pixels high, latitude ~52.2): the edge
+# correlation with the zoom 19 OSM captures peaks at a scale ratio of
+# 0.99-1.01, i.e. 0.183 m per CSS pixel, zoom 19 +- 0.015.
+GOOGLE_GROUND_PER_ALTITUDE = 1.187
+
+# CSS width of the viewport of the scrapers' 1200x800 window, for captures made
+# before georeferences were saved (2374 pixel wide at device pixel ratio 2)
+LEGACY_VIEWPORT_WIDTH = 1187
+
+
+def google_view_zoom(latitude: float, viewport_height: float, altitude: float = GOOGLE_ALTITUDE) -> float:
+    """
+    Return the (fractional) Web Mercator zoom of a Google Maps satellite view.
+
+    Args:
+        latitude (float): Latitude of the view center in degrees
+        viewport_height (float): Height of the map view in CSS pixels
+        altitude (float): Camera altitude of the view URL in meters
+
+    Returns:
+        float: Zoom level with the same ground resolution as the view
+    """
+    meters_per_pixel = altitude * GOOGLE_GROUND_PER_ALTITUDE / viewport_height
+    equator_size = 2 * MERCATOR_EXTENT * math.cos(math.radians(latitude))
+    return math.log2(equator_size / (TILE_SIZE * meters_per_pixel))
+
+
+class GeoReference:
+    """
+    Pixel to ground mapping of a map capture.
+
+    A capture of a Web Mercator map is an axis-aligned window of the global
+    pixel grid of its zoom level, so the mapping from image pixels to
+    EPSG:3857 meters is an exact affine transform. Latitudes and longitudes
+    are derived from it with the inverse projection.
+    """
+
+    def __init__(
+        self,
+        zoom: float,
+        origin: tuple[float, float],
+        width: int,
+        height: int,
+        scale: float = 1.0,
+    ) -> None:
+        """
+        Args:
+            zoom (float): Zoom level of the map
+            origin (tuple[float, float]): Global pixel (x, y) of the zoom level
+                at the top left corner of the image
+            width (int): Image width in pixels
+            height (int): Image height in pixels
+            scale (float): Image pixels per map pixel (the device pixel ratio
+                of browser screenshots)
+        """
+        self.zoom = zoom
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.width = int(width)
+        self.height = int(height)
+        self.scale = float(scale)
+
+    @classmethod
+    def from_view(
+        cls,
+        cords: tuple[float, float],
+        width: int,
+        height: int,
+        zoom: float = CAPTURE_ZOOM,
+        scale: float = 1.0,
+        map_rect: Optional[tuple[float, float, float, float]] = None,
+    ) -> "GeoReference":
+        """
+        Georeference a capture of a map view centered on `cords`.
+
+        Args:
+            cords (tuple[float, float]): (latitude, longitude) of the center
+                of the map element
+            width (int): Image width in pixels
+            height (int): Image height in pixels
+            zoom (float): Zoom level of the view
+            scale (float): Image pixels per map pixel
+            map_rect (tuple, optional): (left, top, width, height) of the map
+                element in map pixels, if it does not fill the image (e.g.
+                below the openstreetmap.org header)
+        """
+        if map_rect is None:
+            map_rect = (0.0, 0.0, width / scale, height / scale)
+        left, top, map_width, map_height = map_rect
+
+        x, y = lonlat_to_pixel(cords[0], cords[1], zoom)
+        origin = (x - left - map_width / 2, y - top - map_height / 2)
+        return cls(zoom, origin, width, height, scale=scale)
+
+    @property
+    def world_size(self) -> float:
+        """Size of the world in map pixels of the zoom level."""
+        return TILE_SIZE * 2**self.zoom
+
+    @property
+    def transform(self) -> tuple[float, float, float, float, float, float]:
+        """
+        Affine transform (a, b, c, d, e, f) from image pixels to EPSG:3857:
+        x = a * column + b * row + c, y = d * column + e * row + f
+        (the order of rasterio/affine).
+        """
+        size = 2 * MERCATOR_EXTENT / (self.world_size * self.scale)
+        return (
+            size,
+            0.0,
+            self.origin[0] / self.world_size * 2 * MERCATOR_EXTENT - MERCATOR_EXTENT,
+            0.0,
+            -size,
+            MERCATOR_EXTENT - self.origin[1] / self.world_size * 2 * MERCATOR_EXTENT,
+        )
+
+    def pixels_to_mercator(self, points) -> np.ndarray:
+        """Map image pixels (..., 2) as (x, y) to EPSG:3857 meters (..., 2)."""
+        points = np.asarray(points, dtype=np.float64)
+        a, _, c, _, e, f = self.transform
+        return np.stack([a * points[..., 0] + c, e * points[..., 1] + f], axis=-1)
+
+    def pixels_to_lonlat(self, points) -> np.ndarray:
+        """Map image pixels (..., 2) as (x, y) to WGS84 (..., 2) as (lon, lat)."""
+        mercator = self.pixels_to_mercator(points)
+        lon = np.degrees(mercator[..., 0] / EARTH_RADIUS)
+        lat = np.degrees(2 * np.arctan(np.exp(mercator[..., 1] / EARTH_RADIUS)) - np.pi / 2)
+        return np.stack([lon, lat], axis=-1)
+
+    def lonlat_to_pixels(self, points) -> np.ndarray:
+        """Map WGS84 (..., 2) as (lon, lat) to image pixels (..., 2) as (x, y)."""
+        points = np.asarray(points, dtype=np.float64)
+        lat = np.radians(np.clip(points[..., 1], -85.0511, 85.0511))
+        x = (points[..., 0] + 180.0) / 360.0 * self.world_size
+        y = (0.5 - np.log(np.tan(np.pi / 4 + lat / 2)) / (2 * np.pi)) * self.world_size
+        return np.stack(
+            [(x - self.origin[0]) * self.scale, (y - self.origin[1]) * self.scale],
+            axis=-1,
+        )
+
+    @property
+    def bbox(self) -> tuple[float, float, float, float]:
+        """(west, south, east, north) of the image in degrees."""
+        (west, north), (east, south) = self.pixels_to_lonlat(
+            [(0, 0), (self.width, self.height)]
+        )
+        return float(west), float(south), float(east), float(north)
+
+    @property
+    def meters_per_pixel(self) -> float:
+        """Ground size of an image pixel at the center of the image."""
+        _, latitude = self.pixels_to_lonlat((self.width / 2, self.height / 2))
+        return self.transform[0] * math.cos(math.radians(latitude))
+
+    def crop(self, x: int, y: int, width: int, height: int) -> "GeoReference":
+        """Return the georeference of an image window starting at pixel (x, y)."""
+        origin = (self.origin[0] + x / self.scale, self.origin[1] + y / self.scale)
+        return GeoReference(self.zoom, origin, width, height, scale=self.scale)
+
+    def to_dict(self) -> dict:
+        return {
+            "zoom": self.zoom,
+            "origin": list(self.origin),
+            "width": self.width,
+            "height": self.height,
+            "scale": self.scale,
+            # Derived values, for readers without this class
+            "crs": "EPSG:3857",
+            "transform": list(self.transform),
+            "bbox": list(self.bbox),
+            "meters_per_pixel": self.meters_per_pixel,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "GeoReference":
+        return cls(
+            data["zoom"],
+            data["origin"],
+            data["width"],
+            data["height"],
+            scale=data.get("scale", 1.0),
+        )
+
+
+def save_georefs(cell_dir: str, georefs: dict) -> str:
+    """
+    Write the georeferences of a cell's images, merged with the existing ones.
+
+    Args:
+        cell_dir (str): Cell directory
+        georefs (dict): {image file name: GeoReference}
+
+    Returns:
+        str: Path of the georeference file
+    """
+    path = os.path.join(cell_dir, GEOREF_FILE)
+    data = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+    data.update({name: georef.to_dict() for name, georef in georefs.items()})
+
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    return path
+
+
+def load_georef(cell_dir: str, image_name: str = "gm.png") -> Optional[GeoReference]:
+    """
+    Load the georeference of a cell's image.
+
+    Cells captured before georeferences were saved fall back to the center
+    in coords.json, assuming the image shows the whole view of a
+    `LEGACY_VIEWPORT_WIDTH` wide viewport (at `CAPTURE_ZOOM` for OSM, at the
+    measured Google Maps zoom otherwise). This is approximate: the OSM view
+    below the site header is not centered in its screenshot.
+
+    Returns:
+        GeoReference: Georeference, or None if the cell has no coordinates
+    """
+    path = os.path.join(cell_dir, GEOREF_FILE)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        if image_name in data:
+            return GeoReference.from_dict(data[image_name])
+
+    coords_path = os.path.join(cell_dir, "coords.json")
+    image_path = os.path.join(cell_dir, image_name)
+    if not (os.path.exists(coords_path) and os.path.exists(image_path)):
+        return None
+
+    with open(coords_path, "r") as f:
+        coords = json.load(f)
+    with Image.open(image_path) as image:
+        width, height = image.size
+
+    latitude = coords["latitude"]
+    scale = width / LEGACY_VIEWPORT_WIDTH
+    if "osm" in image_name:
+        latitude += OSM_LAT_OFFSET
+        zoom = CAPTURE_ZOOM
+    else:
+        zoom = google_view_zoom(latitude, height / scale)
+    return GeoReference.from_view(
+        (latitude, coords["longitude"]), width, height, zoom=zoom, scale=scale
+    )
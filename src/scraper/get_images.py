@@ -72,15 +72,14 @@ if __name__ == "__main__":
     chrome_options = Options()
     chrome_options.add_argument("--headless")
     chrome_options.add_argument("--window-size=1200,800")
+    # One browser is reused for every coordinate instead of one per image
     google_scraper = GoogleMapsScraper(headless=False)
-    # open_street_map_scraper = OpenStreetMapScraper(headless=False)
+    open_street_map_scraper = OpenStreetMapScraper(driver=google_scraper.driver)
     for index, cords in enumerate(to_check):
         if cords is None:
             continue
 
         google_scraper.scrape(cords=cords, path=f"data/{index}/gm.png")
-        open_street_map_scraper = OpenStreetMapScraper(headless=False)
         open_street_map_scraper.scrape(cords=cords, path=f"data/{index}/osm.png")
-        open_street_map_scraper.driver.quit()
 
     google_scraper.driver.quit()
\ No newline at end of file
@@ -2,51 +2,130 @@ import time
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
-from src.scraper.utils import create_driver
+from src.scraper.georef import CAPTURE_ZOOM, GOOGLE_ALTITUDE, GeoReference, google_view_zoom
+from src.scraper.utils import (
+    create_driver,
+    hide_selectors_css,
+    inject_stylesheet,
+    view_geometry,
+    wait_for_tiles,
+)
+
+# Satellite imagery and map tile requests of Google Maps
+GOOGLE_TILE_URLS = r"khms\d*\.google|/kh/|/maps/vt"
+
+# UI drawn over the map, hidden with one stylesheet before the screenshot
+GOOGLE_OVERLAYS = [
+    ".JLm1tf-bEDTcc-GWbSKc",  # search box
+    ".bJzME.tTVLSc",  # likely a UI panel or widget
+    ".app-vertical-widget-holder.Hk4XGb",  # vertical widget holder
+    ".app-bottom-content-anchor.HdXONd",  # bottom content anchor
+    ".gb_Re",  # login button
+    ".scene-footer",  # footer
+    ".hUbt4d-watermark",  # google logo at the bottom
+    ".ZhtFke",  # another UI element
+    "[class*='hdeJwf']",  # minimap
+]
+
+OSM_TILE_URLS = r"tile\.openstreetmap\.org"
+
+# Leaflet map element of openstreetmap.org, below the site header
+OSM_MAP_ELEMENT = "#map"
+
+# Leaflet marks every tile image with this class once it is loaded
+LEAFLET_TILES_LOADED = (
+    "document.querySelectorAll('.leaflet-tile:not(.leaflet-tile-loaded)').length === 0"
+)
+
+OSM_OVERLAYS = [
+    ".leaflet-control-container",
+    ".search_forms",
+    ".d-flex.bg-body.text-nowrap.closed.z-3",
+    ".welcome.position-relative.p-3",
+    ".leaflet-control",
+    ".d-flex.gap-2",
+]
+
+
+def _georeference(driver, cords, map_selector=None, altitude=None) -> GeoReference:
+    """
+    Georeference the screenshot of the current map view centered on `cords`.
+
+    Views opened by camera altitude (Google Maps) get the zoom of the
+    measured altitude scale, the others are at `CAPTURE_ZOOM`.
+    """
+    view = view_geometry(driver, map_selector)
+    ratio = view["device_pixel_ratio"]
+    zoom = CAPTURE_ZOOM
+    if altitude is not None:
+        map_height = view["map_rect"][3] if view["map_rect"] else view["height"]
+        zoom = google_view_zoom(cords[0], map_height, altitude)
+    return GeoReference.from_view(
+        cords,
+        round(view["width"] * ratio),
+        round(view["height"] * ratio),
+        zoom=zoom,
+        scale=ratio,
+        map_rect=view["map_rect"],
+    )
 
 
 class GoogleMapsScraper:
 
-    def __init__(self, headless: bool = True) -> None:
+    def __init__(self, headless: bool = True, driver=None) -> None:
         """
-        TOOD
-
         Args:
-            longitude (float): _description_
-            latitude (float): _description_
-            headless (bool, optional): _description_. Defaults to True.
+            headless (bool, optional): Run a new browser without a window.
+                Defaults to True.
+            driver (webdriver.Chrome, optional): Existing browser session to
+                use, e.g. from a BrowserPool. A new one is started if None.
+        """
+        self.driver = driver if driver is not None else create_driver(headless=headless)
+
+    def scrape(self, cords: tuple[float, float], path: str) -> GeoReference:
         """
-        self.driver = create_driver(headless=headless)
+        Take a screenshot of the satellite view centered on `cords`.
 
-    def scrape(self, cords: tuple[float, float], path: str) -> None:
+        Returns:
+            GeoReference: Pixel to ground mapping of the screenshot
+        """
         latitude, longitude = cords
         self.driver.get(
-            f"https://www.google.pl/maps/@{latitude},{longitude},101m/data=!3m1!1e3?entry=ttu&g_ep=EgoyMDI1MDMwMi4wIKXMDSoASAFQAw%3D%3D"
+            f"https://www.google.pl/maps/@{latitude},{longitude},{GOOGLE_ALTITUDE}m/data=!3m1!1e3?entry=ttu&g_ep=EgoyMDI1MDMwMi4wIKXMDSoASAFQAw%3D%3D"
         )
         self._click_accept()
-        time.sleep(3)
         self._disable_labels()
-        self._remove_elements_by_class()
-        self._remove_minimap()
-        # wait 120 seconds for the map to load
-        # time.sleep(120)
+        # Screenshot as soon as the satellite tiles (re-rendered without labels) are in
+        wait_for_tiles(self.driver, GOOGLE_TILE_URLS)
+        self._hide_overlays()
         self.driver.save_screenshot(path)
+        return _georeference(self.driver, cords, altitude=GOOGLE_ALTITUDE)
 
     def _click_accept(self):
+        # The consent page is already loaded when driver.get returns
+        buttons = self.driver.find_elements(
+            By.XPATH, "//button[contains(., 'Zaakceptuj wszystko')]"
+        )
+        if not buttons:
+            return
         try:
-            accept_button = WebDriverWait(self.driver, 5).until(
-                EC.element_to_be_clickable(
-                    (By.XPATH, "//button[contains(., 'Zaakceptuj wszystko')]")
-                )
-            )
-            accept_button.click()
+            buttons[0].click()
             print("Accepted cookies.")
-            time.sleep(1)
+            WebDriverWait(self.driver, 10).until(
+                lambda driver: "consent." not in driver.current_url
+            )
         except Exception as e:
-            print("Could not find the accept button:", e)
+            print("Could not accept cookies:", e)
 
     def _disable_labels(self):
         try:
+            # Wait for the map UI instead of a fixed delay
+            WebDriverWait(self.driver, 10).until(
+                EC.presence_of_element_located(
+                    (By.CSS_SELECTOR, 'button[jsaction="layerswitcher.quick.more"]')
+                )
+            )
+
             target_x = 150
             target_y = self.driver.execute_script("return window.innerHeight;") - 80
 
@@ -187,80 +266,45 @@ class GoogleMapsScraper:
                 else:
                     print("Labels checkbox is already unchecked.")
 
-                time.sleep(0.2)
-
         except Exception as e:
             print(f"Could not uncheck labels button {e}")
 
-    def _remove_elements_by_class(self):
-        def _remove(class_name):
-            try:
-                if " " in class_name:
-                    # Create an XPath that looks for elements with both classes
-                    class_parts = class_name.split(" ")
-                    xpath = f"//*[contains(@class, '{class_parts[0]}') and contains(@class, '{class_parts[1]}')]"
-                    element = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((By.XPATH, xpath))
-                    )
-                else:
-                    element = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((By.CLASS_NAME, class_name))
-                    )
-
-                self.driver.execute_script("arguments[0].remove();", element)
-                print(f"Element with class '{class_name}' removed.")
-            except Exception as e:
-                print(f"Couldn't remove element with class '{class_name}': {e}")
-
-        elements_to_remove_by_class = [
-            "JLm1tf-bEDTcc-GWbSKc",  # search box
-            "bJzME tTVLSc",  # likely a UI panel or widget
-            "app-vertical-widget-holder Hk4XGb",  # vertical widget holder
-            "app-bottom-content-anchor HdXONd",  # bottom content anchor
-            "gb_Re",  # login button
-            "scene-footer",  # footer
-            "hUbt4d-watermark",  # google logo at the bottom
-            "ZhtFke",  # another UI element
-        ]
-
-        for class_name in elements_to_remove_by_class:
-            _remove(class_name)
-
-    def _remove_minimap(self):
-        try:
-            xpath = "//*[contains(@class, 'hdeJwf')]"
-            element = WebDriverWait(self.driver, 3).until(
-                EC.presence_of_element_located((By.XPATH, xpath))
-            )
-            self.driver.execute_script("arguments[0].remove();", element)
-            print("Element z klasą 'hdeJwf pzaG1c' usunięty przed zrzutem ekranu.")
-        except Exception as e:
-            print(f"Element z klasą 'hdeJwf pzaG1c' nie został znaleziony: {e}")
+    def _hide_overlays(self):
+        inject_stylesheet(
+            self.driver, hide_selectors_css(GOOGLE_OVERLAYS), "scraper-hide-overlays"
+        )
 
 
 class OpenStreetMapScraper:
 
-    def __init__(self, headless: bool = True) -> None:
+    def __init__(self, headless: bool = True, driver=None) -> None:
         """
-        TOOD
-
         Args:
-            longitude (float): _description_
-            latitude (float): _description_
-            headless (bool, optional): _description_. Defaults to True.
+            headless (bool, optional): Run a new browser without a window.
+                Defaults to True.
+            driver (webdriver.Chrome, optional): Existing browser session to
+                use, e.g. from a BrowserPool. A new one is started if None.
         """
-        self.driver = create_driver(headless=headless)
+        self.driver = driver if driver is not None else create_driver(headless=headless)
 
-    def scrape(self, cords: tuple[float, float], path: str) -> None:
+    def scrape(self, cords: tuple[float, float], path: str) -> GeoReference:
+        """
+        Take a screenshot of the map at zoom 19 centered on `cords`.
+
+        Returns:
+            GeoReference: Pixel to ground mapping of the screenshot
+        """
         latitude, longitude = cords
         self.driver.get(
             f"https://www.openstreetmap.org/#map=19/{latitude}/{longitude}"
         )
         # self._click_accept()
-        time.sleep(2)
-        self._remove_elements_by_class()
-        # time.sleep(1200)
+        self._hide_overlays()
+        wait_for_tiles(
+            self.driver, OSM_TILE_URLS, ready_script=LEAFLET_TILES_LOADED
+        )
         self.driver.save_screenshot(path)
+        return _georeference(self.driver, cords, OSM_MAP_ELEMENT)
 
     def _click_accept(self):
         try:
@@ -275,39 +319,11 @@ class OpenStreetMapScraper:
         except Exception as e:
             print("Could not find the accept button:", e)
 
-    def _remove_elements_by_class(self):
-        def _remove(class_name):
-            try:
-                if " " in class_name:
-                    # Create an XPath that looks for elements with both classes
-                    class_parts = class_name.split(" ")
-                    xpath = f"//*[contains(@class, '{class_parts[0]}') and contains(@class, '{class_parts[1]}')]"
-                    element = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((By.XPATH, xpath))
-                    )
-                else:
-                    element = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((By.CLASS_NAME, class_name))
-                    )
+    def _hide_overlays(self):
+        inject_stylesheet(
+            self.driver, hide_selectors_css(OSM_OVERLAYS), "scraper-hide-overlays"
+        )
 
-                self.driver.execute_script("arguments[0].remove();", element)
-                print(f"Element with class '{class_name}' removed.")
-            except Exception as e:
-                print(f"Couldn't remove element with class '{class_name}': {e}")
-
-        elements_to_remove_by_class = [
-            "leaflet-control-container",
-            "search_forms",
-            "d-flex bg-body text-nowrap closed z-3",
-            "welcome position-relative p-3",
-            "leaflet-control-attribution leaflet-control",
-            "d-flex gap-2",
-        ]
-
-        for class_name in elements_to_remove_by_class:
-            _remove(class_name)
-        for _ in range(8):
-            _remove("leaflet-control")        
 
 def main():
     longitude = 21.0103057
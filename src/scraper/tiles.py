@@ -0,0 +1,320 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import cv2
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+TILE_SIZE = 256
+OSM_TILE_URL = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+USER_AGENT = "DataScienceWorkshop parking density research (tile fetcher)"
+
+# The openstreetmap.org header covers the top of the browser view, so the browser
+# OSM view of a cell is shifted south to line up with the Google Maps view. Tile
+# windows have no header and need no offset.
+OSM_LAT_OFFSET = -0.000009 * 7.5
+
+
+def lonlat_to_pixel(
+    latitude: float, longitude: float, zoom: int
+) -> tuple[float, float]:
+    """
+    Project a WGS84 point to global Web Mercator pixel coordinates.
+
+    Args:
+        latitude (float): Latitude in degrees
+        longitude (float): Longitude in degrees
+        zoom (int): Zoom level
+
+    Returns:
+        tuple[float, float]: (x, y) in pixels of the whole zoom level
+    """
+    world = TILE_SIZE * 2**zoom
+    sin_lat = math.sin(math.radians(latitude))
+    x = (longitude + 180.0) / 360.0 * world
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * world
+    return x, y
+
+
+def pixel_window(
+    cords: tuple[float, float], zoom: int = 19, width: int = 1200, height: int = 800
+) -> tuple[int, int, int, int]:
+    """
+    Return the pixel window (x0, y0, x1, y1) of a map view centered on a point.
+
+    This is the area a browser of the given viewport size shows for
+    "#map=<zoom>/<latitude>/<longitude>".
+    """
+    x, y = lonlat_to_pixel(cords[0], cords[1], zoom)
+    x0, y0 = round(x - width / 2), round(y - height / 2)
+    return x0, y0, x0 + width, y0 + height
+
+
+def window_tiles(
+    window: tuple[int, int, int, int], zoom: int
+) -> list[tuple[int, int, int]]:
+    """Return the (z, x, y) tiles covering a pixel window."""
+    x0, y0, x1, y1 = window
+    count = 2**zoom
+    return [
+        (zoom, tx % count, ty)
+        for ty in range(max(0, y0 // TILE_SIZE), min(count, (y1 - 1) // TILE_SIZE + 1))
+        for tx in range(x0 // TILE_SIZE, (x1 - 1) // TILE_SIZE + 1)
+    ]
+
+
+class MBTilesCache:
+    """
+    Thread-safe tile cache in an MBTiles (SQLite) file.
+
+    Rows follow the MBTiles convention (TMS, y axis flipped), so the file can
+    be opened by other MBTiles tools.
+    """
+
+    def __init__(self, path: str, name: str = "osm") -> None:
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, "
+                "tile_column INTEGER, tile_row INTEGER, tile_data BLOB, "
+                "PRIMARY KEY (zoom_level, tile_column, tile_row))"
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO metadata VALUES (?, ?)",
+                [("name", name), ("format", "png"), ("type", "baselayer")],
+            )
+
+    @staticmethod
+    def _row(z: int, y: int) -> int:
+        return 2**z - 1 - y
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND "
+                "tile_column = ? AND tile_row = ?",
+                (z, x, self._row(z, y)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, z: int, x: int, y: int, data: bytes) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                (z, x, self._row(z, y), sqlite3.Binary(data)),
+            )
+
+    def __contains__(self, tile: tuple[int, int, int]) -> bool:
+        z, x, y = tile
+        with self._lock:
+            return (
+                self._connection.execute(
+                    "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? "
+                    "AND tile_row = ?",
+                    (z, x, self._row(z, y)),
+                ).fetchone()
+                is not None
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class TileFetcher:
+    """
+    Rate-limited XYZ tile client backed by an MBTiles cache.
+
+    Every tile is downloaded at most once: cached tiles are read from the
+    cache, and threads asking for a tile that is being downloaded wait for
+    that download instead of starting their own.
+
+    Respect the usage policy of the tile server; for bulk downloads of the
+    whole grid use your own server (e.g. a local tile server) through
+    `url_template`.
+    """
+
+    def __init__(
+        self,
+        cache: MBTilesCache,
+        url_template: str = OSM_TILE_URL,
+        max_connections: int = 2,
+        requests_per_second: float = 2.0,
+        timeout: float = 30.0,
+        retries: int = 3,
+        user_agent: str = USER_AGENT,
+    ) -> None:
+        """
+        Args:
+            cache (MBTilesCache): Tile cache
+            url_template (str): Tile URL with {z}, {x} and {y} placeholders
+            max_connections (int): Size of the HTTP connection pool
+            requests_per_second (float): Maximum request rate (None disables
+                the limit, e.g. for a local server)
+            timeout (float): Request timeout in seconds
+            retries (int): Attempts per tile
+            user_agent (str): User-Agent header sent with every request
+        """
+        self.cache = cache
+        self.url_template = url_template
+        self.timeout = timeout
+        self.retries = retries
+        self.downloaded = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_connections, pool_maxsize=max_connections
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = user_agent
+        self._connections = threading.Semaphore(max_connections)
+
+        self._interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._next_request = 0.0
+        self._rate_lock = threading.Lock()
+
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+    def _wait_for_rate_limit(self) -> None:
+        with self._rate_lock:
+            now = time.monotonic()
+            delay = self._next_request - now
+            self._next_request = max(now, self._next_request) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def _download(self, z: int, x: int, y: int) -> bytes:
+        url = self.url_template.format(z=z, x=x, y=y)
+        for attempt in range(1, self.retries + 1):
+            self._wait_for_rate_limit()
+            try:
+                with self._connections:
+                    response = self.session.get(url, timeout=self.timeout)
+                response.raise_for_status()
+                return response.content
+            except requests.RequestException as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Retrying tile {z}/{x}/{y} ({e})")
+                time.sleep(attempt)
+
+    def get(self, z: int, x: int, y: int) -> bytes:
+        """Return the PNG bytes of a tile, downloading it only if it is not cached."""
+        data = self.cache.get(z, x, y)
+        if data is not None:
+            return data
+
+        with self._in_flight_lock:
+            future = self._in_flight.get((z, x, y))
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[(z, x, y)] = future
+
+        if not owner:
+            return future.result()
+
+        try:
+            data = self.cache.get(z, x, y)
+            if data is None:
+                data = self._download(z, x, y)
+                self.cache.put(z, x, y, data)
+                with self._in_flight_lock:
+                    self.downloaded += 1
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[(z, x, y)]
+
+    def prefetch(self, tiles, workers: int = 4) -> int:
+        """
+        Download the missing tiles of a set (e.g. of all grid cells) in parallel.
+
+        Returns:
+            int: Number of tiles that were not cached yet
+        """
+        missing = sorted({tile for tile in tiles if tile not in self.cache})
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list(executor.map(lambda tile: self.get(*tile), missing))
+        return len(missing)
+
+    def render(self, window: tuple[int, int, int, int], zoom: int) -> np.ndarray:
+        """Stitch the tiles of a pixel window into one BGR image of its size."""
+        x0, y0, x1, y1 = window
+        image = np.zeros((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+        count = 2**zoom
+        for ty in range(y0 // TILE_SIZE, (y1 - 1) // TILE_SIZE + 1):
+            if ty < 0 or ty >= count:
+                continue
+            for tx in range(x0 // TILE_SIZE, (x1 - 1) // TILE_SIZE + 1):
+                data = self.get(zoom, tx % count, ty)
+                tile = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+                # Paste the part of the tile that lies inside the window
+                left, top = tx * TILE_SIZE, ty * TILE_SIZE
+                ix0, iy0 = max(x0, left), max(y0, top)
+                ix1, iy1 = min(x1, left + TILE_SIZE), min(y1, top + TILE_SIZE)
+                image[iy0 - y0 : iy1 - y0, ix0 - x0 : ix1 - x0] = tile[
+                    iy0 - top : iy1 - top, ix0 - left : ix1 - left
+                ]
+        return image
+
+
+class TileMapScraper:
+    """
+    Map "screenshots" stitched from XYZ raster tiles, without a browser.
+
+    Has the same `scrape` interface as OpenStreetMapScraper.
+    """
+
+    def __init__(
+        self,
+        fetcher: TileFetcher,
+        zoom: int = 19,
+        width: int = 1200,
+        height: int = 800,
+    ) -> None:
+        """
+        Args:
+            fetcher (TileFetcher): Tile client (shared between threads)
+            zoom (int): Zoom level, 19 matches OpenStreetMapScraper
+            width (int): Output width in pixels
+            height (int): Output height in pixels
+        """
+        self.fetcher = fetcher
+        self.zoom = zoom
+        self.width = width
+        self.height = height
+
+    def window(self, cords: tuple[float, float]) -> tuple[int, int, int, int]:
+        return pixel_window(cords, self.zoom, self.width, self.height)
+
+    def tiles(self, cords: tuple[float, float]) -> list[tuple[int, int, int]]:
+        """Return the tiles needed for the view centered on `cords`."""
+        return window_tiles(self.window(cords), self.zoom)
+
+    def scrape(self, cords: tuple[float, float], path: str) -> None:
+        image = self.fetcher.render(self.window(cords), self.zoom)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, image)
@@ -1,10 +1,24 @@
+import time
+from functools import lru_cache
+
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium import webdriver
 
+@lru_cache(maxsize=None)
+def driver_path() -> str:
+    """
+    Resolve the chromedriver binary once per process.
+
+    `ChromeDriverManager().install()` checks the installed Chrome version and
+    the driver cache on every call, so the path is resolved only once.
+    """
+    return ChromeDriverManager().install()
+
+
 def create_driver(headless: bool = True) -> webdriver.Chrome:
-        """TODO"""
+        """Start a Chrome session with the scrapers' window size and Polish locale."""
         chrome_options = Options()
         if headless:
             chrome_options.add_argument("--headless")
@@ -27,6 +41,114 @@ def create_driver(headless: bool = True) -> webdriver.Chrome:
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-dev-shm-usage")
         driver = webdriver.Chrome(
-            service=Service(ChromeDriverManager().install()), options=chrome_options
+            service=Service(driver_path()), options=chrome_options
         )
         return driver
+
+
+# Counts tile requests completed since the previous call; the resource buffer is
+# cleared every time, so it never fills up in a long-lived session
+_COMPLETED_TILES_SCRIPT = """
+var pattern = new RegExp(arguments[0]);
+var count = performance.getEntriesByType('resource').filter(
+    function (entry) { return pattern.test(entry.name); }
+).length;
+performance.clearResourceTimings();
+return [document.readyState, count, arguments[1] ? eval(arguments[1]) : true];
+"""
+
+
+def wait_for_tiles(
+    driver: webdriver.Chrome,
+    tile_url_pattern: str,
+    ready_script: str = None,
+    timeout: float = 20.0,
+    idle: float = 0.75,
+    poll: float = 0.1,
+) -> bool:
+    """
+    Wait until the map tiles of the current page finished loading.
+
+    The page counts as loaded when the document is complete, at least one
+    tile request matching `tile_url_pattern` has finished, no new tile has
+    finished for `idle` seconds and the optional `ready_script` (a JavaScript
+    expression, e.g. a check of the Leaflet tile classes) is true.
+
+    Args:
+        driver (webdriver.Chrome): Browser session
+        tile_url_pattern (str): JavaScript regular expression of tile URLs
+        ready_script (str, optional): Extra JavaScript readiness expression
+        timeout (float, optional): Maximum wait in seconds
+        idle (float, optional): Quiet period after the last finished tile
+        poll (float, optional): Polling interval in seconds
+
+    Returns:
+        bool: True if the tiles loaded, False on timeout
+    """
+    start = time.monotonic()
+    last_tile, seen_tiles = start, 0
+    while time.monotonic() - start < timeout:
+        state, count, ready = driver.execute_script(
+            _COMPLETED_TILES_SCRIPT, tile_url_pattern, ready_script
+        )
+        now = time.monotonic()
+        if count:
+            seen_tiles += count
+            last_tile = now
+        if state == "complete" and seen_tiles and ready and now - last_tile >= idle:
+            return True
+        time.sleep(poll)
+
+    print(f"Tiles still loading after {timeout} s, taking the screenshot anyway.")
+    return False
+
+
+def inject_stylesheet(driver: webdriver.Chrome, css: str, style_id: str) -> None:
+    """Add a stylesheet to the current page once (e.g. to hide map overlays)."""
+    driver.execute_script(
+        """
+        if (!document.getElementById(arguments[0])) {
+            var style = document.createElement('style');
+            style.id = arguments[0];
+            style.textContent = arguments[1];
+            document.head.appendChild(style);
+        }
+        """,
+        style_id,
+        css,
+    )
+
+
+def hide_selectors_css(selectors: list[str]) -> str:
+    """Build a stylesheet hiding every element matching the CSS selectors."""
+    return ",\n".join(selectors) + " {\n    display: none !important;\n}\n"
+
+
+def view_geometry(driver: webdriver.Chrome, map_selector: str = None) -> dict:
+    """
+    Measure the viewport and map element of the current page in CSS pixels.
+
+    Returns:
+        dict: width, height and device_pixel_ratio of the viewport, and
+            map_rect, the (left, top, width, height) of the element matching
+            `map_selector` (None if no selector is given or nothing matches)
+    """
+    width, height, ratio, rect = driver.execute_script(
+        """
+        var map = arguments[0] ? document.querySelector(arguments[0]) : null;
+        var rect = map ? map.getBoundingClientRect() : null;
+        return [
+            window.innerWidth,
+            window.innerHeight,
+            window.devicePixelRatio,
+            rect ? [rect.left, rect.top, rect.width, rect.height] : null,
+        ];
+        """,
+        map_selector,
+    )
+    return {
+        "width": width,
+        "height": height,
+        "device_pixel_ratio": ratio,
+        "map_rect": tuple(rect) if rect else None,
+    }
@@ -0,0 +1,42 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from src.scraper.auto_align import ALIGNMENT_TOLERANCE, estimate_offset, is_confident
+
+DATA_OLD = "data_old"
+CELLS = sorted(
+    (name for name in os.listdir(DATA_OLD) if name.isdigit()), key=int
+) if os.path.isdir(DATA_OLD) else []
+
+
+def manual_offset(cell_dir, gm, osm):
+    """Recover the offset of a manually aligned cell from the positions of its crops."""
+    positions = []
+    for image, crop_name in ((gm, "cropped_gm.png"), (osm, "cropped_osm.png")):
+        crop = cv2.imread(os.path.join(cell_dir, crop_name))
+        result = cv2.matchTemplate(image, crop, cv2.TM_SQDIFF)
+        positions.append(np.array(cv2.minMaxLoc(result)[2]))
+    return positions[1] - positions[0]
+
+
+@pytest.mark.skipif(not CELLS, reason="no manually aligned cells")
+def test_confident_alignments_are_within_the_tolerance():
+    accepted = 0
+    for name in CELLS:
+        cell_dir = os.path.join(DATA_OLD, name)
+        gm = cv2.imread(os.path.join(cell_dir, "gm.png"))
+        osm = cv2.imread(os.path.join(cell_dir, "osm.png"))
+
+        alignment = estimate_offset(gm, osm)
+        if not is_confident(alignment):
+            continue
+        accepted += 1
+        expected = manual_offset(cell_dir, gm, osm)
+        error = np.hypot(alignment["dx"] - expected[0], alignment["dy"] - expected[1])
+        assert error <= ALIGNMENT_TOLERANCE, f"cell {name} is {error:.1f} px off"
+
+    # Most cells still align without review
+    assert accepted > len(CELLS) / 2
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+
+from src.predictor.detection_store import DetectionStore
+from src.predictor.detections import Detections
+from src.scraper.georef import EARTH_RADIUS, GeoReference
+
+
+def car_corners(lat, lon, length=4.5, width=2.0):
+    """Return the (lon, lat) corners of a car parked east-west at a point."""
+    dlat = math.degrees(width / 2 / EARTH_RADIUS)
+    dlon = math.degrees(length / 2 / (EARTH_RADIUS * math.cos(math.radians(lat))))
+    return np.array(
+        [
+            [lon - dlon, lat - dlat],
+            [lon + dlon, lat - dlat],
+            [lon + dlon, lat + dlat],
+            [lon - dlon, lat + dlat],
+        ]
+    )
+
+
+def capture_detections(georef, cars, rng):
+    """Detect the cars fully inside a capture, with a pixel of noise."""
+    polygons = []
+    for corners in cars:
+        pixels = georef.lonlat_to_pixels(corners)
+        inside = (pixels >= 0).all() and (pixels < (georef.width, georef.height)).all()
+        if inside:
+            polygons.append(pixels + rng.uniform(-1, 1, size=2))
+    count = len(polygons)
+    return Detections(
+        np.array(polygons).reshape(-1, 4, 2),
+        rng.uniform(0.3, 0.9, count),
+        np.zeros(count),
+        np.ones(count),
+    )
+
+
+def test_overlapping_captures_dedupe_to_the_exact_count():
+    rng = np.random.default_rng(0)
+    captures, cars = [], []
+    # Two rows of two overlapping captures each, in cities ~220 km apart,
+    # so the ground scale differs by ~4% between them
+    for center_lat, center_lon in ((52.23, 21.01), (54.35, 18.65)):
+        georefs = [
+            GeoReference.from_view(
+                (center_lat + dlat, center_lon + dlon), 1200, 800, zoom=19, scale=2
+            )
+            for dlat in (0.0, -0.0004)
+            for dlon in (0.0, 0.0006)
+        ]
+        west, south, east, north = (
+            min(g.bbox[0] for g in georefs),
+            min(g.bbox[1] for g in georefs),
+            max(g.bbox[2] for g in georefs),
+            max(g.bbox[3] for g in georefs),
+        )
+        # Cars on a lattice 8 m apart, so no two cars of one capture overlap
+        lats = np.arange(south, north, math.degrees(8 / EARTH_RADIUS))
+        ground_scale = math.cos(math.radians(center_lat))
+        lons = np.arange(west, east, math.degrees(8 / (EARTH_RADIUS * ground_scale)))
+        cars.extend(car_corners(lat, lon) for lat in lats for lon in lons)
+        captures.extend(georefs)
+
+    detected = [capture_detections(g, cars, rng) for g in captures]
+    seen = set()
+    for georef in captures:
+        for index, corners in enumerate(cars):
+            pixels = georef.lonlat_to_pixels(corners)
+            if (pixels >= 0).all() and (pixels < (georef.width, georef.height)).all():
+                seen.add(index)
+
+    store = DetectionStore()
+    # North to south, like find_cells
+    order = sorted(
+        range(len(captures)),
+        key=lambda i: (-captures[i].transform[5], captures[i].transform[2]),
+    )
+    for i in order:
+        store.add_cell(i, detected[i], captures[i])
+    store.close()
+
+    total = sum(len(d) for d in detected)
+    assert store.unique_cars == len(seen)
+    assert store.merged_duplicates == total - len(seen)
+    assert sum(area["unique_cars"] for area in store.areas.values()) == len(seen)
@@ -0,0 +1,56 @@
+import os
+
+import cv2
+import numpy as np
+
+from run_prediction import (
+    OUTPUT_FILES,
+    REQUIRED_FILES,
+    SKIPPED_OUTPUT_FILES,
+    skip_empty_masks,
+)
+from src.predictor.result_cache import ResultCache
+
+
+def make_cell(path, mask_value=0):
+    os.makedirs(path)
+    image = np.full((64, 96, 3), 128, dtype=np.uint8)
+    cv2.imwrite(os.path.join(path, "gm.png"), image)
+    cv2.imwrite(os.path.join(path, "osm.png"), image)
+    cv2.imwrite(
+        os.path.join(path, "osm_mask.png"), np.full((64, 96), mask_value, dtype=np.uint8)
+    )
+    return str(path)
+
+
+def run_once(data_dir, cell_dirs):
+    """One run of the cache and skip stages of run_prediction."""
+    cache = ResultCache(data_dir, REQUIRED_FILES, OUTPUT_FILES)
+    stale, current = cache.split(cell_dirs, "key")
+    remaining, skipped = skip_empty_masks(stale, min_mask_area=0.0)
+    cache.update(skipped, SKIPPED_OUTPUT_FILES)
+    return stale, current, remaining, skipped
+
+
+def test_skipped_cell_is_up_to_date_on_the_next_run(tmp_path):
+    cell = make_cell(tmp_path / "1")
+
+    stale, current, remaining, skipped = run_once(str(tmp_path), [cell])
+    assert (stale, current, remaining, skipped) == ([cell], [], [], [cell])
+    for name in SKIPPED_OUTPUT_FILES:
+        assert os.path.exists(os.path.join(cell, name))
+
+    stale, current, _, _ = run_once(str(tmp_path), [cell])
+    assert (stale, current) == ([], [cell])
+
+
+def test_skipping_removes_the_visualizations_of_an_earlier_prediction(tmp_path):
+    cell = make_cell(tmp_path / "1")
+    for name in ("visualization_gm.png", "visualization_osm.png"):
+        cv2.imwrite(os.path.join(cell, name), np.zeros((8, 8), dtype=np.uint8))
+
+    run_once(str(tmp_path), [cell])
+    assert not any(
+        os.path.exists(os.path.join(cell, name))
+        for name in ("visualization_gm.png", "visualization_osm.png")
+    )
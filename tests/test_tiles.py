@@ -0,0 +1,110 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import pytest
+
+from src.scraper.tiles import (
+    TILE_SIZE,
+    MBTilesCache,
+    TileFetcher,
+    TileMapScraper,
+    lonlat_to_pixel,
+)
+
+
+def tile_image(x, y):
+    """Tile whose pixels encode the tile and the position inside it."""
+    rows, cols = np.mgrid[0:TILE_SIZE, 0:TILE_SIZE]
+    image = np.empty((TILE_SIZE, TILE_SIZE, 3), dtype=np.uint8)
+    image[..., 0] = x % 251
+    image[..., 1] = y % 251
+    image[..., 2] = (rows + cols) % 256
+    return image
+
+
+def expected_pixels(window):
+    """Return the image a correct render of a global pixel window gives."""
+    x0, y0, x1, y1 = window
+    ys, xs = np.mgrid[y0:y1, x0:x1]
+    image = np.empty((y1 - y0, x1 - x0, 3), dtype=np.uint8)
+    image[..., 0] = (xs // TILE_SIZE) % 251
+    image[..., 1] = (ys // TILE_SIZE) % 251
+    image[..., 2] = (ys % TILE_SIZE + xs % TILE_SIZE) % 256
+    return image
+
+
+@pytest.fixture
+def tile_server():
+    """Local stand-in for an XYZ tile server, counting the requests per tile."""
+    requests_count = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            z, x, y = (int(v) for v in self.path.strip("/").removesuffix(".png").split("/"))
+            requests_count[(z, x, y)] = requests_count.get((z, x, y), 0) + 1
+            body = cv2.imencode(".png", tile_image(x, y))[1].tobytes()
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/{{z}}/{{x}}/{{y}}.png", requests_count
+    server.shutdown()
+    server.server_close()
+
+
+def make_scraper(url, cache_path):
+    fetcher = TileFetcher(
+        MBTilesCache(str(cache_path)),
+        url_template=url,
+        max_connections=4,
+        requests_per_second=None,
+    )
+    return TileMapScraper(fetcher, zoom=19, width=600, height=400)
+
+
+def test_scrape_is_centered_on_the_cell(tile_server, tmp_path):
+    url, _ = tile_server
+    scraper = make_scraper(url, tmp_path / "tiles.mbtiles")
+    cords = (52.2297, 21.0122)
+
+    path = tmp_path / "osm.png"
+    scraper.scrape(cords, str(path))
+    image = cv2.imread(str(path))
+
+    window = scraper.window(cords)
+    x, y = lonlat_to_pixel(cords[0], cords[1], scraper.zoom)
+    assert window[2] - window[0] == image.shape[1] == 600
+    assert window[3] - window[1] == image.shape[0] == 400
+    assert abs((window[0] + window[2]) / 2 - x) <= 1
+    assert abs((window[1] + window[3]) / 2 - y) <= 1
+    np.testing.assert_array_equal(image, expected_pixels(window))
+
+
+def test_tiles_are_downloaded_once_and_cached(tile_server, tmp_path):
+    url, requests_count = tile_server
+    cache_path = tmp_path / "tiles.mbtiles"
+    scraper = make_scraper(url, cache_path)
+    cells = [(52.2297, 21.0122), (52.2300, 21.0126)]
+
+    tiles = {tile for cords in cells for tile in scraper.tiles(cords)}
+    assert scraper.fetcher.prefetch(tiles, workers=4) == len(tiles)
+    for index, cords in enumerate(cells):
+        scraper.scrape(cords, str(tmp_path / f"{index}.png"))
+    assert set(requests_count) == tiles
+    assert all(count == 1 for count in requests_count.values())
+
+    # A new fetcher on the same MBTiles file does not hit the server again
+    cached = make_scraper(url, cache_path)
+    assert cached.fetcher.prefetch(tiles) == 0
+    cached.scrape(cells[0], str(tmp_path / "cached.png"))
+    assert sum(requests_count.values()) == len(tiles)